@@ -0,0 +1,335 @@
+"""Representation compacte d'une balance comptable (colonnes NumPy).
+
+Une balance est lue une seule fois depuis la feuille active du fichier importe:
+numeros de compte, intitules et les six colonnes de montants (soldes d'ouverture,
+mouvements et soldes de cloture, au debit et au credit). Les totaux, filtres par
+classe et recherches par prefixe de compte se font ensuite sans parcourir de
+cellules openpyxl.
+"""
+import itertools
+import re
+import unicodedata
+
+import numpy as np
+
+import ooxml
+
+AMOUNT_COLUMNS = (
+    "opening_debit",
+    "opening_credit",
+    "movement_debit",
+    "movement_credit",
+    "closing_debit",
+    "closing_credit",
+)
+
+# En-tetes utilises pour reecrire une balance dans une feuille (ordre des colonnes de 'BAL N')
+HEADERS = (
+    "Compte",
+    "Intitulé",
+    "Solde débit ouverture",
+    "Solde crédit ouverture",
+    "Mouvement débit",
+    "Mouvement crédit",
+    "Solde débit clôture",
+    "Solde crédit clôture",
+)
+
+# Colonnes de prefixes (longueur du prefixe du numero de compte) lues par les SOMME.SI du modele
+PREFIX_COLUMNS = ((10, 2), (11, 3), (12, 4), (13, 5), (14, 1))
+
+# Nombre de lignes parcourues pour trouver la ligne d'en-tete
+HEADER_SEARCH_ROWS = 30
+
+_OPENING_WORDS = ("ouverture", "debut", "initial", "anterieur", "report", "a nouveau", "reouverture")
+_MOVEMENT_WORDS = ("mouvement", "periode", "exercice", "mvt")
+_CLOSING_WORDS = ("cloture", "fin", "final", "solde")
+_ACCOUNT_RE = re.compile(r"^\d[\dA-Za-z]*$")
+
+
+def _normalize(text):
+    text = unicodedata.normalize("NFKD", str(text)).encode("ascii", "ignore").decode("ascii")
+    return " ".join(text.lower().replace("'", " ").replace("\u2019", " ").split())
+
+
+def _classify_header(text):
+    """Associe un libelle d'en-tete a un champ de la balance (ou None)"""
+    text = _normalize(text)
+    if not text:
+        return None
+    if "intitule" in text or "libelle" in text or "designation" in text:
+        return "label"
+    side = None
+    if "debit" in text:
+        side = "debit"
+    elif "credit" in text:
+        side = "credit"
+    if side is None:
+        if "compte" in text or text in ("n", "no", "numero", "num"):
+            return "account"
+        return None
+    if any(word in text for word in _OPENING_WORDS):
+        return "opening_" + side
+    if any(word in text for word in _MOVEMENT_WORDS):
+        return "movement_" + side
+    if any(word in text for word in _CLOSING_WORDS):
+        return "closing_" + side
+    return side
+
+
+def detect_layout(rows):
+    """Detecte la ligne d'en-tete et la position des colonnes dans les premieres lignes.
+
+    Retourne (index de la premiere ligne de donnees, dict champ -> index de colonne),
+    ou None si aucun en-tete de balance n'est reconnu.
+    """
+    parent = []
+    for index, row in enumerate(rows):
+        fields = [_classify_header(value) if value is not None else None for value in row]
+        if any(field and field not in ("account", "label") for field in fields):
+            # En-tetes sur deux lignes: "Solde d'ouverture" au-dessus de "Debit" / "Credit"
+            filled, last = [], None
+            for value in parent + [None] * (len(row) - len(parent)):
+                last = value if value is not None else last
+                filled.append(last)
+            layout = {}
+            sides = []
+            for column, (value, field) in enumerate(zip(row, fields)):
+                if field in ("debit", "credit"):
+                    combined = _classify_header("%s %s" % (filled[column] or "", value))
+                    field = combined if combined not in (None, "debit", "credit") else None
+                    if field is None:
+                        sides.append((column, _classify_header(value)))
+                        continue
+                if field and field not in layout:
+                    layout[field] = column
+            # Colonnes Debit/Credit sans precision: ouverture, mouvements puis cloture, dans l'ordre
+            missing = [f for f in AMOUNT_COLUMNS if f not in layout]
+            for column, side in sides:
+                field = next((f for f in missing if f.endswith(side)), None)
+                if field:
+                    layout[field] = column
+                    missing.remove(field)
+            # "Compte" / "Intitule" sur la ligne du dessus quand les en-tetes sont sur deux lignes
+            for column, value in enumerate(parent):
+                field = _classify_header(value) if value is not None else None
+                if field in ("account", "label") and field not in layout:
+                    layout[field] = column
+            layout.setdefault("account", 0)
+            return index + 1, layout
+        parent = list(row)
+    return None
+
+
+# Disposition par defaut des feuilles 'BAL N' du modele: A compte, B intitule, C a H montants
+DEFAULT_LAYOUT = dict(zip(("account", "label") + AMOUNT_COLUMNS, range(8)))
+
+# Empreinte d'une ligne absente du fichier
+EMPTY_ROW_HASH = ooxml.stable_hash(((), ()))
+
+
+def _to_amount(value):
+    if value is None:
+        return 0.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip().replace(" ", "").replace("\u00a0", "").replace("\u202f", "")
+    if not text:
+        return 0.0
+    if "," in text and "." in text:
+        # Le dernier separateur est le separateur decimal: 1.000,50 ou 1,000.50
+        if text.rfind(",") > text.rfind("."):
+            text = text.replace(".", "").replace(",", ".")
+        else:
+            text = text.replace(",", "")
+    else:
+        text = text.replace(",", ".")
+    try:
+        return float(text)
+    except ValueError:
+        return 0.0
+
+
+def _to_account(value):
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    text = str(value).strip()
+    return text if _ACCOUNT_RE.match(text) else None
+
+
+class Balance:
+    """Balance comptable stockee en colonnes typees"""
+
+    def __init__(self, accounts, labels, amounts):
+        accounts = [str(a) for a in accounts]
+        try:
+            self.accounts = np.array(accounts, dtype="S") if accounts else np.array([], dtype="S1")
+        except UnicodeEncodeError:
+            self.accounts = np.array(accounts, dtype="U")
+        # Intitules concatenes en un seul bloc utf-8 + positions
+        encoded = [str(label or "").encode("utf-8") for label in labels]
+        self._labels = b"".join(encoded)
+        self._label_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        if encoded:
+            np.cumsum([len(e) for e in encoded], out=self._label_offsets[1:])
+        self.amounts = {}
+        for name in AMOUNT_COLUMNS:
+            column = amounts.get(name)
+            self.amounts[name] = np.asarray(column, dtype=np.float64) if column is not None else np.zeros(len(accounts))
+        self._sorted = None
+        # Empreinte (valeurs + styles) de chaque ligne de la feuille source, index = numero de ligne - 1
+        self.row_hashes = None
+
+    @classmethod
+    def from_rows(cls, rows, layout=None):
+        """Construit la balance a partir d'un iterable de lignes (tuples de valeurs)"""
+        rows = iter(rows)
+        if layout is None:
+            head = []
+            for row in rows:
+                head.append(row)
+                if len(head) >= HEADER_SEARCH_ROWS:
+                    break
+            detected = detect_layout(head)
+            if detected is None:
+                start, layout = 0, DEFAULT_LAYOUT
+            else:
+                start, layout = detected
+            rows = _chain(head[start:], rows)
+
+        account_col = layout.get("account", 0)
+        label_col = layout.get("label")
+        amount_cols = [(name, layout.get(name)) for name in AMOUNT_COLUMNS]
+        accounts, labels = [], []
+        values = {name: [] for name in AMOUNT_COLUMNS}
+        for row in rows:
+            if account_col >= len(row):
+                continue
+            account = _to_account(row[account_col])
+            if account is None:
+                continue
+            accounts.append(account)
+            labels.append(row[label_col] if label_col is not None and label_col < len(row) else None)
+            for name, column in amount_cols:
+                values[name].append(_to_amount(row[column]) if column is not None and column < len(row) else 0.0)
+        balance = cls(accounts, labels, values)
+        balance.layout = layout
+        return balance
+
+    @classmethod
+    def from_xlsx(cls, source, detected=None):
+        """Lit la feuille active d'un fichier xlsx (chemin ou contenu) en un seul passage.
+
+        Le meme passage calcule l'empreinte de chaque ligne, qui sert a reintegrer
+        seulement les lignes modifiees quand le fichier est reimporte.
+        detected: en-tete deja detecte (resultat de detect_layout), qui n'est pas recherche a nouveau
+        """
+        hashes = []
+        ordered = [True]
+        # Styles compares par contenu: un reenregistrement peut renumeroter les styles
+        fingerprints = ooxml.style_fingerprints(source)
+
+        def rows():
+            for number, values, styles in ooxml.iter_sheet_cells(source, formulas=False):
+                if number <= len(hashes):
+                    # Lignes dans le desordre: pas d'empreintes exploitables
+                    ordered[0] = False
+                elif number > len(hashes) + 1:
+                    hashes.extend([EMPTY_ROW_HASH] * (number - 1 - len(hashes)))
+                hashes.append(ooxml.stable_hash((values, tuple(fingerprints[s] if s < len(fingerprints) else s for s in styles))))
+                yield values
+
+        if detected is None:
+            balance = cls.from_rows(rows())
+        else:
+            start, layout = detected
+            # Les lignes d'en-tete passent quand meme par rows(): leurs empreintes sont calculees
+            balance = cls.from_rows(itertools.islice(rows(), start, None), layout)
+        balance.row_hashes = np.array(hashes, dtype=np.int64) if ordered[0] else None
+        return balance
+
+    def __len__(self):
+        return len(self.accounts)
+
+    @property
+    def nbytes(self):
+        return (self.accounts.nbytes + len(self._labels) + self._label_offsets.nbytes
+                + sum(column.nbytes for column in self.amounts.values())
+                + (self.row_hashes.nbytes if self.row_hashes is not None else 0))
+
+    def account(self, index):
+        value = self.accounts[index]
+        return value.decode("utf-8") if isinstance(value, bytes) else str(value)
+
+    def label(self, index):
+        return self._labels[self._label_offsets[index]:self._label_offsets[index + 1]].decode("utf-8")
+
+    @property
+    def labels(self):
+        return [self.label(i) for i in range(len(self))]
+
+    def totals(self):
+        """Totaux de chaque colonne de montants"""
+        return {name: float(column.sum()) for name, column in self.amounts.items()}
+
+    def solde(self):
+        """Solde de cloture (debit - credit) de chaque compte"""
+        return self.amounts["closing_debit"] - self.amounts["closing_credit"]
+
+    def _prefix_mask(self, prefix):
+        prefix = str(prefix)
+        if self.accounts.dtype.kind == "S":
+            return np.char.startswith(self.accounts, prefix.encode("utf-8"))
+        return np.char.startswith(self.accounts, prefix)
+
+    def subset(self, indexes):
+        """Nouvelle balance restreinte aux lignes indiquees (masque booleen ou indices)"""
+        indexes = np.arange(len(self))[indexes]
+        balance = Balance.__new__(Balance)
+        balance.accounts = self.accounts[indexes]
+        labels = [self._labels[self._label_offsets[i]:self._label_offsets[i + 1]] for i in indexes]
+        balance._labels = b"".join(labels)
+        balance._label_offsets = np.zeros(len(labels) + 1, dtype=np.int64)
+        if labels:
+            np.cumsum([len(label) for label in labels], out=balance._label_offsets[1:])
+        balance.amounts = {name: column[indexes] for name, column in self.amounts.items()}
+        balance._sorted = None
+        balance.row_hashes = None
+        balance.layout = getattr(self, "layout", DEFAULT_LAYOUT)
+        return balance
+
+    def by_class(self, account_class):
+        """Comptes d'une classe du plan comptable (premier chiffre du numero)"""
+        return self.subset(self._prefix_mask(str(account_class)[:1]))
+
+    def _sorted_index(self):
+        if self._sorted is None:
+            order = np.argsort(self.accounts, kind="stable")
+            self._sorted = (order, self.accounts[order])
+        return self._sorted
+
+    def lookup(self, prefix):
+        """Indices des comptes commencant par le prefixe (recherche dichotomique sur l'index trie)"""
+        order, sorted_accounts = self._sorted_index()
+        key = str(prefix).encode("utf-8") if sorted_accounts.dtype.kind == "S" else str(prefix)
+        high_key = key + (b"\xff" if isinstance(key, bytes) else "\U0010ffff")
+        start = np.searchsorted(sorted_accounts, key, side="left")
+        end = np.searchsorted(sorted_accounts, high_key, side="left")
+        return np.sort(order[start:end])
+
+    def prefix_totals(self, prefix):
+        indexes = self.lookup(prefix)
+        return {name: float(column[indexes].sum()) for name, column in self.amounts.items()}
+
+    def iter_rows(self):
+        """Lignes (compte, intitule, montants...) dans l'ordre des colonnes de HEADERS"""
+        columns = [self.amounts[name] for name in AMOUNT_COLUMNS]
+        for i in range(len(self)):
+            yield (self.account(i), self.label(i)) + tuple(float(column[i]) for column in columns)
+
+
+def _chain(first, rest):
+    yield from first
+    yield from rest
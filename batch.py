@@ -0,0 +1,175 @@
+"""Integration en lot de dossiers clients, sans interface Streamlit.
+
+Le manifeste est un fichier CSV (separateur ',' ou ';') avec une ligne par dossier:
+
+    modele,balance_n,balance_n_1,sortie
+    modele 1,clients/dupont/bal_2024.xlsx,clients/dupont/bal_2023.xlsx,sorties/dupont.xlsx
+
+Les chemins relatifs sont resolus par rapport au dossier du manifeste. Les dossiers
+sont traites en parallele dans un pool de processus; chaque processus ne charge
+chaque modele qu'une seule fois.
+
+Usage: python batch.py manifeste.csv [--workers 4] [--engine ooxml] [--report rapport.json]
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from reporter import Reporter
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+MANIFEST_COLUMNS = ("modele", "balance_n", "balance_n_1", "sortie")
+
+
+def read_manifest(path):
+    """Lit le manifeste et retourne la liste des dossiers avec des chemins absolus"""
+    base_dir = os.path.dirname(os.path.abspath(path))
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        sample = f.read(4096)
+        f.seek(0)
+        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        reader = csv.DictReader(f, dialect=dialect)
+        missing = [c for c in MANIFEST_COLUMNS if c not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError("Colonnes manquantes dans le manifeste: %s" % ", ".join(missing))
+        dossiers = []
+        for line, row in enumerate(reader, start=2):
+            dossier = {"ligne": line, "modele": row["modele"].strip()}
+            for column in ("balance_n", "balance_n_1", "sortie"):
+                dossier[column] = os.path.normpath(os.path.join(base_dir, row[column].strip()))
+            dossiers.append(dossier)
+    return dossiers
+
+
+def _init_worker(template_paths, engine):
+    """Initialisation d'un processus: les modeles sont parses une fois pour tous ses dossiers"""
+    os.chdir(APP_DIR)
+    if APP_DIR not in sys.path:
+        sys.path.insert(0, APP_DIR)
+    from config import ENGINE_OPENPYXL
+    from cache import template_cache
+
+    if engine == ENGINE_OPENPYXL:
+        for path in template_paths:
+            template_cache.get(path)
+
+
+def integrate_dossier(dossier, engine):
+    """Integre un dossier et retourne son compte rendu (statut, durees par etape, messages)"""
+    from catalog import catalog
+    from config import Config
+
+    reporter = Reporter()
+    timings = {}
+    result = dict(dossier, statut="erreur", durees=timings)
+    start = time.perf_counter()
+
+    def step(name, action):
+        step_start = time.perf_counter()
+        ok = action()
+        timings[name] = round(time.perf_counter() - step_start, 4)
+        return ok
+
+    try:
+        config = Config()
+        config.integration_engine = engine
+        model = catalog.get(dossier["modele"])
+        if model is None:
+            reporter.error("Modèle inconnu: %s" % dossier["modele"])
+        else:
+            template_path = catalog.template_path(model)
+            ok = step("modele", lambda: config.load_excel(reporter, template_path))
+            ok = ok and step("balances", lambda: config.load_excel(reporter, dossier["balance_n"], 2)
+                             and config.load_excel(reporter, dossier["balance_n_1"], 3))
+            ok = ok and step("integration", lambda: config.add_balances_to_modele(reporter))
+            data = step("export", lambda: config.get_excel_file_download(reporter)) if ok else None
+            if data:
+                os.makedirs(os.path.dirname(dossier["sortie"]) or ".", exist_ok=True)
+                with open(dossier["sortie"], "wb") as f:
+                    f.write(data)
+                result["statut"] = "ok"
+                result["taille"] = len(data)
+    except Exception as e:
+        reporter.error("%s: %s" % (type(e).__name__, e))
+
+    timings["total"] = round(time.perf_counter() - start, 4)
+    result["messages"] = reporter.messages
+    result["erreurs"] = reporter.errors
+    result["pid"] = os.getpid()
+    return result
+
+
+def run_batch(dossiers, workers=None, engine=None):
+    """Traite les dossiers dans un pool de processus et retourne les comptes rendus dans l'ordre du manifeste"""
+    sys.path.insert(0, APP_DIR)
+    cwd = os.getcwd()
+    os.chdir(APP_DIR)
+    try:
+        # Catalogue charge depuis le dossier de l'application (chemins absolus ensuite)
+        from catalog import catalog
+        from config import ENGINE_OOXML
+        models = [catalog.get(d["modele"]) for d in dossiers]
+    finally:
+        os.chdir(cwd)
+
+    engine = engine or ENGINE_OOXML
+    template_paths = sorted({catalog.template_path(model) for model in models if model is not None})
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(template_paths, engine)) as pool:
+        futures = {pool.submit(integrate_dossier, dossier, engine): dossier for dossier in dossiers}
+        for future in as_completed(futures):
+            dossier = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = dict(dossier, statut="erreur", erreurs=["%s: %s" % (type(e).__name__, e)], durees={})
+            results.append(result)
+            print("[%s] ligne %d -> %s (%.2fs)%s" % (
+                result["statut"], dossier["ligne"], dossier["sortie"], result["durees"].get("total", 0),
+                "" if result["statut"] == "ok" else " " + "; ".join(result["erreurs"])))
+    return sorted(results, key=lambda r: r["ligne"])
+
+
+def summarize(results, wall_time, workers, engine):
+    succeeded = [r for r in results if r["statut"] == "ok"]
+    totals = [r["durees"].get("total", 0) for r in results]
+    return {
+        "dossiers": len(results),
+        "reussis": len(succeeded),
+        "echecs": len(results) - len(succeeded),
+        "moteur": engine,
+        "processus": workers,
+        "duree_totale": round(wall_time, 3),
+        "duree_moyenne_par_dossier": round(sum(totals) / len(totals), 3) if totals else 0,
+        "resultats": results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Intégration en lot des balances N et N-1 dans les modèles")
+    parser.add_argument("manifest", help="fichier CSV: modele, balance_n, balance_n_1, sortie")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="nombre de processus (défaut: nombre de coeurs)")
+    parser.add_argument("--engine", choices=("ooxml", "openpyxl"), default="ooxml", help="moteur d'intégration")
+    parser.add_argument("--report", help="rapport JSON (défaut: <manifeste>.rapport.json)")
+    args = parser.parse_args(argv)
+
+    dossiers = read_manifest(args.manifest)
+    start = time.perf_counter()
+    results = run_batch(dossiers, workers=args.workers, engine=args.engine)
+    summary = summarize(results, time.perf_counter() - start, args.workers, args.engine)
+
+    report = args.report or os.path.splitext(args.manifest)[0] + ".rapport.json"
+    with open(report, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    print("%d/%d dossiers intégrés en %.2fs (rapport: %s)" % (summary["reussis"], summary["dossiers"], summary["duree_totale"], report))
+    return 0 if summary["echecs"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
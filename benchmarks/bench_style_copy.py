@@ -0,0 +1,40 @@
+"""Compare la copie de styles attribut par attribut et la copie par index de styles.
+
+Usage: python benchmarks/bench_style_copy.py [nombre_de_lignes ...]
+"""
+import os
+import sys
+import time
+import warnings
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from openpyxl import Workbook, load_workbook
+
+import synthetic
+from config import Config, STYLE_COPY_ATTRIBUTES, STYLE_COPY_INTERNED
+from reporter import Reporter
+
+
+def run(rows):
+    source = load_workbook(synthetic.get_balance(rows))
+    timings = {}
+    for mode in (STYLE_COPY_ATTRIBUTES, STYLE_COPY_INTERNED):
+        config = Config()
+        config.style_copy_mode = mode
+        target_wb = Workbook()
+        target = target_wb.create_sheet("BAL N")
+        start = time.perf_counter()
+        config._copy_worksheet_with_styles(Reporter(), source.active, target)
+        timings[mode] = time.perf_counter() - start
+    speedup = timings[STYLE_COPY_ATTRIBUTES] / timings[STYLE_COPY_INTERNED]
+    print("%8d lignes  attributs: %7.3fs  index: %7.3fs  gain: x%.1f"
+          % (rows, timings[STYLE_COPY_ATTRIBUTES], timings[STYLE_COPY_INTERNED], speedup))
+
+
+if __name__ == "__main__":
+    warnings.simplefilter("ignore")
+    for rows in [int(arg) for arg in sys.argv[1:]] or [1000, 10000, 50000]:
+        run(rows)
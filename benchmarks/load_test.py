@@ -0,0 +1,317 @@
+"""Test de charge: plusieurs sessions simultanees de l'application Streamlit.
+
+Chaque session est un AppTest (streamlit.testing) qui execute main.py dans le
+processus courant, comme les sessions d'un meme serveur: les caches partages
+(modeles, balances, exports), l'ordonnanceur des integrations et le gestionnaire
+de memoire des sessions sont donc les memes pour toutes. Les sessions tournent
+dans des threads et suivent le parcours d'un utilisateur:
+
+    accueil -> choix du modele -> import des balances N et N-1
+            -> integration (tache de fond) -> telechargement
+
+AppTest remplace le runtime Streamlit global a chaque rerun: les reruns des
+sessions sont donc executes un a la fois (l'attente est mesuree a part), alors
+que les integrations tournent en parallele dans l'ordonnanceur, comme sur le
+serveur.
+
+Le temps de chaque rerun du script est mesure (p50/p95 par etape et au total),
+ainsi que le debit des integrations (lignes de balances par seconde), la memoire
+de chaque session (Config.memory_size) et le RSS du processus. Par defaut chaque
+session importe ses propres balances synthetiques (--same-files: meme fichier
+pour toutes, le cache des balances sert alors entre les sessions).
+
+Usage: python benchmarks/load_test.py [--sessions 4] [--rows 10000] [--ramp 0.5]
+                                      [--engine ooxml] [--output results/charge.json]
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import sys
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Les fichiers exportes ne sont pas gardes sur disque: chaque session refait tout le travail
+os.environ.setdefault("COMPTALANCE_EXPORT_CACHE_DIR", "")
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import synthetic
+
+APP_SCRIPT = os.path.join(APP_DIR, "main.py")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+NAVIGATION = "Choisir une section:"
+PAGE_HOME = "🏠 Accueil"
+PAGE_MODELS = "📁 Choisir un model"
+PAGE_IMPORT = "📤 Importer les balances"
+ENGINE_LABELS = {"ooxml": "Rapide (fusion des fichiers xlsx)", "openpyxl": "Standard (copie cellule par cellule)"}
+
+# Un seul rerun AppTest a la fois (runtime Streamlit global, voir plus haut)
+_RERUN_LOCK = threading.Lock()
+
+
+def _rss():
+    """RSS courant du processus en octets (Linux), sinon None"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _max_rss():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _percentile(values, percent):
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[percent - 1]
+
+
+class Session:
+    """Parcours d'un utilisateur, chaque rerun chronometre"""
+
+    def __init__(self, number, balances, model, engine, timeout, poll):
+        self.number = number
+        self.balances = balances
+        self.model = model
+        self.engine = engine
+        self.timeout = timeout
+        self.poll = poll
+        self.reruns = []
+        self.waits = []
+        self.integration = None
+        self.rows = 0
+        self.memory = None
+        self.export_size = None
+        self.error = None
+
+    def _run(self, step, action):
+        queued = time.perf_counter()
+        with _RERUN_LOCK:
+            start = time.perf_counter()
+            self.at = action()
+            self.reruns.append((step, time.perf_counter() - start))
+        self.waits.append(start - queued)
+        if self.at.exception:
+            raise RuntimeError("%s: %s" % (step, self.at.exception[0].message))
+        return self.at
+
+    def _widget(self, kind, label):
+        return next(w for w in getattr(self.at, kind) if w.label == label)
+
+    def _navigate(self, page):
+        return self._run("navigation", lambda: self._widget("selectbox", NAVIGATION).select(page).run())
+
+    def run(self):
+        from streamlit.testing.v1 import AppTest
+
+        try:
+            self.at = AppTest.from_file(APP_SCRIPT, default_timeout=self.timeout)
+            self._run("accueil", lambda: self.at.run())
+            self._navigate(PAGE_MODELS)
+            if self.model:
+                self._run("choix_modele", lambda: self.at.radio[0].set_value(self.model).run())
+            self._navigate(PAGE_IMPORT)
+            for label, (name, data) in zip(("Fichier balance année courante (N):", "Fichier balance année précédente (N-1):"),
+                                           self.balances):
+                self._run("import_balance", lambda: self._widget("file_uploader", label).set_value((name, data, XLSX_MIME)).run())
+            config = self.at.session_state["config"]
+            if not (config.model_balances_["baln"] and config.model_balances_["baln_1"]):
+                raise RuntimeError("balances non chargées")
+            self.rows = len(config.baln_balance) + len(config.baln_1_balance)
+
+            self._navigate(PAGE_HOME)
+            self._run("moteur", lambda: self._widget("radio", "Moteur d'intégration").set_value(ENGINE_LABELS[self.engine]).run())
+            start = time.perf_counter()
+            self._run("integration", lambda: self._widget("button", "🔄 Intégrer les balances au modèle").click().run())
+            deadline = start + self.timeout
+            # Le fragment d'avancement ne se relance pas seul sous AppTest: attente de la tache puis rerun
+            while config.integration_job is not None and not config.integration_job.finished:
+                if time.perf_counter() > deadline:
+                    raise RuntimeError("intégration non terminée après %ss" % self.timeout)
+                time.sleep(self.poll)
+            self._run("fin_integration", lambda: self.at.run())
+            self.integration = time.perf_counter() - start
+            if not config.isIntegrated or not self.at.get("download_button"):
+                raise RuntimeError("intégration sans fichier à télécharger")
+            self.export_size = len(config.excel_data)
+            self.memory = config.memory_size()
+        except Exception as e:
+            self.error = "%s: %s" % (type(e).__name__, e)
+        return self
+
+
+def _balances(rows, sessions, same_files):
+    """(nom, contenu) des balances N et N-1 de chaque session"""
+    files = []
+    for i in range(sessions):
+        seeds = (0, 1) if same_files else (2 * i, 2 * i + 1)
+        pair = []
+        for seed in seeds:
+            path = synthetic.get_balance(rows, seed)
+            with open(path, "rb") as f:
+                pair.append((os.path.basename(path), f.read()))
+        files.append(pair)
+    return files
+
+
+def run_load_test(sessions, rows, engine="ooxml", ramp=0.0, same_files=False, model=None, timeout=600, poll=0.2):
+    # Chemins relatifs de l'application (catalogue, modeles) resolus depuis son dossier
+    os.chdir(APP_DIR)
+    import jobs
+    import sessions as session_memory
+    from cache import balance_cache, export_cache, template_cache
+
+    files = _balances(rows, sessions, same_files)
+    rss_before = _rss()
+    peak_rss = [rss_before]
+    done = threading.Event()
+
+    def sample():
+        # RSS releve pendant le test: pic des sessions simultanees
+        while not done.wait(0.1):
+            peak_rss.append(_rss())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        futures = []
+        for i in range(sessions):
+            futures.append(pool.submit(Session(i, files[i], model, engine, timeout, poll).run))
+            if ramp:
+                time.sleep(ramp)
+        results = [future.result() for future in futures]
+    elapsed = time.perf_counter() - start
+    done.set()
+    sampler.join()
+    rss_after = _rss()
+
+    ok = [s for s in results if s.error is None]
+    durations = [d for s in results for _, d in s.reruns]
+    waits = [w for s in results for w in s.waits]
+    steps = {}
+    for s in results:
+        for step, duration in s.reruns:
+            steps.setdefault(step, []).append(duration)
+    integrations = [s.integration for s in ok]
+    peak = max((value for value in peak_rss if value is not None), default=None)
+    return {
+        "sessions": sessions,
+        "lignes": rows,
+        "moteur": engine,
+        "fichiers_identiques": same_files,
+        "duree": elapsed,
+        "erreurs": [{"session": s.number, "erreur": s.error} for s in results if s.error],
+        "reruns": {
+            "nombre": len(durations),
+            "p50": _percentile(durations, 50),
+            "p95": _percentile(durations, 95),
+            "max": max(durations, default=None),
+            "attente_p50": _percentile(waits, 50),
+            "attente_p95": _percentile(waits, 95),
+        },
+        "etapes": {step: {"nombre": len(values), "p50": _percentile(values, 50), "p95": _percentile(values, 95)}
+                   for step, values in steps.items()},
+        "integration": {
+            "p50": _percentile(integrations, 50),
+            "p95": _percentile(integrations, 95),
+            # Lignes des balances N et N-1 integrees par seconde: par session et pour tout le serveur
+            "lignes_par_seconde": statistics.median(s.rows / s.integration for s in ok) if ok else None,
+            "lignes_par_seconde_total": sum(s.rows for s in ok) / elapsed if ok else None,
+        },
+        "memoire": {
+            "session_p50": _percentile([s.memory for s in ok], 50),
+            "session_max": max((s.memory for s in ok), default=None),
+            "rss_avant": rss_before,
+            "rss_apres": rss_after,
+            "rss_pic": peak,
+            "rss_pic_processus": _max_rss(),
+            "rss_par_session": (peak - rss_before) / sessions if peak is not None and rss_before is not None else None,
+        },
+        "caches": {
+            "modeles": template_cache.stats(),
+            "balances": balance_cache.stats(),
+            "exports": export_cache.stats(),
+            "sessions": session_memory.manager.stats(),
+            "integrations": jobs.scheduler.stats(),
+        },
+    }
+
+
+def _ms(value):
+    return "-" if value is None else "%.0f ms" % (value * 1000)
+
+
+def _mb(value):
+    return "-" if value is None else "%.0f Mo" % (value / 1024 / 1024)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Test de charge: sessions simultanées de l'application")
+    parser.add_argument("--sessions", type=int, default=4, help="nombre de sessions simultanées")
+    parser.add_argument("--rows", type=int, default=10000, help="nombre de comptes des balances importées")
+    parser.add_argument("--engine", choices=list(ENGINE_LABELS), default="ooxml", help="moteur d'intégration")
+    parser.add_argument("--ramp", type=float, default=0.0, help="délai (s) entre les démarrages de deux sessions")
+    parser.add_argument("--same-files", action="store_true", help="mêmes balances pour toutes les sessions")
+    parser.add_argument("--model", help="nom du modèle choisi (défaut: premier du catalogue)")
+    parser.add_argument("--timeout", type=float, default=600, help="durée maximale (s) d'un rerun et d'une intégration")
+    parser.add_argument("--output", help="fichier JSON des résultats (défaut: benchmarks/results/charge-<date>.json)")
+    args = parser.parse_args(argv)
+
+    warnings.simplefilter("ignore")
+    result = run_load_test(args.sessions, args.rows, args.engine, args.ramp, args.same_files, args.model, args.timeout)
+
+    reruns, integration, memory = result["reruns"], result["integration"], result["memoire"]
+    print("%d sessions, balances de %d comptes, moteur %s: %.1fs" % (args.sessions, args.rows, args.engine, result["duree"]))
+    print("reruns       %5d  p50 %9s  p95 %9s  max %9s  attente p50 %s p95 %s" % (
+        reruns["nombre"], _ms(reruns["p50"]), _ms(reruns["p95"]), _ms(reruns["max"]),
+        _ms(reruns["attente_p50"]), _ms(reruns["attente_p95"])))
+    for step, values in result["etapes"].items():
+        print("  %-16s %5d  p50 %9s  p95 %9s" % (step, values["nombre"], _ms(values["p50"]), _ms(values["p95"])))
+    if integration["p50"] is not None:
+        print("intégration  p50 %.2fs  p95 %.2fs  %.0f lignes/s par session, %.0f lignes/s au total" % (
+            integration["p50"], integration["p95"], integration["lignes_par_seconde"], integration["lignes_par_seconde_total"]))
+    print("mémoire      session p50 %s  max %s  RSS %s -> pic %s (%s par session)" % (
+        _mb(memory["session_p50"]), _mb(memory["session_max"]), _mb(memory["rss_avant"]), _mb(memory["rss_pic"]),
+        _mb(memory["rss_par_session"])))
+    for error in result["erreurs"]:
+        print("ERREUR session %d: %s" % (error["session"], error["erreur"]))
+
+    output = args.output or os.path.join(RESULTS_DIR, "charge-" + datetime.datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "machine": platform.platform(),
+            "python": platform.python_version(),
+            "processeurs": os.cpu_count(),
+            "resultats": result,
+        }, f, ensure_ascii=False, indent=2)
+    print("Résultats: %s" % output)
+    return 1 if result["erreurs"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,220 @@
+"""Cout d'execution du script main.py par page (rerun Streamlit).
+
+Chaque interaction relance tout main.py: ce rapport mesure ce que coute ce
+rerun sur chaque page de la navigation, via AppTest (streamlit.testing), sans
+navigateur ni serveur. Seule l'execution du script est chronometree (le
+ScriptRunner est enveloppe), pas le travail d'AppTest autour.
+
+    demarrage a froid  premier run dans un processus neuf (imports de
+                       l'application, chargement du modele), par page: un
+                       sous-processus par mesure; modules lourds deja importes
+                       (openpyxl, PIL, numpy) a la fin du run, puis attente du
+                       modele parse et de ses formules (ce que paie la
+                       premiere integration)
+    rerun a chaud      reruns repetes de la meme page dans une session (p50/p95)
+
+--warmup mesure les demarrages a froid d'un serveur prechauffe (warmup.py).
+--baseline compare avec un rapport precedent (par exemple mesure avant une
+modification): ecart en ms et en % pour chaque page.
+
+Usage: python benchmarks/rerun_cost.py [--reruns 20] [--cold 3] [--warmup] [--baseline results/reruns-avant.json]
+                                       [--output results/reruns.json]
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import warnings
+
+os.environ.setdefault("COMPTALANCE_EXPORT_CACHE_DIR", "")
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCH_DIR)
+APP_SCRIPT = os.path.join(APP_DIR, "main.py")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+NAVIGATION = "Choisir une section:"
+PAGES = {"accueil": "🏠 Accueil", "modeles": "📁 Choisir un model", "import": "📤 Importer les balances"}
+
+# Modules dont l'import est couteux: presents ou non apres le premier run
+HEAVY_MODULES = ("openpyxl", "PIL", "numpy")
+
+
+def _percentile(values, percent):
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[percent - 1]
+
+
+# Duree d'execution du corps de main.py au dernier run (sans le travail d'AppTest autour)
+_script = {"duree": None}
+
+
+def _time_script():
+    """Chronometre l'execution du script: enveloppe la fonction du ScriptRunner qui l'appelle"""
+    from streamlit.runtime.scriptrunner import script_runner
+
+    execute = script_runner.exec_func_with_error_handling
+    if getattr(execute, "timed", False):
+        return
+
+    def timed(func, ctx):
+        start = time.perf_counter()
+        try:
+            return execute(func, ctx)
+        finally:
+            _script["duree"] = time.perf_counter() - start
+
+    timed.timed = True
+    script_runner.exec_func_with_error_handling = timed
+
+
+def _session():
+    from streamlit.testing.v1 import AppTest
+
+    _time_script()
+    return AppTest.from_file(APP_SCRIPT, default_timeout=600)
+
+
+def _run(at):
+    """Duree du script pour un run de at (AppTest.run)"""
+    _script["duree"] = None
+    at.run()
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+    return _script["duree"]
+
+
+def _navigate(at, page):
+    if page != PAGES["accueil"]:
+        next(w for w in at.selectbox if w.label == NAVIGATION).select(page)
+    return _run(at)
+
+
+def cold_run(key, warm=False):
+    """Premier run de la page key dans ce processus (appele dans un sous-processus)"""
+    os.chdir(APP_DIR)
+    sys.path.insert(0, APP_DIR)
+    if warm:
+        # Comme "python warmup.py --serve": prechauffage termine avant la premiere session
+        import warmup
+
+        warmup.warm_up()
+    at = _session()
+    first = _run(at)
+    page = _navigate(at, PAGES[key]) if key != "accueil" else 0.0
+    # Attente du modele parse et de ses formules, payee par la premiere integration de la session
+    import calculation
+
+    template = at.session_state["config"].modele_template
+    start = time.perf_counter()
+    calculation.graph_for(template)
+    model = time.perf_counter() - start
+    return {
+        "premier_run": first,
+        "page": page,
+        "total": first + page,
+        "modele": model,
+        "modules_lourds": [name for name in HEAVY_MODULES if name in sys.modules],
+    }
+
+
+def measure_cold(key, repeat, warm=False):
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "--cold-child", key] + (["--warmup"] if warm else []),
+                                capture_output=True, text=True, check=True, cwd=APP_DIR)
+        runs.append(json.loads(output.stdout.strip().splitlines()[-1]))
+    return {
+        "total_p50": statistics.median(run["total"] for run in runs),
+        "premier_run_p50": statistics.median(run["premier_run"] for run in runs),
+        "modele_p50": statistics.median(run["modele"] for run in runs),
+        "modules_lourds": runs[-1]["modules_lourds"],
+    }
+
+
+def measure_warm(reruns):
+    os.chdir(APP_DIR)
+    sys.path.insert(0, APP_DIR)
+    at = _session()
+    _run(at)
+    result = {}
+    for key, page in PAGES.items():
+        _navigate(at, page)
+        durations = [_run(at) for _ in range(reruns)]
+        result[key] = {"p50": _percentile(durations, 50), "p95": _percentile(durations, 95), "min": min(durations)}
+    return result
+
+
+def run_report(reruns=20, cold=3, warm=False):
+    return {
+        "froid": {key: measure_cold(key, cold, warm) for key in PAGES} if cold else {},
+        "chaud": measure_warm(reruns),
+    }
+
+
+def _ms(value):
+    return "-" if value is None else "%.1f ms" % (value * 1000)
+
+
+def _delta(value, before):
+    if value is None or not before:
+        return ""
+    return "  (%+.1f ms, %+.0f%%)" % ((value - before) * 1000, (value / before - 1) * 100)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Coût d'un rerun de main.py par page")
+    parser.add_argument("--reruns", type=int, default=20, help="reruns mesurés par page (à chaud)")
+    parser.add_argument("--cold", type=int, default=3, help="démarrages à froid par page (0: non mesuré)")
+    parser.add_argument("--warmup", action="store_true", help="serveur préchauffé (python warmup.py --serve)")
+    parser.add_argument("--baseline", help="rapport JSON précédent à comparer")
+    parser.add_argument("--output", help="fichier JSON des résultats (défaut: benchmarks/results/reruns-<date>.json)")
+    parser.add_argument("--cold-child", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    warnings.simplefilter("ignore")
+    if args.cold_child:
+        print(json.dumps(cold_run(args.cold_child, args.warmup)))
+        return 0
+
+    result = run_report(args.reruns, args.cold, args.warmup)
+    before = {}
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            before = json.load(f)["resultats"]
+
+    for key in PAGES:
+        warm = result["chaud"][key]
+        previous = before.get("chaud", {}).get(key, {})
+        print("%-9s rerun   p50 %9s  p95 %9s%s" % (key, _ms(warm["p50"]), _ms(warm["p95"]), _delta(warm["p50"], previous.get("p50"))))
+        if key in result["froid"]:
+            cold = result["froid"][key]
+            previous = before.get("froid", {}).get(key, {})
+            print("%-9s froid   %9s  modules lourds: %s%s" % ("", _ms(cold["total_p50"]), ", ".join(cold["modules_lourds"]) or "aucun",
+                                                          _delta(cold["total_p50"], previous.get("total_p50"))))
+            print("%-9s modele  %9s%s" % ("", _ms(cold["modele_p50"]), _delta(cold["modele_p50"], previous.get("modele_p50"))))
+
+    output = args.output or os.path.join(RESULTS_DIR, "reruns-" + datetime.datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "machine": platform.platform(),
+            "python": platform.python_version(),
+            "processeurs": os.cpu_count(),
+            "reruns": args.reruns,
+            "prechauffage": args.warmup,
+            "resultats": result,
+        }, f, ensure_ascii=False, indent=2)
+    print("Résultats: %s" % output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
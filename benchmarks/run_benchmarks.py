@@ -0,0 +1,271 @@
+"""Mesure le cout des etapes d'integration sur des balances synthetiques.
+
+Chaque etape est executee dans un processus neuf (caches vides) contre
+models_excel/model_1.xlsx et mesuree en temps reel, temps CPU et pic de memoire
+(RSS du processus et tracemalloc). Le pic tracemalloc est mesure dans une
+seconde execution, pour ne pas fausser les temps.
+
+Les resultats sont ecrits en JSON dans benchmarks/results/. Avec --baseline,
+le script compare les temps a un run precedent et sort en erreur si une etape
+ralentit de plus de --threshold pourcent.
+
+Usage: python benchmarks/run_benchmarks.py [--sizes 1000 10000] [--stages load_balance_full ...]
+                                           [--baseline results/precedent.json] [--threshold 20]
+"""
+import argparse
+import datetime
+import gc
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Les fichiers exportes ne sont pas gardes sur disque: chaque mesure refait tout le travail
+os.environ.setdefault("COMPTALANCE_EXPORT_CACHE_DIR", "")
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import synthetic
+
+TEMPLATE = os.path.join("models_excel", "model_1.xlsx")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+DEFAULT_SIZES = (1000, 10000, 100000, 500000)
+
+# Taille maximale des etapes cellule par cellule (plusieurs minutes et Go au-dela), levee par --no-limit
+STAGE_MAX_ROWS = {
+    "copy_styles_attributes": 10000,
+    "integrate_openpyxl": 100000,
+    "export_openpyxl": 100000,
+}
+
+
+def _max_rss():
+    """Pic RSS du processus en octets"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _check(reporter, ok=True):
+    if reporter.errors or not ok:
+        raise RuntimeError("; ".join(reporter.errors) or "l'etape a echoue")
+
+
+def _load(reporter, rows, engine=None, ingestion=None):
+    from config import Config
+
+    config = Config()
+    if engine:
+        config.integration_engine = engine
+    if ingestion:
+        config.ingestion_mode = ingestion
+    _check(reporter, config.load_excel(reporter, TEMPLATE))
+    _check(reporter, config.load_excel(reporter, synthetic.balance_path(rows, 0), 2))
+    _check(reporter, config.load_excel(reporter, synthetic.balance_path(rows, 1), 3))
+    return config
+
+
+# Chaque etape: fonction de preparation (non mesuree) qui retourne la fonction mesuree
+
+def _stage_load_modele(reporter, rows):
+    from config import Config
+
+    config = Config()
+    return lambda: _check(reporter, config.load_excel(reporter, TEMPLATE) and config.modele_wb is not None)
+
+
+def _stage_load_balance(ingestion):
+    def prepare(reporter, rows):
+        from config import Config
+
+        config = Config()
+        config.ingestion_mode = ingestion
+        return lambda: _check(reporter, config.load_excel(reporter, synthetic.balance_path(rows, 0), 2))
+    return prepare
+
+
+def _stage_copy_styles(mode):
+    def prepare(reporter, rows):
+        from openpyxl import Workbook, load_workbook
+        from config import Config
+
+        config = Config()
+        config.style_copy_mode = mode
+        source = load_workbook(synthetic.balance_path(rows, 0)).active
+        target = Workbook().create_sheet("BAL N")
+        return lambda: config._copy_worksheet_with_styles(reporter, source, target)
+    return prepare
+
+
+def _stage_integrate(engine, ingestion):
+    def prepare(reporter, rows):
+        config = _load(reporter, rows, engine, ingestion)
+        if engine != "ooxml":
+            config.modele_wb  # modele parse pendant la preparation
+        return lambda: _check(reporter, config.add_balances_to_modele(reporter))
+    return prepare
+
+
+def _stage_export(engine, ingestion):
+    def prepare(reporter, rows):
+        config = _load(reporter, rows, engine, ingestion)
+        _check(reporter, config.add_balances_to_modele(reporter))
+        return lambda: _check(reporter, config.get_excel_file_download(reporter) is not None)
+    return prepare
+
+
+STAGES = {
+    "load_modele": _stage_load_modele,
+    "load_balance_full": _stage_load_balance("full"),
+    "load_balance_streaming": _stage_load_balance("streaming"),
+    "copy_styles_attributes": _stage_copy_styles("attributes"),
+    "copy_styles_interned": _stage_copy_styles("interned"),
+    "integrate_ooxml": _stage_integrate("ooxml", "streaming"),
+    "integrate_openpyxl": _stage_integrate("openpyxl", "full"),
+    "export_ooxml": _stage_export("ooxml", "streaming"),
+    "export_openpyxl": _stage_export("openpyxl", "full"),
+}
+
+
+def _measure(stage, rows, trace):
+    """Execute une etape dans le processus courant (processus neuf fourni par le pool)"""
+    from reporter import Reporter
+
+    os.chdir(APP_DIR)
+    warnings.simplefilter("ignore")
+    reporter = Reporter()
+    action = STAGES[stage](reporter, rows)
+    gc.collect()
+    rss_before = _max_rss()
+    if trace:
+        tracemalloc.start()
+        action()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return {"tracemalloc_peak": peak}
+    wall, cpu = time.perf_counter(), time.process_time()
+    action()
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    rss_after = _max_rss()
+    return {
+        "wall": wall,
+        "cpu": cpu,
+        "peak_rss": rss_after,
+        "rss_increase": None if rss_after is None else rss_after - rss_before,
+    }
+
+
+def _run_isolated(stage, rows, trace):
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(_measure, stage, rows, trace).result()
+
+
+def run_stage(stage, rows, repeat=1, trace=True):
+    runs = [_run_isolated(stage, rows, False) for _ in range(repeat)]
+    result = {
+        "wall": statistics.median(r["wall"] for r in runs),
+        "cpu": statistics.median(r["cpu"] for r in runs),
+        "peak_rss": max((r["peak_rss"] for r in runs if r["peak_rss"] is not None), default=None),
+        "rss_increase": max((r["rss_increase"] for r in runs if r["rss_increase"] is not None), default=None),
+        "repetitions": repeat,
+    }
+    if trace:
+        result.update(_run_isolated(stage, rows, True))
+    return result
+
+
+def compare(results, baseline, threshold, min_time):
+    """Liste des etapes dont le temps reel depasse celui de la reference de plus de threshold %"""
+    regressions = []
+    for stage, sizes in results.items():
+        for size, current in sizes.items():
+            previous = baseline.get(stage, {}).get(size)
+            if not previous or "wall" not in previous or "wall" not in current:
+                continue
+            if max(previous["wall"], current["wall"]) < min_time:
+                continue  # trop court pour etre significatif
+            change = (current["wall"] - previous["wall"]) / previous["wall"] * 100
+            if change > threshold:
+                regressions.append((stage, size, previous["wall"], current["wall"], change))
+    return regressions
+
+
+def _mb(value):
+    return "-" if value is None else "%.0f Mo" % (value / 1024 / 1024)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks des étapes de chargement, copie et export")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="nombre de comptes des balances")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES), help="étapes mesurées")
+    parser.add_argument("--repeat", type=int, default=1, help="exécutions par mesure (médiane retenue)")
+    parser.add_argument("--no-limit", action="store_true", help="mesurer les étapes cellule par cellule à toutes les tailles")
+    parser.add_argument("--no-tracemalloc", action="store_true", help="ne pas mesurer le pic tracemalloc")
+    parser.add_argument("--output", help="fichier JSON des résultats (défaut: benchmarks/results/<date>.json)")
+    parser.add_argument("--baseline", help="résultats JSON de référence")
+    parser.add_argument("--threshold", type=float, default=20.0, help="ralentissement toléré en pourcent")
+    parser.add_argument("--min-time", type=float, default=0.05, help="durée (s) en dessous de laquelle une étape n'est pas comparée")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for rows in args.sizes:
+        for seed in (0, 1):
+            synthetic.get_balance(rows, seed)
+        for stage in args.stages:
+            if not args.no_limit and rows > STAGE_MAX_ROWS.get(stage, rows):
+                continue
+            try:
+                result = run_stage(stage, rows, args.repeat, not args.no_tracemalloc)
+            except Exception as e:
+                result = {"erreur": "%s: %s" % (type(e).__name__, e)}
+            results.setdefault(stage, {})[str(rows)] = result
+            if "erreur" in result:
+                print("%-24s %8d  ERREUR %s" % (stage, rows, result["erreur"]))
+            else:
+                print("%-24s %8d  %8.3fs  cpu %8.3fs  rss %9s  tracemalloc %9s" % (
+                    stage, rows, result["wall"], result["cpu"], _mb(result["peak_rss"]),
+                    _mb(result.get("tracemalloc_peak"))))
+
+    output = args.output or os.path.join(RESULTS_DIR, datetime.datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "machine": platform.platform(),
+            "python": platform.python_version(),
+            "processeurs": os.cpu_count(),
+            "modele": TEMPLATE,
+            "resultats": results,
+        }, f, ensure_ascii=False, indent=2)
+    print("Résultats: %s" % output)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["resultats"]
+        regressions = compare(results, baseline, args.threshold, args.min_time)
+        for stage, size, before, after, change in regressions:
+            print("REGRESSION %s (%s lignes): %.3fs -> %.3fs (+%.0f%%)" % (stage, size, before, after, change))
+        if regressions:
+            return 1
+        print("Aucune régression au-delà de %.0f%%" % args.threshold)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
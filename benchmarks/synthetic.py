@@ -0,0 +1,205 @@
+"""Generateur de balances synthetiques realistes pour les benchmarks.
+
+Les balances ressemblent aux exports des logiciels comptables: titre et en-tetes
+fusionnes sur deux lignes, comptes du plan SYSCOHADA, formats numeriques,
+bordures et remplissages alternes, mise en forme conditionnelle, validation de
+donnees et ligne de totaux. Les fichiers sont ecrits en mode write-only (les
+grandes tailles tiennent en memoire) et gardes dans benchmarks/.data/.
+
+Usage: python benchmarks/synthetic.py 1000 10000 ...
+"""
+import os
+import random
+import sys
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.formatting.rule import CellIsRule
+from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+from openpyxl.worksheet.datavalidation import DataValidation
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".data")
+
+# Ligne des premieres donnees: titre, societe, en-tetes sur deux lignes
+FIRST_DATA_ROW = 5
+
+AMOUNT_FORMAT = '#,##0.00;[Red]-#,##0.00;"-"'
+
+# Comptes de tete des classes SYSCOHADA et intitules correspondants
+_ACCOUNT_ROOTS = (
+    ("101", "Capital social"), ("106", "Réserves"), ("121", "Report à nouveau"),
+    ("162", "Emprunts auprès des établissements de crédit"), ("213", "Logiciels"),
+    ("231", "Bâtiments industriels"), ("241", "Matériel et outillage"), ("245", "Matériel de transport"),
+    ("281", "Amortissements des immobilisations"), ("311", "Marchandises"),
+    ("321", "Matières premières"), ("401", "Fournisseurs"), ("411", "Clients"),
+    ("421", "Personnel, avances et acomptes"), ("431", "Sécurité sociale"),
+    ("441", "Etat, impôt sur les bénéfices"), ("443", "Etat, TVA facturée"),
+    ("445", "Etat, TVA récupérable"), ("471", "Débiteurs et créditeurs divers"),
+    ("521", "Banques locales"), ("571", "Caisse siège social"), ("601", "Achats de marchandises"),
+    ("604", "Achats stockés de matières"), ("605", "Autres achats"), ("622", "Locations et charges locatives"),
+    ("624", "Entretien, réparations"), ("627", "Publicité"), ("631", "Frais bancaires"),
+    ("641", "Impôts et taxes directs"), ("661", "Rémunérations directes"),
+    ("664", "Charges sociales"), ("671", "Intérêts des emprunts"), ("681", "Dotations aux amortissements"),
+    ("701", "Ventes de marchandises"), ("706", "Services vendus"), ("707", "Produits accessoires"),
+    ("771", "Intérêts de prêts"), ("781", "Transferts de charges"),
+)
+
+_QUALIFIERS = ("", "Agence", "Siège", "Dakar", "Abidjan", "Douala", "Export", "Groupe", "Tiers")
+
+
+def balance_path(rows, seed=0):
+    return os.path.join(DATA_DIR, "balance_%d_%d.xlsx" % (rows, seed))
+
+
+def _accounts(rows, rng):
+    """Numeros de compte a 8 chiffres, uniques et tries comme dans un export comptable"""
+    accounts = set()
+    while len(accounts) < rows:
+        root, label = rng.choice(_ACCOUNT_ROOTS)
+        accounts.add((root + "%05d" % rng.randrange(100000), label))
+    return sorted(accounts)
+
+
+def generate_balance(path, rows, seed=0):
+    """Ecrit une balance de `rows` comptes dans `path`"""
+    rng = random.Random(seed)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Balance")
+
+    thin = Side(style="thin", color="999999")
+    header_fill = PatternFill("solid", fgColor="1F4E78")
+    band_fill = PatternFill("solid", fgColor="EEF3F8")
+    header_font = Font(bold=True, color="FFFFFF")
+    centered = Alignment(horizontal="center", vertical="center", wrap_text=True)
+
+    ws.column_dimensions["A"].width = 12
+    ws.column_dimensions["B"].width = 42
+    for letter in "CDEFGH":
+        ws.column_dimensions[letter].width = 16
+    # En mode write-only, la mise en page de la feuille est ecrite avant la premiere ligne
+    ws.freeze_panes = "C%d" % FIRST_DATA_ROW
+
+    def cell(value, **style):
+        c = WriteOnlyCell(ws, value=value)
+        for name, attr in style.items():
+            setattr(c, name, attr)
+        return c
+
+    ws.append([cell("BALANCE GENERALE AU 31/12/2024", font=Font(bold=True, size=14), alignment=centered)])
+    ws.append([cell("SOCIETE SYNTHETIQUE SA - %d comptes" % rows, font=Font(italic=True), alignment=centered)])
+    header = dict(font=header_font, fill=header_fill, alignment=centered, border=Border(thin, thin, thin, thin))
+    ws.append([cell(v, **header) for v in ("Compte", "Intitulé", "Solde d'ouverture", None,
+                                         "Mouvements de la période", None, "Solde de clôture", None)])
+    ws.append([cell(v, **header) for v in (None, None) + ("Débit", "Crédit") * 3])
+    for ref in ("A1:H1", "A2:H2", "A3:A4", "B3:B4", "C3:D3", "E3:F3", "G3:H3"):
+        ws.merged_cells.add(ref)
+
+    # Une cellule modele par colonne et par bande: seule la valeur change d'une ligne a l'autre
+    bands = []
+    for fill in (None, band_fill):
+        style = dict(border=Border(bottom=thin))
+        if fill is not None:
+            style["fill"] = fill
+        bands.append([cell(None, **style), cell(None, **style)]
+                     + [cell(None, number_format=AMOUNT_FORMAT, **style) for _ in range(6)])
+
+    totals = [0.0] * 6
+    for index, (account, label) in enumerate(_accounts(rows, rng)):
+        qualifier = rng.choice(_QUALIFIERS)
+        opening = round(rng.lognormvariate(8, 2), 2)
+        debit = round(rng.lognormvariate(9, 2), 2)
+        credit = round(rng.lognormvariate(9, 2), 2)
+        closing = opening + debit - credit
+        amounts = (
+            opening if account[0] in "2345" else 0.0,
+            0.0 if account[0] in "2345" else opening,
+            debit,
+            credit,
+            max(closing, 0.0),
+            max(-closing, 0.0),
+        )
+        row = bands[index % 2]
+        row[0].value = account
+        row[1].value = ("%s %s" % (label, qualifier)).strip()
+        for column, amount in enumerate(amounts):
+            row[column + 2].value = round(amount, 2) if amount else None
+            totals[column] += amount
+        ws.append(row)
+
+    last = FIRST_DATA_ROW + rows - 1
+    total_style = dict(font=Font(bold=True), border=Border(top=thin, bottom=Side(style="double")))
+    ws.append([cell("TOTAL", **total_style), cell(None, **total_style)]
+              + [cell(round(t, 2), number_format=AMOUNT_FORMAT, **total_style) for t in totals])
+
+    amounts_range = "C%d:H%d" % (FIRST_DATA_ROW, last)
+    ws.conditional_formatting.add(amounts_range, CellIsRule(operator="lessThan", formula=["0"], font=Font(color="FF0000")))
+    validation = DataValidation(type="decimal", allow_blank=True)
+    validation.add(amounts_range)
+    ws.data_validations.append(validation)
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    wb.save(tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+FEC_COLUMNS = ("JournalCode", "JournalLib", "EcritureNum", "EcritureDate", "CompteNum", "CompteLib",
+               "CompAuxNum", "CompAuxLib", "PieceRef", "PieceDate", "EcritureLib", "Debit", "Credit",
+               "EcritureLet", "DateLet", "ValidDate", "Montantdevise", "Idevise")
+
+
+def fec_path(lines, seed=0):
+    return os.path.join(DATA_DIR, "fec_%d_%d.txt" % (lines, seed))
+
+
+def generate_fec(path, lines, seed=0, accounts=2000):
+    """Ecrit un FEC de `lines` lignes (ecritures equilibrees sur deux exercices, a-nouveaux compris)"""
+    rng = random.Random(seed)
+    chart = _accounts(accounts, rng)
+    journals = (("VE", "Ventes"), ("AC", "Achats"), ("BQ", "Banque"), ("OD", "Opérations diverses"))
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8", newline="\n") as f:
+        f.write("\t".join(FEC_COLUMNS) + "\n")
+        written = 0
+        number = 0
+        while written < lines:
+            number += 1
+            year = 2023 if written < lines // 2 else 2024
+            if number == 1 or (year == 2024 and written - 2 < lines // 2 <= written):
+                journal, journal_label, month, day = "AN", "A nouveaux", 1, 1
+            else:
+                (journal, journal_label), month, day = rng.choice(journals), rng.randint(1, 12), rng.randint(1, 28)
+            date = "%d%02d%02d" % (year, month, day)
+            amount = ("%.2f" % rng.lognormvariate(7, 1.5)).replace(".", ",")
+            (debit_account, debit_label), (credit_account, credit_label) = rng.sample(chart, 2)
+            for account, label, debit, credit in ((debit_account, debit_label, amount, "0,00"),
+                                                  (credit_account, credit_label, "0,00", amount)):
+                f.write("\t".join((journal, journal_label, str(number), date, account, label, "", "",
+                                   "P%d" % number, date, "Ecriture %d" % number, debit, credit,
+                                   "", "", date, "", "")) + "\n")
+            written += 2
+    os.replace(tmp_path, path)
+    return path
+
+
+def get_fec(lines, seed=0):
+    """Chemin d'un FEC synthetique, genere au premier appel"""
+    path = fec_path(lines, seed)
+    if not os.path.exists(path):
+        generate_fec(path, lines, seed)
+    return path
+
+
+def get_balance(rows, seed=0):
+    """Chemin d'une balance synthetique, generee au premier appel"""
+    path = balance_path(rows, seed)
+    if not os.path.exists(path):
+        generate_balance(path, rows, seed)
+    return path
+
+
+if __name__ == "__main__":
+    for rows in [int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000, 500000]:
+        print(get_balance(rows))
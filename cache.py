@@ -0,0 +1,392 @@
+import copyreg
+import hashlib
+import io
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+from openpyxl import load_workbook
+from openpyxl.worksheet.dimensions import DimensionHolder
+
+import settings
+from balance import Balance
+from preflight import check_balance
+
+logger = logging.getLogger(__name__)
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """Calcule l'empreinte SHA-256 d'un fichier sans le charger entierement"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def bytes_sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def read_uploaded_bytes(uploaded_file):
+    """Retourne le contenu brut d'un fichier importe (UploadedFile, flux binaire ou chemin)"""
+    if isinstance(uploaded_file, (str, os.PathLike)):
+        with open(uploaded_file, "rb") as f:
+            return f.read()
+    if hasattr(uploaded_file, "getvalue"):
+        return uploaded_file.getvalue()
+    uploaded_file.seek(0)
+    return uploaded_file.read()
+
+
+def estimate_workbook_size(workbook):
+    """Estimation grossiere de la memoire occupee par un classeur openpyxl"""
+    cells = sum(len(ws._cells) for ws in workbook.worksheets)
+    return cells * settings.CELL_SIZE_ESTIMATE
+
+
+class LRUCache:
+    """Cache LRU thread-safe, borne en nombre d'entrees et/ou en octets"""
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key][0]
+            self.misses += 1
+            return None
+
+    def peek(self, key):
+        """Lecture sans mise a jour de l'ordre LRU ni des compteurs"""
+        with self._lock:
+            item = self._data.get(key)
+            return item[0] if item is not None else None
+
+    def put(self, key, value, size=0):
+        with self._lock:
+            if key in self._data:
+                self.current_bytes -= self._data.pop(key)[1]
+            self._data[key] = (value, size)
+            self.current_bytes += size
+            self._evict()
+
+    def _evict(self):
+        # On garde toujours la derniere entree, meme si elle depasse le budget
+        while len(self._data) > 1 and (
+            (self.max_entries is not None and len(self._data) > self.max_entries)
+            or (self.max_bytes is not None and self.current_bytes > self.max_bytes)
+        ):
+            _, (_, size) = self._data.popitem(last=False)
+            self.current_bytes -= size
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.current_bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def sizes(self, group):
+        """{groupe: (entrees, octets)}, groupe = group(cle)"""
+        sizes = {}
+        with self._lock:
+            for key, (_, size) in self._data.items():
+                entries, total = sizes.get(group(key), (0, 0))
+                sizes[group(key)] = (entries + 1, total + size)
+        return sizes
+
+    def stats(self):
+        return {
+            "entries": len(self._data),
+            "bytes": self.current_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+def _rebuild_dimension_holder(worksheet, reference, default_factory, max_outline, items):
+    holder = DimensionHolder(worksheet, reference, default_factory)
+    holder.max_outline = max_outline
+    holder.update(items)
+    return holder
+
+
+def _reduce_dimension_holder(holder):
+    # Sans cela, pickle recree le DimensionHolder sans sa feuille ni sa fonction par defaut
+    return _rebuild_dimension_holder, (holder.worksheet, holder.reference, holder.default_factory,
+                                       holder.max_outline, list(holder.items()))
+
+
+# Classeurs openpyxl copies par pickle (modele en cache, sessions deplacees sur disque)
+copyreg.pickle(DimensionHolder, _reduce_dimension_holder)
+
+
+class CachedTemplate:
+    """Modele parse une seule fois et partage en lecture seule entre les sessions.
+
+    Le classeur openpyxl n'est construit qu'au premier acces: le moteur OOXML
+    n'a besoin que du chemin du fichier.
+    """
+
+    def __init__(self, path, mtime_ns, sha256):
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.sha256 = sha256
+        self._workbook = None
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    @property
+    def workbook(self):
+        return self.load()
+
+    def load(self):
+        """Parse le classeur au premier appel (prechauffage compris); retourne le classeur"""
+        if self._workbook is None:
+            # Deux sessions qui demandent le meme modele ne le parsent qu'une fois
+            with self._lock:
+                if self._workbook is None:
+                    self._workbook = load_workbook(self.path, data_only=False)
+        return self._workbook
+
+    def clone(self):
+        """Retourne une copie privee du classeur, a utiliser avant toute modification"""
+        workbook = self.workbook
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = pickle.dumps(workbook, protocol=pickle.HIGHEST_PROTOCOL)
+        return pickle.loads(self._snapshot)
+
+
+class TemplateCache:
+    """Cache des modeles Excel parses, cle = chemin + mtime + taille du fichier.
+
+    L'empreinte du contenu est calculee une fois par cle et gardee sur l'entree
+    (CachedTemplate.sha256): elle disparait avec elle quand le LRU l'evince.
+    """
+
+    def __init__(self, max_entries=settings.TEMPLATE_CACHE_SIZE):
+        self._entries = LRUCache(max_entries=max_entries)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(path):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        return path, stat.st_mtime_ns, stat.st_size
+
+    def get(self, path):
+        """Retourne le CachedTemplate du fichier (le meme objet tant que le fichier ne change pas)"""
+        key = self._key(path)
+        entry = self._entries.get(key)
+        if entry is not None:
+            return entry
+        with self._lock:
+            entry = self._entries.peek(key)
+            if entry is None:
+                entry = CachedTemplate(key[0], key[1], file_sha256(key[0]))
+                self._entries.put(key, entry)
+        return entry
+
+    def stats(self):
+        return self._entries.stats()
+
+    def clear(self):
+        self._entries.clear()
+
+
+class BalanceCache:
+    """Cache des balances importees, cle = SHA-256 du fichier, borne par un budget memoire.
+
+    Classeurs openpyxl et balances en colonnes partagent le meme LRU, donc le
+    meme budget: settings.BALANCE_CACHE_MAX_BYTES est la memoire totale du cache.
+    """
+
+    # Premier element des cles du LRU: (WORKBOOK, empreinte) ou (COLUMNS, empreinte)
+    WORKBOOK = "classeurs"
+    COLUMNS = "colonnes"
+
+    def __init__(self, max_bytes=settings.BALANCE_CACHE_MAX_BYTES):
+        self._entries = LRUCache(max_bytes=max_bytes)
+        self._validated = LRUCache(max_entries=settings.VALIDATED_BALANCES_SIZE)
+
+    def get(self, data, digest=None):
+        """Retourne (empreinte, classeur) en ne parsant le fichier que s'il est inconnu"""
+        digest = digest or bytes_sha256(data)
+        workbook = self._entries.get((self.WORKBOOK, digest))
+        if workbook is None:
+            workbook = load_workbook(io.BytesIO(data), data_only=False)
+            self._entries.put((self.WORKBOOK, digest), workbook, estimate_workbook_size(workbook))
+        return digest, workbook
+
+    def preflight(self, data):
+        """Controles rapides du fichier (preflight.check_balance), faits une seule fois par contenu.
+
+        Leve preflight.PreflightError si le fichier est refuse.
+        """
+        digest = bytes_sha256(data)
+        checked = self._validated.get(digest)
+        if checked is None:
+            checked = check_balance(data, digest)
+            self._validated.put(digest, checked)
+        return checked
+
+    def get_balance(self, data, checked=None):
+        """Retourne (empreinte, Balance) en colonnes, lue une seule fois par contenu de fichier.
+
+        checked: Preflight du fichier, dont l'empreinte et l'en-tete detecte sont repris
+        """
+        digest = checked.digest if checked is not None else bytes_sha256(data)
+        balance = self._entries.get((self.COLUMNS, digest))
+        if balance is None:
+            balance = Balance.from_xlsx(data, checked.detected if checked is not None else None)
+            self.put_balance(digest, balance)
+        return digest, balance
+
+    def cached_balance(self, digest):
+        """Balance deja lue pour ce contenu, ou None"""
+        return self._entries.get((self.COLUMNS, digest))
+
+    def put_balance(self, digest, balance):
+        """Garde une balance lue ailleurs (pool de processus de la consolidation)"""
+        self._entries.put((self.COLUMNS, digest), balance, balance.nbytes)
+
+    def stats(self):
+        """Statistiques du LRU, avec le detail (entrees, octets) des classeurs et des balances en colonnes"""
+        stats = self._entries.stats()
+        stats["max_bytes"] = self._entries.max_bytes
+        sizes = self._entries.sizes(lambda key: key[0])
+        for kind in (self.WORKBOOK, self.COLUMNS):
+            entries, size = sizes.get(kind, (0, 0))
+            stats[kind] = {"entries": entries, "bytes": size}
+        return stats
+
+    def clear(self):
+        self._entries.clear()
+        self._validated.clear()
+
+
+class ExportCache:
+    """Fichiers exportes, cle = empreintes du modele et des balances + version du moteur.
+
+    Deux niveaux: un LRU en memoire partage par les sessions et un dossier sur
+    disque, conserve entre deux demarrages du serveur. Un fichier absent est
+    enregistre dans un fichier temporaire (en memoire jusqu'a
+    settings.EXPORT_SPOOL_MAX_BYTES, sur disque au-dela) puis relu une seule fois.
+    """
+
+    def __init__(self, directory=settings.EXPORT_CACHE_DIR, max_bytes=settings.EXPORT_CACHE_MAX_BYTES,
+                 disk_max_bytes=settings.EXPORT_CACHE_DISK_MAX_BYTES):
+        self.directory = directory
+        self.disk_max_bytes = disk_max_bytes
+        self._memory = LRUCache(max_bytes=max_bytes)
+        self._disk_lock = threading.Lock()
+        self.disk_hits = 0
+
+    @staticmethod
+    def key(*parts):
+        """Cle d'un fichier exporte a partir des empreintes et versions qui le determinent"""
+        return hashlib.sha256("\0".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".xlsx")
+
+    def get(self, key):
+        """Contenu du fichier exporte, ou None s'il n'a jamais ete produit"""
+        data = self._memory.get(key)
+        if data is not None or not self.directory:
+            return data
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # Date d'acces: les fichiers les plus anciens sont supprimes en premier
+            os.utime(path)
+        except OSError:
+            return None
+        self.disk_hits += 1
+        self._memory.put(key, data, len(data))
+        return data
+
+    def store(self, key, write):
+        """Produit le fichier avec write(flux binaire), le garde sous key et retourne son contenu.
+
+        key None: le fichier est produit sans etre garde.
+        """
+        with tempfile.SpooledTemporaryFile(max_size=settings.EXPORT_SPOOL_MAX_BYTES) as spool:
+            write(spool)
+            if key is not None and self.directory:
+                spool.seek(0)
+                self._write_disk(key, spool)
+            spool.seek(0)
+            data = spool.read()
+        if key is not None:
+            self._memory.put(key, data, len(data))
+        return data
+
+    def _write_disk(self, key, spool):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Fichier temporaire dans le meme dossier: le renommage est atomique
+            with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix=".tmp", delete=False) as f:
+                shutil.copyfileobj(spool, f)
+            os.replace(f.name, path)
+        except OSError as e:
+            logger.warning("Cache disque des exports desactive (%s): %s", self.directory, e)
+            self.directory = None
+            return
+        self._prune()
+
+    def _prune(self):
+        """Supprime les fichiers les moins recemment utilises au-dela du budget disque"""
+        with self._disk_lock:
+            files = []
+            for root, _, names in os.walk(self.directory):
+                for name in names:
+                    if name.endswith(".xlsx"):
+                        path = os.path.join(root, name)
+                        try:
+                            stat = os.stat(path)
+                        except OSError:
+                            continue
+                        files.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in files)
+            # On garde toujours le fichier le plus recent, meme s'il depasse le budget
+            for _, size, path in sorted(files)[:-1]:
+                if total <= self.disk_max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+    def stats(self):
+        return dict(self._memory.stats(), disk_hits=self.disk_hits)
+
+    def clear(self):
+        self._memory.clear()
+
+
+template_cache = TemplateCache()
+balance_cache = BalanceCache()
+export_cache = ExportCache()
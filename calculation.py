@@ -0,0 +1,907 @@
+"""Calcul des formules du modele cote serveur.
+
+Les formules du modele sont analysees une seule fois par modele (FormulaGraph,
+garde avec le modele dans template_cache): chaque formule est compilee en
+fonctions Python et reliee aux cellules et feuilles qu'elle lit. Le graphe donne
+l'ordre de calcul (tri topologique) et, pour chaque feuille fournie a
+l'integration ('BAL N', 'BAL N-1', ...), les formules qui en dependent
+directement ou non. Les formules qui ne lisent que le modele sont calculees une
+fois avec le graphe.
+
+Une Evaluation garde les resultats d'une session: apres une integration, seules
+les formules qui dependent des feuilles dont le contenu a change sont
+recalculees. Les valeurs obtenues sont ecrites comme valeurs en cache (<v>)
+des cellules a formule du fichier exporte.
+
+Fonctions prises en charge: voir FUNCTIONS. Une formule qui utilise autre chose
+(fonction inconnue, nom defini, formule matricielle, reference circulaire) n'est
+pas calculee, ni les formules qui en dependent: Excel les calcule a l'ouverture.
+Les cellules des balances donnent leur derniere valeur enregistree.
+"""
+import bisect
+import datetime
+import math
+import re
+import threading
+from fnmatch import fnmatchcase
+
+from openpyxl.formula.tokenizer import Token, Tokenizer
+from openpyxl.utils.cell import column_index_from_string, get_column_letter
+from openpyxl.utils.datetime import to_excel
+
+import ooxml
+import settings
+from cache import LRUCache
+
+VERSION = "calcul-1"
+
+MAX_ROW = 1048576
+MAX_COLUMN = 16384
+
+
+class ExcelError(Exception):
+    """Valeur d'erreur Excel (#DIV/0!, #VALUE!, #N/A, #REF!...)"""
+
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+    def __eq__(self, other):
+        return isinstance(other, ExcelError) and other.code == self.code
+
+    def __hash__(self):
+        return hash(self.code)
+
+    def __repr__(self):
+        return self.code
+
+
+class Unsupported(Exception):
+    """Formule que le moteur ne sait pas calculer"""
+
+
+class _Unsupported:
+    def __repr__(self):
+        return "NON_CALCULEE"
+
+
+# Resultat d'une cellule qui n'a pas pu etre calculee
+UNSUPPORTED = _Unsupported()
+
+
+class Range:
+    """Plage (feuille, lignes et colonnes a partir de 1, bornes incluses)"""
+
+    __slots__ = ("sheet", "min_row", "min_col", "max_row", "max_col")
+
+    def __init__(self, sheet, min_row, min_col, max_row, max_col):
+        self.sheet = sheet
+        self.min_row, self.min_col = min_row, min_col
+        self.max_row, self.max_col = max_row, max_col
+
+    @property
+    def key(self):
+        return (self.sheet, self.min_row, self.min_col, self.max_row, self.max_col)
+
+    @property
+    def is_cell(self):
+        return self.min_row == self.max_row and self.min_col == self.max_col
+
+
+_CELL_RE = re.compile(r"^\$?([A-Za-z]{1,3})\$?(\d+)$")
+_COLUMNS_RE = re.compile(r"^\$?([A-Za-z]{1,3}):\$?([A-Za-z]{1,3})$")
+_ROWS_RE = re.compile(r"^\$?(\d+):\$?(\d+)$")
+
+
+def parse_reference(text, sheet):
+    """'Feuille'!A1:B2, A:A, 1:3 ou A1 -> Range; Unsupported pour un nom defini"""
+    if "!" in text:
+        sheet, text = text.rsplit("!", 1)
+        if sheet.startswith("'") and sheet.endswith("'"):
+            sheet = sheet[1:-1].replace("''", "'")
+    parts = text.split(":")
+    if len(parts) == 2 and _CELL_RE.match(parts[0]) and _CELL_RE.match(parts[1]):
+        (c1, r1), (c2, r2) = _CELL_RE.match(parts[0]).groups(), _CELL_RE.match(parts[1]).groups()
+        r1, r2 = sorted((int(r1), int(r2)))
+        c1, c2 = sorted((column_index_from_string(c1.upper()), column_index_from_string(c2.upper())))
+        return Range(sheet, r1, c1, r2, c2)
+    m = _CELL_RE.match(text)
+    if m:
+        column, row = column_index_from_string(m.group(1).upper()), int(m.group(2))
+        return Range(sheet, row, column, row, column)
+    m = _COLUMNS_RE.match(text)
+    if m:
+        c1, c2 = sorted((column_index_from_string(m.group(1).upper()), column_index_from_string(m.group(2).upper())))
+        return Range(sheet, 1, c1, MAX_ROW, c2)
+    m = _ROWS_RE.match(text)
+    if m:
+        r1, r2 = sorted((int(m.group(1)), int(m.group(2))))
+        return Range(sheet, r1, 1, r2, MAX_COLUMN)
+    raise Unsupported("référence non prise en charge: %s" % text)
+
+
+# Conversions et comparaisons a la maniere d'Excel
+
+def _number(value):
+    if value is None:
+        return 0
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        try:
+            return float(value.strip()) if value.strip() else 0
+        except ValueError:
+            raise ExcelError("#VALUE!")
+    raise ExcelError("#VALUE!")
+
+
+def _text(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _boolean(value):
+    if isinstance(value, str):
+        if value.upper() in ("TRUE", "VRAI"):
+            return True
+        if value.upper() in ("FALSE", "FAUX"):
+            return False
+        raise ExcelError("#VALUE!")
+    return bool(_number(value))
+
+
+def _rank(value):
+    # Ordre d'Excel: nombres < textes < booleens
+    if isinstance(value, bool):
+        return 2, value
+    if isinstance(value, str):
+        return 1, value.lower()
+    return 0, value
+
+
+def _compare(left, right):
+    if left is None:
+        left = "" if isinstance(right, str) else (False if isinstance(right, bool) else 0)
+    if right is None:
+        right = "" if isinstance(left, str) else (False if isinstance(left, bool) else 0)
+    left, right = _rank(left), _rank(right)
+    return (left > right) - (left < right)
+
+
+def _result(value):
+    """Normalise un resultat de calcul (entier si possible, erreur sur un nombre invalide)"""
+    if value is None:
+        # Reference a une cellule vide: Excel affiche 0
+        return 0
+    if isinstance(value, float):
+        if math.isnan(value) or math.isinf(value):
+            raise ExcelError("#NUM!")
+        if value.is_integer() and abs(value) < 1e15:
+            return int(value)
+    return value
+
+
+def _criteria(criteria):
+    """Critere de SOMME.SI -> (cle d'egalite exacte ou None, fonction de test)"""
+    if isinstance(criteria, str):
+        m = re.match(r"^(<=|>=|<>|=|<|>)?(.*)$", criteria, re.S)
+        operator, operand = m.group(1) or "=", m.group(2)
+        try:
+            operand = float(operand)
+        except ValueError:
+            if operand.upper() in ("TRUE", "VRAI", "FALSE", "FAUX"):
+                operand = operand.upper() in ("TRUE", "VRAI")
+    else:
+        operator, operand = "=", criteria
+    if operator in ("=", "<>") and isinstance(operand, str) and ("*" in operand or "?" in operand):
+        pattern = operand.lower().replace("~*", "[*]").replace("~?", "[?]")
+        matches = lambda v: isinstance(v, str) and fnmatchcase(v.lower(), pattern)
+        return None, matches if operator == "=" else (lambda v: not matches(v))
+    if operator == "=" and operand != "":
+        return _key(operand), None
+    if operator == "=":
+        return None, lambda v: v is None or v == ""
+    if operator == "<>":
+        return None, lambda v: _key(v) != _key(operand)
+
+    def test(value):
+        if value is None or isinstance(value, str) != isinstance(operand, str) or isinstance(value, bool):
+            return False
+        sign = _compare(value, operand)
+        return {"<": sign < 0, "<=": sign <= 0, ">": sign > 0, ">=": sign >= 0}[operator]
+    return None, test
+
+
+def _key(value):
+    """Cle de comparaison d'egalite de SOMME.SI / RECHERCHEV: '101' et 101 sont egaux"""
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip()
+    try:
+        return float(text)
+    except ValueError:
+        return text.lower()
+
+
+# Fonctions: chaque fonction recoit le contexte et ses arguments non evalues (fonctions de ctx)
+
+def _scalar_args(ctx, args):
+    for arg in args:
+        value = arg(ctx)
+        if isinstance(value, Range):
+            yield from ctx.range_values(value)
+        else:
+            yield value
+
+
+def _fn_sum(ctx, *args):
+    total = 0
+    for arg in args:
+        value = arg(ctx)
+        if isinstance(value, Range):
+            for item in ctx.range_values(value):
+                if isinstance(item, (int, float)) and not isinstance(item, bool):
+                    total += item
+        else:
+            total += _number(value)
+    return total
+
+
+def _numbers(ctx, args):
+    values = []
+    for arg in args:
+        value = arg(ctx)
+        if isinstance(value, Range):
+            values.extend(v for v in ctx.range_values(value) if isinstance(v, (int, float)) and not isinstance(v, bool))
+        else:
+            values.append(_number(value))
+    return values
+
+
+def _fn_min(ctx, *args):
+    return min(_numbers(ctx, args), default=0)
+
+
+def _fn_max(ctx, *args):
+    return max(_numbers(ctx, args), default=0)
+
+
+def _fn_average(ctx, *args):
+    values = _numbers(ctx, args)
+    if not values:
+        raise ExcelError("#DIV/0!")
+    return sum(values) / len(values)
+
+
+def _fn_count(ctx, *args):
+    return len(_numbers(ctx, args))
+
+
+def _fn_sumif(ctx, criteria_range, criteria, sum_range=None):
+    criteria_range = criteria_range(ctx)
+    sum_range = sum_range(ctx) if sum_range is not None else criteria_range
+    if not isinstance(criteria_range, Range) or not isinstance(sum_range, Range):
+        raise ExcelError("#VALUE!")
+    return ctx.sumif(criteria_range, ctx.scalar(criteria(ctx)), sum_range)
+
+
+def _fn_iferror(ctx, value, fallback):
+    try:
+        return ctx.scalar(value(ctx))
+    except ExcelError:
+        return ctx.scalar(fallback(ctx))
+
+
+def _fn_if(ctx, condition, if_true=None, if_false=None):
+    if _boolean(ctx.scalar(condition(ctx))):
+        return ctx.scalar(if_true(ctx)) if if_true is not None else True
+    return ctx.scalar(if_false(ctx)) if if_false is not None else False
+
+
+def _fn_and(ctx, *args):
+    return all(_boolean(v) for v in _scalar_args(ctx, args) if v is not None)
+
+
+def _fn_or(ctx, *args):
+    return any(_boolean(v) for v in _scalar_args(ctx, args) if v is not None)
+
+
+def _fn_not(ctx, value):
+    return not _boolean(ctx.scalar(value(ctx)))
+
+
+def _fn_abs(ctx, value):
+    return abs(_number(ctx.scalar(value(ctx))))
+
+
+def _fn_round(ctx, value, digits=None):
+    value = _number(ctx.scalar(value(ctx)))
+    digits = int(_number(ctx.scalar(digits(ctx)))) if digits is not None else 0
+    # Arrondi d'Excel: les demis s'eloignent de zero
+    factor = 10 ** digits
+    return math.copysign(math.floor(abs(value) * factor + 0.5 + 1e-9) / factor, value)
+
+
+def _fn_vlookup(ctx, lookup, table, column, approximate=None):
+    lookup = ctx.scalar(lookup(ctx))
+    table = table(ctx)
+    column = int(_number(ctx.scalar(column(ctx))))
+    approximate = _boolean(ctx.scalar(approximate(ctx))) if approximate is not None else True
+    if not isinstance(table, Range):
+        raise ExcelError("#VALUE!")
+    if column < 1 or column > table.max_col - table.min_col + 1:
+        raise ExcelError("#REF!")
+    row = ctx.vlookup_row(lookup, table, approximate)
+    if row is None:
+        raise ExcelError("#N/A")
+    return ctx.value(table.sheet, row, table.min_col + column - 1)
+
+
+def _fn_left(ctx, value, count=None):
+    count = int(_number(ctx.scalar(count(ctx)))) if count is not None else 1
+    return _text(ctx.scalar(value(ctx)))[:count]
+
+
+def _fn_right(ctx, value, count=None):
+    count = int(_number(ctx.scalar(count(ctx)))) if count is not None else 1
+    return _text(ctx.scalar(value(ctx)))[-count:] if count > 0 else ""
+
+
+def _fn_len(ctx, value):
+    return len(_text(ctx.scalar(value(ctx))))
+
+
+FUNCTIONS = {
+    "SUM": _fn_sum,
+    "SUMIF": _fn_sumif,
+    "IFERROR": _fn_iferror,
+    "IF": _fn_if,
+    "VLOOKUP": _fn_vlookup,
+    "MIN": _fn_min,
+    "MAX": _fn_max,
+    "AVERAGE": _fn_average,
+    "COUNT": _fn_count,
+    "ABS": _fn_abs,
+    "ROUND": _fn_round,
+    "AND": _fn_and,
+    "OR": _fn_or,
+    "NOT": _fn_not,
+    "LEFT": _fn_left,
+    "RIGHT": _fn_right,
+    "LEN": _fn_len,
+}
+
+
+def _power(a, b):
+    try:
+        return _number(a) ** _number(b)
+    except ZeroDivisionError:
+        raise ExcelError("#DIV/0!")
+
+
+def _divide(a, b):
+    b = _number(b)
+    if b == 0:
+        raise ExcelError("#DIV/0!")
+    return _number(a) / b
+
+
+_INFIX = {
+    "^": (5, _power),
+    "*": (4, lambda a, b: _number(a) * _number(b)),
+    "/": (4, _divide),
+    "+": (3, lambda a, b: _number(a) + _number(b)),
+    "-": (3, lambda a, b: _number(a) - _number(b)),
+    "&": (2, lambda a, b: _text(a) + _text(b)),
+    "=": (1, lambda a, b: _compare(a, b) == 0),
+    "<>": (1, lambda a, b: _compare(a, b) != 0),
+    "<": (1, lambda a, b: _compare(a, b) < 0),
+    ">": (1, lambda a, b: _compare(a, b) > 0),
+    "<=": (1, lambda a, b: _compare(a, b) <= 0),
+    ">=": (1, lambda a, b: _compare(a, b) >= 0),
+}
+
+_ERRORS = ("#NULL!", "#DIV/0!", "#VALUE!", "#REF!", "#NAME?", "#NUM!", "#N/A")
+
+
+class _Parser:
+    """Compile les jetons d'une formule (openpyxl Tokenizer) en fonctions de ctx"""
+
+    def __init__(self, formula, sheet):
+        self.sheet = sheet
+        self.tokens = [t for t in Tokenizer(formula).items if t.type != Token.WSPACE]
+        self.position = 0
+        self.references = []
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def next(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def parse(self):
+        node = self.expression(0)
+        if self.peek() is not None:
+            raise Unsupported("jeton inattendu: %s" % self.peek().value)
+        return node
+
+    def expression(self, min_precedence):
+        left = self.unary()
+        while True:
+            token = self.peek()
+            if token is None or token.type != Token.OP_IN or token.value not in _INFIX:
+                return left
+            precedence, operation = _INFIX[token.value]
+            if precedence < min_precedence:
+                return left
+            self.next()
+            right = self.expression(precedence + 1)
+            left = self._binary(operation, left, right)
+
+    def _binary(self, operation, left, right):
+        def node(ctx):
+            return operation(ctx.scalar(left(ctx)), ctx.scalar(right(ctx)))
+        return node
+
+    def unary(self):
+        token = self.peek()
+        if token is not None and token.type == Token.OP_PRE:
+            self.next()
+            operand = self.unary()
+            if token.value == "-":
+                return lambda ctx: -_number(ctx.scalar(operand(ctx)))
+            return operand
+        node = self.primary()
+        while self.peek() is not None and self.peek().type == Token.OP_POST:
+            self.next()
+            node = (lambda inner: lambda ctx: _number(ctx.scalar(inner(ctx))) / 100)(node)
+        return node
+
+    def primary(self):
+        token = self.next()
+        if token is None:
+            raise Unsupported("formule incomplète")
+        if token.type == Token.OPERAND:
+            return self.operand(token)
+        if token.type == Token.PAREN and token.subtype == Token.OPEN:
+            node = self.expression(0)
+            closing = self.next()
+            if closing is None or closing.type != Token.PAREN:
+                raise Unsupported("parenthèse non fermée")
+            return node
+        if token.type == Token.FUNC and token.subtype == Token.OPEN:
+            return self.function(token.value[:-1].upper())
+        raise Unsupported("élément non pris en charge: %s" % token.value)
+
+    def operand(self, token):
+        value = token.value
+        if token.subtype == Token.NUMBER:
+            number = float(value)
+            number = int(number) if number.is_integer() and "." not in value and "E" not in value.upper() else number
+            return lambda ctx: number
+        if token.subtype == Token.TEXT:
+            text = value[1:-1].replace('""', '"')
+            return lambda ctx: text
+        if token.subtype == Token.LOGICAL:
+            logical = value.upper() in ("TRUE", "VRAI")
+            return lambda ctx: logical
+        if token.subtype == Token.ERROR or value in _ERRORS:
+            error = ExcelError(value)
+
+            def raise_error(ctx):
+                raise error
+            return raise_error
+        reference = parse_reference(value, self.sheet)
+        self.references.append(reference)
+        if reference.is_cell:
+            sheet, row, column = reference.sheet, reference.min_row, reference.min_col
+            return lambda ctx: ctx.value(sheet, row, column)
+        return lambda ctx: reference
+
+    def function(self, name):
+        if name.startswith("_XLFN."):
+            name = name[6:]
+        function = FUNCTIONS.get(name)
+        if function is None:
+            raise Unsupported("fonction non prise en charge: %s" % name)
+        args = []
+        token = self.peek()
+        if token is not None and token.type == Token.FUNC and token.subtype == Token.CLOSE:
+            self.next()
+        else:
+            while True:
+                args.append(self.expression(0))
+                token = self.next()
+                if token is None:
+                    raise Unsupported("fonction non fermée: %s" % name)
+                if token.type == Token.FUNC and token.subtype == Token.CLOSE:
+                    break
+                if token.type != Token.SEP or token.subtype != Token.ARG:
+                    raise Unsupported("séparateur inattendu: %s" % token.value)
+        return lambda ctx: function(ctx, *args)
+
+
+def compile_formula(formula, sheet):
+    """Formule "=..." de la feuille sheet -> (fonction de ctx, plages lues); Unsupported sinon"""
+    parser = _Parser(formula, sheet)
+    try:
+        return parser.parse(), parser.references
+    except (IndexError, ValueError) as e:
+        raise Unsupported("formule illisible: %s" % e)
+
+
+class SheetData:
+    """Cellules non vides d'une feuille, avec les lignes occupees de chaque colonne"""
+
+    def __init__(self, cells):
+        self.cells = cells
+        self._columns = None
+
+    @classmethod
+    def from_xlsx(cls, data):
+        """Valeurs de la feuille active d'un fichier (dernieres valeurs calculees des formules)"""
+        cells = {}
+        for number, values, _ in ooxml.iter_sheet_cells(data, formulas=False):
+            for column, value in enumerate(values, start=1):
+                if value is not None:
+                    cells[(number, column)] = value
+        return cls(cells)
+
+    def column_rows(self, column):
+        if self._columns is None:
+            columns = {}
+            for row, col in self.cells:
+                columns.setdefault(col, []).append(row)
+            for rows in columns.values():
+                rows.sort()
+            self._columns = columns
+        return self._columns.get(column, ())
+
+    def columns(self, min_col, max_col):
+        if self._columns is None:
+            self.column_rows(min_col)
+        return [c for c in self._columns if min_col <= c <= max_col]
+
+    def cells_in(self, reference):
+        """Coordonnees (ligne, colonne) des cellules non vides de la plage"""
+        for column in sorted(self.columns(reference.min_col, reference.max_col)):
+            rows = self.column_rows(column)
+            start = bisect.bisect_left(rows, reference.min_row)
+            end = bisect.bisect_right(rows, reference.max_row)
+            for row in rows[start:end]:
+                yield row, column
+
+
+def _constant(value):
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return to_excel(value)
+    if isinstance(value, (int, float, str, bool)):
+        return value
+    return None
+
+
+class FormulaGraph:
+    """Formules d'un modele, compilees, et leurs dependances.
+
+    external: feuilles fournies a chaque integration (leur contenu dans le modele est ignore)
+    """
+
+    def __init__(self, workbook, external=("BAL N", "BAL N-1")):
+        self.external = set(external)
+        self.sheets = {}
+        self.functions = {}
+        self.unsupported = {}
+        references = {}
+        for ws in workbook.worksheets:
+            if ws.title in self.external:
+                continue
+            cells = {}
+            for (row, column), cell in ws._cells.items():
+                value = cell.value
+                if value is None:
+                    continue
+                key = (ws.title, row, column)
+                if cell.data_type == "f":
+                    cells[(row, column)] = None
+                    if not isinstance(value, str):
+                        self.unsupported[key] = "formule matricielle"
+                        continue
+                    try:
+                        self.functions[key], references[key] = compile_formula(value, ws.title)
+                    except Unsupported as e:
+                        self.unsupported[key] = str(e)
+                else:
+                    constant = _constant(value)
+                    if constant is not None:
+                        cells[(row, column)] = constant
+            self.sheets[ws.title] = SheetData(cells)
+
+        # Formules de chaque feuille du modele, par colonne, pour retrouver celles d'une plage
+        formula_cells = {}
+        for sheet, row, column in list(self.functions) + list(self.unsupported):
+            formula_cells.setdefault(sheet, {}).setdefault((row, column), None)
+        formula_index = {sheet: SheetData(cells) for sheet, cells in formula_cells.items()}
+
+        dependents = {}
+        self.reads = {}
+        precedents = {key: set() for key in self.functions}
+        for key, refs in references.items():
+            reads = set()
+            for reference in refs:
+                if reference.sheet in self.external or reference.sheet not in self.sheets:
+                    reads.add(reference.sheet)
+                    continue
+                index = formula_index.get(reference.sheet)
+                if index is None:
+                    continue
+                for row, column in index.cells_in(reference):
+                    precedent = (reference.sheet, row, column)
+                    if precedent not in self.functions:
+                        # Formule non calculable: ses dependantes ne le seront pas non plus
+                        continue
+                    if precedent != key:
+                        precedents[key].add(precedent)
+                        dependents.setdefault(precedent, []).append(key)
+                    else:
+                        self.unsupported[key] = "référence circulaire"
+            self.reads[key] = reads
+
+        # Tri topologique (Kahn); les formules restantes sont dans un cycle
+        pending = {key: len(p) for key, p in precedents.items()}
+        ready = [key for key, count in pending.items() if count == 0]
+        self.order = []
+        while ready:
+            key = ready.pop()
+            self.order.append(key)
+            for dependent in dependents.get(key, ()):
+                if dependent in pending:
+                    pending[dependent] -= 1
+                    if pending[dependent] == 0:
+                        ready.append(dependent)
+        for key in self.functions:
+            if key not in pending or pending[key] > 0:
+                self.unsupported.setdefault(key, "référence circulaire")
+        self.order = [key for key in self.order if key not in self.unsupported]
+        position = {key: i for i, key in enumerate(self.order)}
+
+        # Formules a recalculer quand le contenu d'une feuille externe change
+        self.dependents = {}
+        for sheet in {s for reads in self.reads.values() for s in reads}:
+            affected = set()
+            stack = [key for key, reads in self.reads.items() if sheet in reads]
+            while stack:
+                key = stack.pop()
+                if key in affected:
+                    continue
+                affected.add(key)
+                stack.extend(dependents.get(key, ()))
+            self.dependents[sheet] = sorted((k for k in affected if k in position), key=position.get)
+        dynamic = {key for keys in self.dependents.values() for key in keys}
+
+        # Formules qui ne lisent que le modele: calculees une fois pour toutes
+        evaluation = Evaluation(self, static=False)
+        evaluation._run([key for key in self.order if key not in dynamic], {})
+        self.static = evaluation.results
+
+    def __len__(self):
+        return len(self.functions) + len(self.unsupported)
+
+
+class Evaluation:
+    """Resultats des formules d'un modele pour une session, recalcules par feuille modifiee"""
+
+    def __init__(self, graph, static=True):
+        self.graph = graph
+        self.results = dict(graph.static) if static else {}
+        for key in graph.unsupported:
+            self.results[key] = UNSUPPORTED
+        # Cle (empreinte) du contenu de chaque feuille externe deja prise en compte (None: jamais calcule)
+        self.keys = None
+        self._sources = {}
+        self._loaded = {}
+        self._sumifs = {}
+        self._lookups = {}
+
+    def copy(self):
+        evaluation = Evaluation.__new__(Evaluation)
+        evaluation.__dict__.update(self.__dict__)
+        evaluation.results = dict(self.results)
+        evaluation.keys = dict(self.keys) if self.keys is not None else None
+        evaluation._sources, evaluation._loaded, evaluation._sumifs, evaluation._lookups = {}, {}, {}, {}
+        return evaluation
+
+    def update(self, sources):
+        """Recalcule les formules qui dependent des feuilles modifiees.
+
+        sources: nom de feuille -> (cle du contenu, fonction qui retourne le contenu xlsx ou None)
+        Retourne le nombre de formules recalculees.
+        """
+        current = {name: sources[name][0] if name in sources else None for name in self.graph.dependents}
+        if self.keys is None:
+            # Premier calcul: toutes les formules qui lisent une feuille externe
+            changed = list(self.graph.dependents)
+        else:
+            changed = [name for name in self.graph.dependents if current[name] != self.keys.get(name)]
+        keys = set()
+        for name in changed:
+            keys.update(self.graph.dependents[name])
+        position = {key: i for i, key in enumerate(self.graph.order)}
+        self._run(sorted(keys, key=position.get), sources)
+        self.keys = current
+        return len(keys)
+
+    def _run(self, keys, sources):
+        self._sources = sources
+        try:
+            for key in keys:
+                try:
+                    self.results[key] = _result(self.scalar(self.graph.functions[key](self)))
+                except ExcelError as e:
+                    self.results[key] = e
+                except (Unsupported, RecursionError, TypeError, OverflowError):
+                    self.results[key] = UNSUPPORTED
+        finally:
+            # Contenu des feuilles externes et index: recharges au prochain calcul
+            self._sources, self._loaded, self._sumifs, self._lookups = {}, {}, {}, {}
+
+    # Acces aux valeurs, utilises par les formules compilees
+
+    def sheet(self, name):
+        data = self.graph.sheets.get(name) if name not in self.graph.external else None
+        if data is not None:
+            return data
+        data = self._loaded.get(name)
+        if data is None:
+            source = self._sources.get(name)
+            content = source[1]() if source is not None else None
+            if content is None:
+                raise ExcelError("#REF!")
+            data = self._loaded[name] = SheetData.from_xlsx(content)
+        return data
+
+    def value(self, sheet, row, column):
+        key = (sheet, row, column)
+        if key in self.results:
+            value = self.results[key]
+            if value is UNSUPPORTED:
+                raise Unsupported("cellule non calculée")
+            if isinstance(value, ExcelError):
+                raise value
+            return value
+        if key in self.graph.functions or key in self.graph.unsupported:
+            raise Unsupported("cellule non calculée")
+        value = self.sheet(sheet).cells.get((row, column))
+        if isinstance(value, str) and value in _ERRORS:
+            raise ExcelError(value)
+        return value
+
+    def scalar(self, value):
+        if isinstance(value, Range):
+            if value.is_cell:
+                return self.value(value.sheet, value.min_row, value.min_col)
+            # Intersection implicite: non prise en charge
+            raise Unsupported("plage utilisée comme valeur")
+        return value
+
+    def range_values(self, reference):
+        data = self.sheet(reference.sheet)
+        for row, column in data.cells_in(reference):
+            yield self.value(reference.sheet, row, column)
+
+    def sumif(self, criteria_range, criteria, sum_range):
+        row_offset = sum_range.min_row - criteria_range.min_row
+        column_offset = sum_range.min_col - criteria_range.min_col
+        key, test = _criteria(criteria)
+        data = self.sheet(criteria_range.sheet)
+        if key is None:
+            total = 0
+            for row, column in data.cells_in(criteria_range):
+                if test(self.value(criteria_range.sheet, row, column)):
+                    total += self._summable(sum_range.sheet, row + row_offset, column + column_offset)
+            return total
+        # Egalite exacte: totaux de toutes les valeurs du critere calcules en un seul passage
+        index_key = (criteria_range.key, sum_range.sheet, row_offset, column_offset)
+        index = self._sumifs.get(index_key)
+        if index is None:
+            index = {}
+            for row, column in data.cells_in(criteria_range):
+                value = _key(self.value(criteria_range.sheet, row, column))
+                index[value] = index.get(value, 0) + self._summable(sum_range.sheet, row + row_offset, column + column_offset)
+            self._sumifs[index_key] = index
+        return index.get(key, 0)
+
+    def _summable(self, sheet, row, column):
+        value = self.value(sheet, row, column)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return value
+        return 0
+
+    def vlookup_row(self, lookup, table, approximate):
+        data = self.sheet(table.sheet)
+        first = Range(table.sheet, table.min_row, table.min_col, table.max_row, table.min_col)
+        if not approximate:
+            index = self._lookups.get(first.key)
+            if index is None:
+                index = {}
+                for row, column in data.cells_in(first):
+                    index.setdefault(_key(self.value(table.sheet, row, column)), row)
+                self._lookups[first.key] = index
+            return index.get(_key(lookup))
+        found = None
+        for row, column in data.cells_in(first):
+            if _compare(self.value(table.sheet, row, column), lookup) > 0:
+                break
+            found = row
+        return found
+
+    def cached_values(self):
+        """Valeurs a ecrire dans le fichier: nom de feuille -> {(ligne, colonne): valeur}"""
+        values = {}
+        for (sheet, row, column), value in self.results.items():
+            if value is not UNSUPPORTED:
+                values.setdefault(sheet, {})[(row, column)] = value
+        return values
+
+    def sheets(self):
+        """Feuilles du modele dont des formules dependent des feuilles externes"""
+        names = {sheet for keys in self.graph.dependents.values() for sheet, _, _ in keys}
+        return [name for name in self.graph.sheets if name in names]
+
+    def preview(self, sheet):
+        """Table (dict de colonnes) des formules calculees d'une feuille: une ligne par ligne de la feuille"""
+        rows = {}
+        for (name, row, column), value in self.results.items():
+            if name == sheet:
+                rows.setdefault(row, {})[column] = value
+        columns = sorted({column for values in rows.values() for column in values})
+        # Libelle de chaque ligne: premier texte de la ligne dans le modele
+        labels = {}
+        cells = self.graph.sheets[sheet].cells if sheet in self.graph.sheets else {}
+        for (row, column), value in sorted(cells.items()):
+            if row in rows and isinstance(value, str) and row not in labels:
+                labels[row] = value
+        table = {"Ligne": [], "Libellé": []}
+        table.update((get_column_letter(column), []) for column in columns)
+        for row in sorted(rows):
+            table["Ligne"].append(row)
+            table["Libellé"].append(labels.get(row, ""))
+            for column in columns:
+                value = rows[row].get(column)
+                if value is UNSUPPORTED:
+                    value = None
+                elif isinstance(value, ExcelError):
+                    value = value.code
+                table[get_column_letter(column)].append(value)
+        return table
+
+    @property
+    def computed(self):
+        return sum(1 for value in self.results.values() if value is not UNSUPPORTED)
+
+
+# Graphes des modeles (cle: empreinte du fichier), autant que de modeles gardes en cache
+_graphs = LRUCache(max_entries=settings.TEMPLATE_CACHE_SIZE)
+_graphs_lock = threading.Lock()
+
+
+def graph_for(template):
+    """FormulaGraph d'un CachedTemplate, construit une seule fois pour tout le serveur"""
+    graph = _graphs.get(template.sha256)
+    if graph is None:
+        with _graphs_lock:
+            graph = _graphs.peek(template.sha256)
+            if graph is None:
+                graph = FormulaGraph(template.workbook)
+                _graphs.put(template.sha256, graph)
+    return graph
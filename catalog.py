@@ -0,0 +1,145 @@
+"""Catalogue des modeles (models.json), partage par toutes les sessions du serveur.
+
+Le catalogue est lu une seule fois et indexe par nom normalise. A chaque acces
+(au plus toutes les settings.CATALOG_CHECK_INTERVAL secondes), les dates de
+modification de models.json et des fichiers de models_excel/ sont comparees a
+celles du dernier chargement: un changement recharge le catalogue sans
+redemarrer le serveur. Les informations de chaque modele (feuilles et plages
+utilisees, taille, empreinte) sont lues dans l'archive zip, sans parser le
+classeur.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import unicodedata
+
+import ooxml
+import settings
+from cache import file_sha256
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_name(name):
+    """Nom de modele compare sans casse, accents ni espaces multiples"""
+    text = unicodedata.normalize("NFKD", str(name))
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(text.lower().split())
+
+
+class TemplateInfo:
+    """Informations d'un fichier modele lues dans l'archive zip"""
+
+    def __init__(self, path):
+        stat = os.stat(path)
+        self.path = path
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+        self.sha256 = file_sha256(path)
+        self.sheets = ooxml.read_workbook_summary(path)
+
+    @property
+    def sheet_names(self):
+        return [sheet["name"] for sheet in self.sheets]
+
+
+class Catalog:
+    """Modeles de models.json, dans l'ordre du fichier, avec leurs informations"""
+
+    def __init__(self, path=settings.CATALOG_PATH, excel_folder="models_excel", check_interval=settings.CATALOG_CHECK_INTERVAL):
+        # Chemins absolus: le catalogue reste valide si le dossier courant change
+        self.path = os.path.abspath(path)
+        self.excel_folder = os.path.abspath(excel_folder)
+        self.check_interval = check_interval
+        self.models = []
+        self._index = {}
+        self._infos = {}
+        self._signature = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+        self.loads = 0
+
+    def _stat(self, path):
+        try:
+            stat = os.stat(path)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def _current_signature(self):
+        try:
+            names = sorted(os.listdir(self.excel_folder))
+        except OSError:
+            names = []
+        return (self._stat(self.path),) + tuple((name, self._stat(os.path.join(self.excel_folder, name))) for name in names)
+
+    def refresh(self, force=False):
+        """Recharge le catalogue si models.json ou un fichier de models_excel/ a change"""
+        now = time.monotonic()
+        if not force and self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return False
+        with self._lock:
+            signature = self._current_signature()
+            changed = signature != self._signature
+            if changed:
+                self._load()
+                self._signature = signature
+            # Date de verification posee apres le chargement: une session concurrente attend
+            # le premier chargement au lieu de lire un catalogue encore vide
+            self._checked_at = now
+            return changed
+
+    def _load(self):
+        models = []
+        try:
+            with open(self.path, encoding="utf-8") as m:
+                models = json.load(m)
+        except (OSError, ValueError) as e:
+            logger.warning("Catalogue des modeles illisible (%s): %s", self.path, e)
+
+        infos = {}
+        index = {}
+        for i, model in enumerate(models):
+            index.setdefault(normalize_name(model.get("nom", "")), i)
+            path = self.template_path(model)
+            info = self._infos.get(path)
+            # Informations relues seulement pour un fichier nouveau ou modifie
+            if info is None or self._stat(path) != (info.mtime_ns, info.size):
+                try:
+                    info = TemplateInfo(path)
+                except Exception as e:
+                    logger.warning("Modele illisible (%s): %s", path, e)
+                    info = None
+            if info is not None:
+                infos[path] = info
+        self.models, self._index, self._infos = models, index, infos
+        self.loads += 1
+
+    def template_path(self, model):
+        return os.path.join(self.excel_folder, model.get("file_path", ""))
+
+    def index(self, name):
+        """Position du modele dans le catalogue (0 si le nom est inconnu)"""
+        self.refresh()
+        return self._index.get(normalize_name(name), 0)
+
+    def get(self, name):
+        """Modele de ce nom, ou None"""
+        self.refresh()
+        i = self._index.get(normalize_name(name))
+        return self.models[i] if i is not None else None
+
+    def info(self, model):
+        """TemplateInfo du fichier du modele, ou None s'il est absent ou illisible"""
+        self.refresh()
+        return self._infos.get(self.template_path(model))
+
+    def __len__(self):
+        self.refresh()
+        return len(self.models)
+
+
+# Catalogue partage par toutes les sessions du serveur
+catalog = Catalog()
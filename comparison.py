@@ -0,0 +1,92 @@
+"""Comparaison N / N-1 des balances, compte par compte.
+
+Les deux balances sont jointes sur le numero de compte par un index trie
+(np.unique), puis les soldes, variations et pourcentages sont calcules en
+operations vectorisees: aucune boucle Python sur les comptes.
+"""
+import numpy as np
+
+STATUS_NEW = "Nouveau"
+STATUS_REMOVED = "Disparu"
+STATUS_BOTH = ""
+
+
+def _same_kind(first, second):
+    """Les numeros de compte doivent avoir le meme type (bytes ou unicode) pour etre joints"""
+    if first.dtype.kind == second.dtype.kind:
+        return first, second
+    return first.astype("U"), second.astype("U")
+
+
+def _first_index(inverse, size):
+    """Pour chaque compte de l'union, indice de sa premiere ligne dans la balance (-1 si absent)"""
+    first = np.full(size, -1, dtype=np.int64)
+    rows = np.arange(len(inverse))
+    # Affectation en ordre inverse: c'est la premiere occurrence qui reste
+    first[inverse[::-1]] = rows[::-1]
+    return first
+
+
+class Comparison:
+    """Resultat de la comparaison: une ligne par compte present en N et/ou en N-1"""
+
+    def __init__(self, balance_n, balance_n1):
+        self.balance_n = balance_n
+        self.balance_n1 = balance_n1
+        accounts_n, accounts_n1 = _same_kind(balance_n.accounts, balance_n1.accounts)
+        self.accounts, inverse = np.unique(np.concatenate([accounts_n, accounts_n1]), return_inverse=True)
+        inverse = inverse.reshape(-1)
+        size = len(self.accounts)
+        index_n, index_n1 = inverse[:len(balance_n)], inverse[len(balance_n):]
+
+        # Un compte peut apparaitre plusieurs fois dans une balance: ses soldes sont additionnes
+        self.solde_n = np.bincount(index_n, weights=balance_n.solde(), minlength=size)
+        self.solde_n1 = np.bincount(index_n1, weights=balance_n1.solde(), minlength=size)
+        self.variation = self.solde_n - self.solde_n1
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.variation_pct = np.where(self.solde_n1 != 0, self.variation / np.abs(self.solde_n1) * 100, np.nan)
+
+        self._first_n = _first_index(index_n, size)
+        self._first_n1 = _first_index(index_n1, size)
+        self.in_n = self._first_n >= 0
+        self.in_n1 = self._first_n1 >= 0
+        self.status = np.where(~self.in_n1, STATUS_NEW, np.where(~self.in_n, STATUS_REMOVED, STATUS_BOTH))
+
+    def __len__(self):
+        return len(self.accounts)
+
+    @property
+    def new_accounts(self):
+        return int((self.in_n & ~self.in_n1).sum())
+
+    @property
+    def removed_accounts(self):
+        return int((self.in_n1 & ~self.in_n).sum())
+
+    def labels(self):
+        """Intitule de chaque compte, pris dans la balance N sinon dans la balance N-1"""
+        return [
+            self.balance_n.label(n) if n >= 0 else self.balance_n1.label(n1)
+            for n, n1 in zip(self._first_n.tolist(), self._first_n1.tolist())
+        ]
+
+    def to_columns(self, sort_by_variation=True):
+        """Table (dict de colonnes) pour l'affichage, triee par variation absolue decroissante"""
+        order = np.argsort(-np.abs(self.variation), kind="stable") if sort_by_variation else np.arange(len(self))
+        accounts = self.accounts[order]
+        if accounts.dtype.kind == "S":
+            accounts = np.char.decode(accounts, "utf-8")
+        labels = self.labels()
+        return {
+            "Compte": accounts,
+            "Intitulé": [labels[i] for i in order.tolist()],
+            "Solde N": self.solde_n[order],
+            "Solde N-1": self.solde_n1[order],
+            "Variation": self.variation[order],
+            "Variation %": self.variation_pct[order],
+            "Statut": self.status[order],
+        }
+
+
+def compare_balances(balance_n, balance_n1):
+    return Comparison(balance_n, balance_n1)
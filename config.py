@@ -1,20 +1,73 @@
 
+import datetime
 import io
-import json
 import os
-from openpyxl import workbook, load_workbook
-from PIL import Image
+from copy import copy
+from zipfile import ZIP_DEFLATED, ZipFile
 
+import openpyxl
+from openpyxl import load_workbook
+from openpyxl.cell.cell import Cell, MergedCell
+from openpyxl.cell.read_only import EmptyCell
+from openpyxl.styles.cell_style import StyleArray
+from openpyxl.styles.numbers import BUILTIN_FORMATS_MAX_SIZE
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.cell_range import MultiCellRange
+from openpyxl.worksheet.merge import MergedCellRange
+from openpyxl.writer.excel import ExcelWriter
 
-def load_models():
-    models = []
-    try:
-        with open("models.json") as m:
-            models = json.load(m)
-    except:
-        pass
+import calculation
+import consolidation
+import delta
+import fec
+import jobs
+import mapping
+import ooxml
+import preview
+import settings
+import thumbnails
+from balance import HEADERS
+from catalog import catalog
+from cache import balance_cache, bytes_sha256, estimate_workbook_size, export_cache, read_uploaded_bytes, template_cache
+from comparison import compare_balances
+from instrumentation import Tracer
+from preflight import PreflightError
+
+# Moteurs d'integration: copie cellule par cellule (openpyxl) ou fusion des paquets xlsx
+ENGINE_OPENPYXL = "openpyxl"
+ENGINE_OOXML = "ooxml"
+
+# Copie des styles: objets recopies attribut par attribut, ou index de styles partages
+STYLE_COPY_ATTRIBUTES = "attributes"
+STYLE_COPY_INTERNED = "interned"
+
+# Import des balances: classeur complet en memoire, ou fichier brut relu en flux a l'integration
+INGESTION_FULL = "full"
+INGESTION_STREAMING = "streaming"
+
+# Parametres de mise en page recopies avec une balance
+PAGE_LAYOUT_ATTRIBUTES = ("page_setup", "page_margins", "HeaderFooter", "print_options")
+
+# Frequence (en lignes) des signalements d'avancement pendant la copie des feuilles
+PROGRESS_EVERY_ROWS = 1000
+
+# Donnees propres a une session, deplacees sur disque quand elle est inactive (voir sessions.py)
+SPILLED_ATTRIBUTES = ("_modele_wb", "excel_data", "baln_data", "baln_1_data")
+
+
+class _ProgressExcelWriter(ExcelWriter):
+    """ExcelWriter d'openpyxl qui signale les lignes enregistrees apres chaque feuille"""
+    
+    def __init__(self, workbook, archive, progress):
+        super().__init__(workbook, archive)
+        self.progress = progress
+        self.rows = 0
+        self.total = sum(getattr(ws, "max_row", 0) for ws in workbook.worksheets)
     
-    return models
+    def write_worksheet(self, ws):
+        super().write_worksheet(ws)
+        self.rows += getattr(ws, "max_row", 0)
+        self.progress("enregistrement", self.rows, self.total)
 
 
 class Config:
@@ -22,119 +75,355 @@ class Config:
         self.model_balances_ = {"modele":False, "baln": False, "baln_1":False}
         self.isIntegrated = False
         self.model_wb = None
+        # Modele partage (cache du processus) et copie privee creee a la premiere modification
+        self.modele_template = None
+        self._modele_wb = None
         self.baln_wb = None
         self.baln_1_wb = None
+        # Empreintes SHA-256 des balances chargees, pour ne pas reparser un fichier inchange
+        self.baln_hash = None
+        self.baln_1_hash = None
+        # Contenu brut des balances, utilise par le moteur OOXML
+        self.baln_data = None
+        self.baln_1_data = None
+        # Balances en colonnes (totaux, filtres, recherches par compte)
+        self.baln_balance = None
+        self.baln_1_balance = None
+        self._comparison = None
+        self._comparison_key = None
+        # Correspondance comptes -> rubriques du modele et totaux calcules pour les balances chargees
+        self.account_mapping = None
+        self._rubrics = None
+        self._rubrics_key = None
+        # Resultats des formules du modele, recalcules par balance modifiee
+        self._evaluation = None
+        # Feuilles du fichier exporte proposees dans l'apercu: (cle du fichier, noms)
+        self._preview_sheets = None
+        self.integration_engine = ENGINE_OOXML
+        self.style_copy_mode = STYLE_COPY_INTERNED
+        self.ingestion_mode = INGESTION_STREAMING
         self.excel_data = None
-        self.modeles = load_models()
+        # Mesures des operations (panneau Performance et journal JSON-lines)
+        self.tracer = Tracer()
+        # Tracer de l'integration en cours (Tracer.fork), fusionne a la fin de la tache
+        self._job_tracer = None
+        # Avancement: fonction (etape, lignes traitees, total) fournie par la tache de fond
+        self.progress = None
+        self.integration_job = None
         self.default_img_path = "models_images"
         self.default_excel_folder = "models_excel"
+        self.default_mapping_folder = "models_mappings"
     
+    @property
+    def modeles(self):
+        """Modèles du catalogue partagé, rechargé si models.json ou models_excel/ change"""
+        catalog.refresh()
+        return catalog.models
     
-    def _copy_worksheet_with_styles(self,st, source_ws, target_ws):
-        """Copie une feuille Excel en préservant tous les styles et formatages"""
-        try:
-            # Copie des dimensions des colonnes
-            for col_letter, dimension in source_ws.column_dimensions.items():
-                target_ws.column_dimensions[col_letter].width = dimension.width
-                target_ws.column_dimensions[col_letter].hidden = dimension.hidden
-            
-            # Copie des dimensions des lignes
-            for row_num, dimension in source_ws.row_dimensions.items():
-                target_ws.row_dimensions[row_num].height = dimension.height
-                target_ws.row_dimensions[row_num].hidden = dimension.hidden
-            
-            # Copie des cellules avec tous leurs attributs
-            for row in source_ws.iter_rows():
+    def model_info(self, model):
+        """Feuilles, taille et empreinte du fichier d'un modèle, lues sans le charger"""
+        return catalog.info(model)
+    
+    @property
+    def modele_wb(self):
+        if self._modele_wb is not None:
+            return self._modele_wb
+        if self.modele_template is not None:
+            return self.modele_template.workbook
+        return None
+    
+    @modele_wb.setter
+    def modele_wb(self, wb):
+        self._modele_wb = wb
+        self.modele_template = None
+    
+    def _get_modele_wb_modifiable(self):
+        """Copie privee du modele (copy-on-write): le classeur du cache n'est jamais modifie"""
+        if self._modele_wb is None and self.modele_template is not None:
+            self._report_progress("copie du modèle", 0)
+            with self.tracer.span("modele.copie", fichier=os.path.basename(self.modele_template.path)):
+                self._modele_wb = self.modele_template.clone()
+        return self._modele_wb
+    
+    
+    def _report_progress(self, stage, done, total=None):
+        if self.progress is not None:
+            self.progress(stage, done, total)
+    
+    
+    def _build_style_map(self, source_wb, target_wb):
+        """Retourne une fonction style source -> style cible, chaque style distinct n'étant converti qu'une fois"""
+        style_map = {}
+        
+        def map_style(style_array):
+            key = tuple(style_array)
+            target = style_map.get(key)
+            if target is None:
+                target = StyleArray()
+                target.fontId = target_wb._fonts.add(source_wb._fonts[style_array.fontId])
+                target.fillId = target_wb._fills.add(source_wb._fills[style_array.fillId])
+                target.borderId = target_wb._borders.add(source_wb._borders[style_array.borderId])
+                target.alignmentId = target_wb._alignments.add(source_wb._alignments[style_array.alignmentId])
+                target.protectionId = target_wb._protections.add(source_wb._protections[style_array.protectionId])
+                num_fmt = style_array.numFmtId
+                if num_fmt >= BUILTIN_FORMATS_MAX_SIZE:
+                    number_format = source_wb._number_formats[num_fmt - BUILTIN_FORMATS_MAX_SIZE]
+                    num_fmt = target_wb._number_formats.add(number_format) + BUILTIN_FORMATS_MAX_SIZE
+                target.numFmtId = num_fmt
+                target.pivotButton = style_array.pivotButton
+                target.quotePrefix = style_array.quotePrefix
+                style_map[key] = target
+            return target
+        
+        return map_style
+    
+    
+    def _copy_cells_interned(self, source_ws, target_ws):
+        """Copie des cellules par index de style, fusions en bloc, mises en forme conditionnelles et validations"""
+        map_style = self._build_style_map(source_ws.parent, target_ws.parent)
+        target_cells = target_ws._cells
+        
+        with self.tracer.span("feuille.cellules") as span:
+            total = source_ws.max_row
+            for index, row in enumerate(source_ws.iter_rows()):
+                if index % PROGRESS_EVERY_ROWS == 0:
+                    self._report_progress(target_ws.title, index, total)
                 for cell in row:
-                    target_cell = target_ws.cell(row=cell.row, column=cell.column)
-                    
-                    # Copie de la valeur
-                    target_cell.value = cell.value
-                    
-                    # Copie du style si disponible
-                    if hasattr(cell, 'has_style') and cell.has_style:
-                        if cell.font:
-                            target_cell.font = cell.font.copy()
-                        if cell.fill:
-                            target_cell.fill = cell.fill.copy()
-                        if cell.border:
-                            target_cell.border = cell.border.copy()
-                        if cell.alignment:
-                            target_cell.alignment = cell.alignment.copy()
-                        if cell.number_format:
-                            target_cell.number_format = cell.number_format
-                        if cell.protection:
-                            target_cell.protection = cell.protection.copy()
-            
-            # Copie des cellules fusionnées
-            for merged_range in source_ws.merged_cells.ranges:
-                target_ws.merge_cells(str(merged_range))
-            
-            # Copie des paramètres de mise en page (avec vérification d'existence)
-            try:
-                if hasattr(source_ws, 'page_setup') and source_ws.page_setup:
-                    target_ws.page_setup = source_ws.page_setup
-            except:
-                pass
+                    key = (cell.row, cell.column)
+                    if isinstance(cell, MergedCell):
+                        target_cell = MergedCell(target_ws, row=cell.row, column=cell.column)
+                    else:
+                        target_cell = Cell(target_ws, row=cell.row, column=cell.column, value=cell._value)
+                        target_cell.data_type = cell.data_type
+                    if cell.has_style:
+                        # Chaque cellule garde son propre StyleArray (openpyxl les modifie en place)
+                        target_cell._style = StyleArray(map_style(cell._style))
+                    target_cells[key] = target_cell
+            span.rows, span.cells = source_ws.max_row, len(target_cells)
+        
+        # Cellules fusionnées: les plages sont ajoutées en une fois, les cellules masquées sont déjà copiées
+        with self.tracer.span("feuille.fusions") as span:
+            target_ws.merged_cells = MultiCellRange(
+                [MergedCellRange(target_ws, merged_range.coord) for merged_range in source_ws.merged_cells.ranges]
+            )
+            span.attrs["plages"] = len(target_ws.merged_cells.ranges)
+        
+        for conditional_format in source_ws.conditional_formatting:
+            for rule in conditional_format.rules:
+                target_ws.conditional_formatting.add(str(conditional_format.sqref), copy(rule))
+        
+        for validation in source_ws.data_validations.dataValidation:
+            target_ws.add_data_validation(copy(validation))
+    
+    
+    def _copy_worksheet_streaming(self, st, source_data, target_ws):
+        """Copie la feuille active d'une balance en la lisant ligne par ligne (openpyxl en lecture seule)"""
+        source_wb = load_workbook(io.BytesIO(source_data), read_only=True, data_only=False)
+        try:
+            columns, merged = ooxml.read_sheet_layout(source_data)
+            for column in columns:
+                for index in range(int(column.get("min", 1)), int(column.get("max", 1)) + 1):
+                    dimension = target_ws.column_dimensions[get_column_letter(index)]
+                    if "width" in column:
+                        dimension.width = float(column["width"])
+                    dimension.hidden = column.get("hidden") in ("1", "true")
             
-            try:
-                if hasattr(source_ws, 'page_margins') and source_ws.page_margins:
-                    target_ws.page_margins = source_ws.page_margins
-            except:
-                pass
+            map_style = self._build_style_map(source_wb, target_ws.parent)
+            cell_styles = source_wb._cell_styles
+            target_cells = target_ws._cells
+            with self.tracer.span("feuille.cellules", mode="flux") as span:
+                rows = 0
+                for row in source_wb.active.iter_rows():
+                    if rows % PROGRESS_EVERY_ROWS == 0:
+                        self._report_progress(target_ws.title, rows, source_wb.active.max_row)
+                    rows += 1
+                    for cell in row:
+                        if isinstance(cell, EmptyCell):
+                            continue
+                        target_cell = Cell(target_ws, row=cell.row, column=cell.column, value=cell.value)
+                        target_cell.data_type = cell.data_type
+                        if cell._style_id:
+                            target_cell._style = StyleArray(map_style(cell_styles[cell._style_id]))
+                        target_cells[(cell.row, cell.column)] = target_cell
+                span.rows, span.cells = rows, len(target_cells)
             
+            with self.tracer.span("feuille.fusions") as span:
+                target_ws.merged_cells = MultiCellRange([MergedCellRange(target_ws, ref) for ref in merged])
+                for merged_range in target_ws.merged_cells.ranges:
+                    cells = merged_range.cells
+                    next(cells)
+                    for row, column in cells:
+                        target_cells[(row, column)] = MergedCell(target_ws, row=row, column=column)
+                span.attrs["plages"] = len(merged)
+        finally:
+            source_wb.close()
+    
+    
+    def _copy_page_layout(self, source_ws, target_ws):
+        """Copie la mise en page et l'affichage; retourne la liste des paramètres non copiés"""
+        failures = []
+        for name in PAGE_LAYOUT_ATTRIBUTES:
             try:
-                if hasattr(source_ws, 'header_footer') and source_ws.header_footer:
-                    target_ws.header_footer = source_ws.header_footer
-            except:
-                pass
-            
-            # Copie des paramètres d'impression additionnels
+                value = copy(getattr(source_ws, name))
+                if name == "page_setup":
+                    # Les parametres d'imprimante (r:id) ne sont pas recopies avec la feuille
+                    value._parent, value.id = target_ws, None
+                setattr(target_ws, name, value)
+            except Exception as e:
+                failures.append(f"{name} ({e})")
+        try:
+            # sheet_view n'a pas de setter: la vue est remplacee dans la liste des vues
+            view = copy(source_ws.sheet_view)
+            view.tabSelected = False
+            target_ws.views.sheetView[0] = view
+        except Exception as e:
+            failures.append(f"sheet_view ({e})")
+        return failures
+    
+    
+    def _copy_worksheet_with_styles(self,st, source_ws, target_ws):
+        """Copie une feuille Excel en préservant tous les styles et formatages"""
+        with self.tracer.span("feuille.copie", feuille=target_ws.title, mode=self.style_copy_mode) as span:
             try:
-                if hasattr(source_ws, 'print_options') and source_ws.print_options:
-                    target_ws.print_options = source_ws.print_options
-            except:
-                pass
+                # Copie des dimensions des colonnes
+                for col_letter, dimension in source_ws.column_dimensions.items():
+                    target_ws.column_dimensions[col_letter].width = dimension.width
+                    target_ws.column_dimensions[col_letter].hidden = dimension.hidden
+                
+                # Copie des dimensions des lignes
+                for row_num, dimension in source_ws.row_dimensions.items():
+                    target_ws.row_dimensions[row_num].height = dimension.height
+                    target_ws.row_dimensions[row_num].hidden = dimension.hidden
+                
+                if self.style_copy_mode == STYLE_COPY_INTERNED:
+                    self._copy_cells_interned(source_ws, target_ws)
+                else:
+                    # Copie des cellules avec tous leurs attributs
+                    with self.tracer.span("feuille.cellules") as cells_span:
+                        for index, row in enumerate(source_ws.iter_rows()):
+                            if index % PROGRESS_EVERY_ROWS == 0:
+                                self._report_progress(target_ws.title, index, source_ws.max_row)
+                            for cell in row:
+                                target_cell = target_ws.cell(row=cell.row, column=cell.column)
+                            
+                                # Copie de la valeur
+                                target_cell.value = cell.value
+                            
+                                # Copie du style si disponible
+                                if hasattr(cell, 'has_style') and cell.has_style:
+                                    if cell.font:
+                                        target_cell.font = cell.font.copy()
+                                    if cell.fill:
+                                        target_cell.fill = cell.fill.copy()
+                                    if cell.border:
+                                        target_cell.border = cell.border.copy()
+                                    if cell.alignment:
+                                        target_cell.alignment = cell.alignment.copy()
+                                    if cell.number_format:
+                                        target_cell.number_format = cell.number_format
+                                    if cell.protection:
+                                        target_cell.protection = cell.protection.copy()
+                        cells_span.rows, cells_span.cells = source_ws.max_row, len(target_ws._cells)
+                
+                    # Copie des cellules fusionnées
+                    with self.tracer.span("feuille.fusions") as merges_span:
+                        for merged_range in source_ws.merged_cells.ranges:
+                            target_ws.merge_cells(str(merged_range))
+                        merges_span.attrs["plages"] = len(source_ws.merged_cells.ranges)
+                
+                # Copie des paramètres de mise en page et d'impression
+                with self.tracer.span("feuille.mise_en_page") as layout_span:
+                    failures = self._copy_page_layout(source_ws, target_ws)
+                    if failures:
+                        layout_span.fail(", ".join(failures))
+                        st.warning(f"Mise en page de '{target_ws.title}' partiellement copiée: {', '.join(failures)}")
                 
+                span.rows, span.cells = source_ws.max_row, len(target_ws._cells)
+            except Exception as e:
+                span.fail(e)
+                st.warning(f"Copie avec styles partielle de '{target_ws.title}': {str(e)}")
+    
+    
+    def _add_balances_ooxml(self, st):
+        """Intègre les balances directement dans le paquet xlsx du modèle, sans openpyxl"""
+        with self.tracer.span("integration.ooxml") as span:
             try:
-                if hasattr(source_ws, 'sheet_view') and source_ws.sheet_view:
-                    target_ws.sheet_view = source_ws.sheet_view
-            except:
-                pass
-            
-        except Exception as e:
-            pass
-            # st.warning(f"Copie avec styles partielle: {str(e)}. Basculement vers copie simple.")
-            # Fallback vers copie simple
-            # self._copy_worksheet_simple(source_ws, target_ws)
+                totals = {'BAL N': self.baln_balance, 'BAL N-1': self.baln_1_balance}
+                sheets = {'BAL N': self.baln_data, 'BAL N-1': self.baln_1_data}
+                rubrics = self._rubrics_sheet()
+                if rubrics is not None:
+                    sheets[rubrics[0]] = rubrics[1]
+                values = self._formula_values(st)
+                self.excel_data = export_cache.store(self._export_key(), lambda output: ooxml.integrate_balances(
+                    self.modele_template.path,
+                    sheets,
+                    output=output,
+                    progress=lambda name, rows: self._report_progress(name, rows, len(totals[name]) if totals.get(name) is not None else None),
+                    cached_values=values,
+                ))
+                span.rows = sum(len(b) for b in (self.baln_balance, self.baln_1_balance) if b is not None)
+                span.attrs["taille"] = len(self.excel_data)
+                return True
+            except Exception as e:
+                span.fail(e)
+                st.error(f"Erreur lors de l'integration des balances: {str(e)}")
+                return False
     
     
     def add_balances_to_modele(self, st):
         """Ajoute les balances au modèle Excel en préservant leur style original"""
-        try:
-            # Suppression des anciennes feuilles si elles existent
-            if 'BAL N' in self.modele_wb.sheetnames:
-                del self.modele_wb['BAL N']
-            if 'BAL N-1' in self.modele_wb.sheetnames:
-                del self.modele_wb['BAL N-1']
-            
-            # Ajout de la balance N en préservant le style original
-            if self.baln_wb is not None:
-                # Copie de la feuille originale avec tous ses styles
-                source_sheet = self.baln_wb.active
-                target_sheet = self.modele_wb.create_sheet('BAL N')
-                self._copy_worksheet_with_styles(st, source_sheet, target_sheet)
+        with self.tracer.span("integration", moteur=self.integration_engine) as span:
+            if self.integration_engine == ENGINE_OOXML and self.modele_template is not None:
+                ok = self._add_balances_ooxml(st)
             else:
-                pass
-            
-            # Ajout de la balance N-1 si disponible
-            if self.baln_1_wb is not None:
-                # Copie de la feuille originale avec tous ses styles
-                source_sheet = self.baln_1_wb.active
-                target_sheet = self.modele_wb.create_sheet('BAL N-1')
-                self._copy_worksheet_with_styles(st, source_sheet, target_sheet)
-            else:
-                pass
+                ok = self._add_balances_openpyxl(st)
+            if not ok:
+                span.fail("integration interrompue")
+            return ok
+    
+    
+    def _add_balances_openpyxl(self, st):
+        try:
+            modele_wb = self._get_modele_wb_modifiable()
+            # Balance a l'origine de chaque feuille deja integree dans ce classeur
+            states = delta.sheet_states(modele_wb)
+            sheets = [
+                ('BAL N', self.baln_hash, self.baln_data, self.baln_balance, self.baln_wb),
+                ('BAL N-1', self.baln_1_hash, self.baln_1_data, self.baln_1_balance, self.baln_1_wb),
+            ]
+            rubrics = self._rubrics_sheet()
+            if rubrics is not None:
+                # Feuille de quelques dizaines de lignes: toujours recopiee
+                sheets.append((rubrics[0], None, rubrics[1], None, None))
+            for name, digest, data, balance, source_wb in sheets:
+                state = states.get(name)
+                if name in modele_wb.sheetnames and state is not None and data is not None:
+                    if state.digest == digest:
+                        # Balance inchangee depuis la derniere integration
+                        with self.tracer.span("feuille.inchangee", feuille=name):
+                            continue
+                    if self._patch_balance_sheet(modele_wb[name], state, digest, balance, data):
+                        continue
+                
+                # Copie complete: la feuille est recreee a la meme position
+                states.pop(name, None)
+                index = None
+                if name in modele_wb.sheetnames:
+                    index = modele_wb.sheetnames.index(name)
+                    del modele_wb[name]
+                if source_wb is not None:
+                    # Copie de la feuille originale avec tous ses styles
+                    target_sheet = modele_wb.create_sheet(name, index)
+                    self._copy_worksheet_with_styles(st, source_wb.active, target_sheet)
+                elif data is not None:
+                    # Balance importee en mode flux: relue ligne par ligne
+                    target_sheet = modele_wb.create_sheet(name, index)
+                    with self.tracer.span("feuille.copie", feuille=name, mode="flux"):
+                        self._copy_worksheet_streaming(st, data, target_sheet)
+                else:
+                    continue
+                if balance is not None:
+                    states[name] = delta.SheetState(digest, balance, data, target_sheet.max_column)
             
             return True
         except Exception as e:
@@ -142,56 +431,425 @@ class Config:
             return False
     
     
+    def _patch_balance_sheet(self, target_ws, state, digest, balance, data):
+        """Réécrit seulement les lignes modifiées d'une balance réimportée; False si la feuille doit être recopiée"""
+        states = delta.sheet_states(target_ws.parent)
+        with self.tracer.span("feuille.delta", feuille=target_ws.title) as span:
+            # L'etat est retire pendant la modification: une feuille a moitie modifiee sera recopiee
+            del states[target_ws.title]
+            try:
+                self._report_progress(f"mise à jour de '{target_ws.title}'", 0, len(balance))
+                changed, width = delta.patch_sheet(target_ws, state, balance, data, self._build_style_map)
+            except delta.DeltaUnsupported as e:
+                span.attrs["repli"] = str(e)
+                return False
+            span.rows = changed
+            states[target_ws.title] = delta.SheetState(digest, balance, data, width)
+            return True
+    
+    
     def get_excel_file_download(self, st):
         """Génère le fichier Excel téléchargeable"""
+        if self.integration_engine == ENGINE_OOXML and self.excel_data is not None:
+            # Le moteur OOXML produit directement le fichier final
+            return self.excel_data
+        
         if not self.modele_wb:
             return None
         
-        try:
-            buffer = io.BytesIO()
-            self.modele_wb.save(buffer)
-            buffer.seek(0)
-            self.excel_data= buffer.getvalue()
-            return self.excel_data
-        except Exception as e:
-            st.error(f"Erreur lors de la génération du fichier: {str(e)}")
+        with self.tracer.span("export.enregistrement") as span:
+            try:
+                # Enregistre dans un fichier temporaire puis garde dans le cache des exports
+                values = self._formula_values(st)
+                self.excel_data = export_cache.store(self._export_key(), lambda output: self._save_workbook(self.modele_wb, output, values))
+                span.cells = sum(len(ws._cells) for ws in self.modele_wb.worksheets)
+                span.attrs["taille"] = len(self.excel_data)
+                return self.excel_data
+            except Exception as e:
+                span.fail(e)
+                st.error(f"Erreur lors de la génération du fichier: {str(e)}")
+                return None
+    
+    
+    def _save_workbook(self, workbook, buffer, values=None):
+        """Workbook.save, avec signalement de l'avancement feuille par feuille si demandé.
+
+        values: valeurs calculées des formules, écrites en cache dans le fichier (openpyxl ne les écrit pas)
+        """
+        if values:
+            saved = io.BytesIO()
+            self._save_workbook(workbook, saved)
+            ooxml.set_cached_values(saved.getvalue(), values, buffer)
+            return
+        if self.progress is None:
+            workbook.save(buffer)
+            return
+        archive = ZipFile(buffer, "w", ZIP_DEFLATED, allowZip64=True)
+        workbook.properties.modified = datetime.datetime.now(tz=datetime.timezone.utc).replace(tzinfo=None)
+        _ProgressExcelWriter(workbook, archive, self._report_progress).save()
+    
+    
+    def integrate(self, st):
+        """Intègre les balances puis génère le fichier final, mesurés comme une seule opération"""
+        with self.tracer.span("traitement") as span:
+            key = self._export_key()
+            data = export_cache.get(key) if key is not None else None
+            if data is not None:
+                # Meme modele, memes balances, meme moteur: le fichier deja produit est reutilise
+                span.attrs["cache"] = True
+                span.attrs["taille"] = len(data)
+                self.excel_data = data
+                return True
+            return self.add_balances_to_modele(st) and self.get_excel_file_download(st) is not None
+    
+    
+    def _export_key(self):
+        """Clé du fichier exporté dans export_cache; None si le modèle n'est pas un fichier du catalogue"""
+        if self.modele_template is None:
             return None
+        if self.integration_engine == ENGINE_OOXML:
+            engine = ooxml.ENGINE_VERSION
+        else:
+            engine = "%s-%s" % (ENGINE_OPENPYXL, openpyxl.__version__)
+        rubrics = self.account_mapping.sha256 if self.account_mapping is not None else None
+        formulas = calculation.VERSION if settings.FORMULA_EVALUATION else None
+        return export_cache.key(self.modele_template.sha256, self.baln_hash, self.baln_1_hash, rubrics, formulas, engine)
+    
+    
+    def _integration_key(self):
+        template = self.modele_template.path if self.modele_template is not None else id(self._modele_wb)
+        return (template, self.baln_hash, self.baln_1_hash, self.integration_engine)
+    
+    
+    def estimate_integration_memory(self):
+        """Mémoire (octets) estimée d'une intégration, d'après la taille des balances importées"""
+        data_size = sum(len(data) for data in (self.baln_data, self.baln_1_data) if data is not None)
+        template_size = os.path.getsize(self.modele_template.path) if self.modele_template is not None else 0
+        if self.integration_engine == ENGINE_OOXML and self.modele_template is not None:
+            # Fusion en flux: fichiers sources et fichier produit
+            return 2 * (template_size + data_size)
+        rows = sum(len(balance) for balance in (self.baln_balance, self.baln_1_balance) if balance is not None)
+        # Cellules des balances copiees dans le modele, plus la copie privee du modele si elle reste a faire
+        cells = rows * len(HEADERS) * settings.CELL_SIZE_ESTIMATE
+        template = template_size * settings.XLSX_MEMORY_FACTOR if self._modele_wb is None else 0
+        return cells + template + data_size
+    
+    
+    def start_integration(self, profile=False):
+        """Lance l'intégration en tâche de fond; le résultat est rattaché par finish_integration"""
+        # La tache travaille sur une copie de la configuration: les reruns du script
+        # (changement de modele, nouvel import) ne modifient pas ses donnees, et la
+        # tache ne modifie rien de ce que lisent les reruns
+        key, memory = self._integration_key(), self.estimate_integration_memory()
+        snapshot = copy(self)
+        snapshot.integration_job = None
+        # Mesures de la tache a part (deque non partagee), reprises par finish_integration
+        snapshot.tracer = self._job_tracer = self.tracer.fork()
+        workbook = self._modele_wb
+        if workbook is not None and self.modele_template is not None:
+            # Classeur confie a la tache: rendu a la session seulement si elle reussit,
+            # sinon la prochaine integration repart d'une copie du modele partage
+            self._modele_wb = None
+            workbook = None
+        
+        def run(job):
+            snapshot.progress = job.progress
+            if workbook is not None:
+                # Modele importe (pas de modele partage): la tache modifie sa propre copie
+                snapshot._modele_wb = delta.clone_workbook(workbook)
+            action = lambda: snapshot.integrate(job.reporter)
+            ok = snapshot.tracer.profile(action) if profile else action()
+            if not ok:
+                raise RuntimeError("; ".join(job.reporter.errors) or "Intégration interrompue")
+            return snapshot
+        
+        self.integration_job = jobs.submit("integration", run, key=key, memory=memory)
+        return self.integration_job
+    
+    
+    def finish_integration(self):
+        """Rattache le résultat de la tâche terminée à la session; retourne la tâche"""
+        job = self.integration_job
+        if job is None or not job.finished:
+            return None
+        self.integration_job = None
+        if self._job_tracer is not None:
+            self.tracer.merge(self._job_tracer)
+            self._job_tracer = None
+        if job.status == jobs.JOB_DONE:
+            if job.key != self._integration_key():
+                job.reporter.warning("Le modèle ou les balances ont changé pendant l'intégration: relancez-la")
+                return job
+            snapshot = job.result
+            self._modele_wb = snapshot._modele_wb
+            self.excel_data = snapshot.excel_data
+            self._evaluation = snapshot._evaluation
+            self.isIntegrated = True
+            # Les classeurs des balances ne servent plus: le cache partage peut les liberer
+            self.baln_wb = self.baln_1_wb = None
+        return job
+    
+    
+    def memory_size(self):
+        """Mémoire (octets) estimée des données propres à la session"""
+        size = sum(len(data) for data in (self.excel_data, self.baln_data, self.baln_1_data) if data is not None)
+        if self._modele_wb is not None:
+            size += estimate_workbook_size(self._modele_wb)
+        return size
+    
+    
+    def is_busy(self):
+        """Une intégration est en cours ou son résultat n'a pas encore été rattaché"""
+        return self.integration_job is not None
+    
+    
+    def spill_state(self):
+        """Données à déplacer sur disque, ou None si la session n'a rien à libérer"""
+        state = {name: getattr(self, name) for name in SPILLED_ATTRIBUTES}
+        if all(value is None for value in state.values()):
+            return None
+        if self._modele_wb is not None:
+            # Etat de la reintegration incrementale, attache au classeur
+            state["delta"] = dict(delta.sheet_states(self._modele_wb))
+        return state
+    
+    
+    def release_spilled(self):
+        for name in SPILLED_ATTRIBUTES:
+            setattr(self, name, None)
+        self.baln_wb = self.baln_1_wb = None
+    
+    
+    def restore_spilled(self, state):
+        states = state.pop("delta", None)
+        for name, value in state.items():
+            setattr(self, name, value)
+        if states and self._modele_wb is not None:
+            delta.sheet_states(self._modele_wb).update(states)
     
     
     def display_image(self, st, image_path):
-        """Affiche une image avec gestion d'erreur"""
+        """Affiche la miniature d'une image; l'image d'origine n'est chargée qu'à la demande"""
         try:
             if os.path.exists(image_path):
-                image = Image.open(image_path)
-                st.image(image, use_container_width=True)
-                # return True
+                st.image(thumbnails.get_thumbnail(image_path, settings.THUMBNAIL_DISPLAY_WIDTH), use_container_width=True)
+                if st.toggle("🔍 Taille réelle", key=f"image_complete_{image_path}"):
+                    # Fichier d'origine transmis tel quel, sans passer par PIL
+                    with open(image_path, "rb") as f:
+                        st.image(f.read())
             else:
                 st.warning(f"Image non trouvée: {image_path}")
-                # return False
         except Exception as e:
             st.error(f"Erreur lors du chargement de l'image: {str(e)}")
-            # return False
     
     def get_index_model(self, model_choisi:str):
-        if self.modeles:
-            for i, model in enumerate(self.modeles):
-                if model["nom"].lower() == model_choisi.lower():
-                    return i
-        
-        return 0
+        return catalog.index(model_choisi)
 
     def load_excel(self, st, uploaded_file, type=1):
         try:
             if type==1:
-                self.modele_wb = load_workbook(uploaded_file, data_only=False)
+                if isinstance(uploaded_file, (str, os.PathLike)):
+                    # Modele du catalogue: parse une seule fois pour tout le serveur
+                    template = template_cache.get(uploaded_file)
+                    if template is not self.modele_template:
+                        self.modele_template = template
+                        self._modele_wb = None
+                else:
+                    with self.tracer.span("chargement.modele"):
+                        self.modele_wb = load_workbook(uploaded_file, data_only=False)
             elif type==2:
-                self.baln_wb = load_workbook(uploaded_file, data_only=False)
+                with self.tracer.span("chargement.balance_n", mode=self.ingestion_mode) as span:
+                    data = read_uploaded_bytes(uploaded_file)
+                    self.baln_hash, self.baln_wb, self.baln_balance = self._load_balance(data)
+                    self.baln_data = data
+                    span.rows, span.attrs["taille"] = len(self.baln_balance), len(self.baln_data)
             else:
-                self.baln_1_wb = load_workbook(uploaded_file, data_only=False)
+                with self.tracer.span("chargement.balance_n_1", mode=self.ingestion_mode) as span:
+                    data = read_uploaded_bytes(uploaded_file)
+                    self.baln_1_hash, self.baln_1_wb, self.baln_1_balance = self._load_balance(data)
+                    self.baln_1_data = data
+                    span.rows, span.attrs["taille"] = len(self.baln_1_balance), len(self.baln_1_data)
             return True
+        except PreflightError as e:
+            st.error(f"Fichier de balance refusé: {str(e)}")
+            return False
         except Exception as e:
             st.error(f"Erreur lors du chargement du modèle: {str(e)}")
             return False
+
+    def _load_balance(self, data):
+        """(empreinte, classeur ou None en mode flux, Balance) d'une balance importee.
+
+        Les controles rapides passent avant toute lecture complete: un fichier refuse
+        (PreflightError) ne va jamais jusqu'a openpyxl.
+        """
+        with self.tracer.span("chargement.controle") as span:
+            checked = balance_cache.preflight(data)
+            span.attrs["dimension"] = checked.dimension
+        if self.ingestion_mode == INGESTION_STREAMING:
+            workbook = None
+        else:
+            _, workbook = balance_cache.get(data, checked.digest)
+        _, balance = balance_cache.get_balance(data, checked)
+        return checked.digest, workbook, balance
+    
+    def load_fec(self, st, uploaded_file):
+        """Importe un FEC: balances des deux derniers exercices calculées en flux, chargées comme N et N-1.
+
+        Retourne les exercices chargés, du plus récent au plus ancien (liste vide en cas d'erreur).
+        """
+        try:
+            with self.tracer.span("chargement.fec") as span:
+                result = fec.read_fec(uploaded_file)
+                span.rows = result.lines
+                span.attrs["exercices"] = result.years
+        except Exception as e:
+            st.error(f"Erreur lors de la lecture du FEC: {str(e)}")
+            return []
+        if result.skipped:
+            st.warning(f"{result.skipped} lignes du FEC ont été ignorées (format invalide)")
+        years = result.years[:2]
+        if not years:
+            st.error("Aucune écriture trouvée dans le FEC")
+            return []
+        # Les balances calculees suivent ensuite le meme chemin qu'un fichier xlsx importe
+        for year, type in zip(years, (2, 3)):
+            data = fec.to_xlsx(result.balances[year], f"Balance {year} (FEC)")
+            if not self.load_excel(st, io.BytesIO(data), type):
+                return []
+        return years
+
+    def load_consolidation(self, st, uploaded_files, type, per_entity=False):
+        """Consolide les balances de plusieurs entités et charge le résultat comme balance N (type 2) ou N-1 (type 3).
+
+        Retourne la Consolidation, ou None en cas d'erreur.
+        """
+        files = [(getattr(f, "name", str(f)), read_uploaded_bytes(f)) for f in uploaded_files]
+        try:
+            with self.tracer.span("chargement.consolidation", entites=len(files)) as span:
+                result = consolidation.consolidate(files)
+                data = consolidation.to_xlsx(result, "Balance consolidée (%d entités)" % len(files), per_entity)
+                span.rows = len(result)
+        except consolidation.ConsolidationError as e:
+            st.error(f"Consolidation impossible: {str(e)}")
+            return None
+        except Exception as e:
+            st.error(f"Erreur lors de la consolidation: {str(e)}")
+            return None
+        # Balance consolidee deja construite: le fichier xlsx n'est pas relu par load_excel
+        balance_cache.put_balance(bytes_sha256(data), result.balance)
+        if not self.load_excel(st, io.BytesIO(data), type):
+            return None
+        return result
+
+    def load_mapping(self, st, model):
+        """Correspondance comptes -> rubriques du modèle (clé "mapping" de models.json); False si le modèle n'en a pas"""
+        name = model.get("mapping")
+        if not name:
+            self.account_mapping = None
+            return False
+        try:
+            # Fichier lu une seule fois pour tout le serveur, relu s'il change
+            self.account_mapping = mapping.load_mapping(os.path.join(self.default_mapping_folder, name))
+            return True
+        except (OSError, mapping.MappingError) as e:
+            self.account_mapping = None
+            st.warning(f"Correspondance des rubriques indisponible pour ce modèle: {str(e)}")
+            return False
+    
+    def rubric_totals(self):
+        """Totaux des rubriques pour les balances N et N-1, recalculés quand la correspondance ou une balance change"""
+        if self.account_mapping is None or self.baln_balance is None:
+            return None
+        key = (self.account_mapping.sha256, self.baln_hash, self.baln_1_hash)
+        if self._rubrics is None or self._rubrics_key != key:
+            with self.tracer.span("rubriques", rubriques=len(self.account_mapping)) as span:
+                self._rubrics = self.account_mapping.totals(self.baln_balance, self.baln_1_balance)
+                span.rows = sum(len(b) for b in (self.baln_balance, self.baln_1_balance) if b is not None)
+                span.attrs["non_rattaches"] = self._rubrics.unmapped_count
+            self._rubrics_key = key
+        return self._rubrics
+    
+    def _rubrics_sheet(self):
+        """(nom, contenu xlsx) de la feuille des totaux par rubrique, ou None sans correspondance"""
+        totals = self.rubric_totals()
+        if totals is None:
+            return None
+        return self.account_mapping.sheet_name, totals.to_xlsx()
+    
+    def evaluate_formulas(self):
+        """Résultats des formules du modèle pour les balances chargées (None si le calcul est désactivé).
+
+        Le graphe des formules est construit une fois par modèle; seules les formules qui
+        dépendent d'une balance modifiée depuis le dernier calcul sont recalculées.
+        """
+        if not settings.FORMULA_EVALUATION or self.modele_template is None or self.baln_balance is None:
+            return None
+        with self.tracer.span("formules") as span:
+            graph = calculation.graph_for(self.modele_template)
+            # La tache de fond travaille sur une copie: les resultats de la session ne changent qu'a la fin
+            evaluation = self._evaluation.copy() if self._evaluation is not None and self._evaluation.graph is graph \
+                else calculation.Evaluation(graph)
+            sources = {
+                'BAL N': (self.baln_hash, lambda: self.baln_data),
+                'BAL N-1': (self.baln_1_hash, lambda: self.baln_1_data),
+            }
+            if self.rubric_totals() is not None:
+                sources[self.account_mapping.sheet_name] = (self._rubrics_key, lambda: self._rubrics_sheet()[1])
+            self._report_progress("calcul des formules", 0, len(graph))
+            span.cells = evaluation.update(sources)
+            span.attrs["non_calculees"] = len(graph.unsupported)
+            self._evaluation = evaluation
+        return evaluation
+    
+    def _formula_values(self, st):
+        """Valeurs à écrire en cache dans le fichier exporté; None si les formules n'ont pas pu être calculées"""
+        try:
+            evaluation = self.evaluate_formulas()
+        except Exception as e:
+            st.warning(f"Les formules du modèle n'ont pas été calculées (Excel les calculera à l'ouverture): {str(e)}")
+            return None
+        return evaluation.cached_values() if evaluation is not None else None
+    
+    def _preview_key(self):
+        """Clé du fichier exporté pour l'aperçu: celle d'export_cache, sinon l'empreinte du contenu"""
+        return self._export_key() or bytes_sha256(self.excel_data)
+    
+    def preview_sheets(self):
+        """Feuilles du fichier exporté, balances intégrées en premier (lues sans parser le classeur)"""
+        if self.excel_data is None:
+            return []
+        key = self._preview_key()
+        if self._preview_sheets is None or self._preview_sheets[0] != key:
+            names = [sheet["name"] for sheet in ooxml.read_workbook_summary(self.excel_data)]
+            first = [name for name in ('BAL N', 'BAL N-1') if name in names]
+            self._preview_sheets = (key, first + [name for name in names if name not in first])
+        return self._preview_sheets[1]
+    
+    def sheet_preview(self, st, name):
+        """SheetPreview d'une feuille du fichier exporté, lue une seule fois puis affichée par pages"""
+        if self.excel_data is None:
+            return None
+        try:
+            with self.tracer.span("apercu", feuille=name) as span:
+                sheet = preview.sheet_preview(self.excel_data, self._preview_key(), name)
+                span.rows = len(sheet)
+            return sheet
+        except Exception as e:
+            st.error(f"Aperçu de la feuille '{name}' indisponible: {str(e)}")
+            return None
+    
+    def compare_balances(self):
+        """Comparaison N / N-1, recalculée uniquement quand l'une des balances change"""
+        if self.baln_balance is None or self.baln_1_balance is None:
+            return None
+        key = (self.baln_hash, self.baln_1_hash)
+        if self._comparison is None or self._comparison_key != key:
+            with self.tracer.span("comparaison") as span:
+                self._comparison = compare_balances(self.baln_balance, self.baln_1_balance)
+                span.rows = len(self._comparison)
+            self._comparison_key = key
+        return self._comparison
     
     def model_choisi(self):
         self.model_balances_["modele"] = True
@@ -204,5 +862,5 @@ class Config:
 
 
 if __name__=="__main__":
-    print(load_models())
+    print(Config().modeles)
 
@@ -0,0 +1,182 @@
+"""Consolidation des balances de plusieurs entites (filiales d'un groupe) en une seule.
+
+Les fichiers d'un exercice passent les controles rapides (preflight.py) puis
+sont lus en parallele dans un pool de processus partage par le serveur: le
+temps total suit le nombre de coeurs et non le nombre d'entites. Une balance
+deja lue (meme contenu) est reprise du cache des balances.
+
+Les comptes sont joints par numero (np.unique) et les montants additionnes par
+np.bincount, sans boucle Python sur les comptes. Les soldes d'ouverture et de
+cloture sont presentes nets, au debit ou au credit, comme dans une balance; les
+mouvements restent bruts.
+
+La balance consolidee est ecrite en xlsx au format de 'BAL N' (colonnes A a H),
+avec les colonnes de prefixes de compte que lisent les formules du modele
+(J a N) et, en option, le solde de cloture de chaque entite.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+from openpyxl.utils import get_column_letter
+
+import ooxml
+import settings
+from balance import AMOUNT_COLUMNS, HEADERS, PREFIX_COLUMNS, Balance
+from cache import balance_cache
+from comparison import _first_index
+from preflight import PreflightError
+
+# Premiere colonne des soldes par entite (apres les colonnes de prefixes)
+ENTITY_FIRST_COLUMN = 16
+
+
+class ConsolidationError(ValueError):
+    """Fichiers refuses ou illisibles"""
+
+
+class Consolidation:
+    """Balance consolidee et detail par entite"""
+
+    def __init__(self, balance, entities, counts, entity_soldes):
+        self.balance = balance
+        self.entities = entities
+        # Nombre de comptes de chaque entite
+        self.counts = counts
+        # Solde de cloture (debit - credit) de chaque compte par entite: (comptes, entites)
+        self.entity_soldes = entity_soldes
+
+    def __len__(self):
+        return len(self.balance)
+
+
+def _read(data, detected):
+    """Lecture d'une balance dans un processus du pool"""
+    return Balance.from_xlsx(data, detected)
+
+
+# Pool de processus partage (demarre au premier besoin, processus neufs: pas de fork du serveur)
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _executor():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=settings.CONSOLIDATION_WORKERS,
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def read_balances(files):
+    """Balances des fichiers [(nom, contenu)], lues en parallele; leve ConsolidationError si un fichier est refuse"""
+    checked, errors = [], []
+    for name, data in files:
+        try:
+            checked.append(balance_cache.preflight(data))
+        except PreflightError as e:
+            errors.append("%s: %s" % (name, e))
+    if errors:
+        raise ConsolidationError("; ".join(errors))
+
+    balances = [balance_cache.cached_balance(check.digest) for check in checked]
+    pending = [i for i, balance in enumerate(balances) if balance is None]
+    if len(pending) > 1 and settings.CONSOLIDATION_WORKERS > 1:
+        try:
+            futures = [(i, _executor().submit(_read, files[i][1], checked[i].detected)) for i in pending]
+            for i, future in futures:
+                balances[i] = future.result()
+        except BrokenProcessPool as e:
+            # Processus arrete (memoire...): le pool est recree a la prochaine consolidation
+            _reset_pool()
+            raise ConsolidationError("Lecture parallèle interrompue: %s" % e)
+    else:
+        for i in pending:
+            balances[i] = Balance.from_xlsx(files[i][1], checked[i].detected)
+    for i in pending:
+        balance_cache.put_balance(checked[i].digest, balances[i])
+    return balances
+
+
+def merge(balances, entities):
+    """Consolidation des balances: une ligne par compte present dans au moins une entite"""
+    kinds = {balance.accounts.dtype.kind for balance in balances}
+    columns = [balance.accounts if kinds == {"S"} else balance.accounts.astype("U") for balance in balances]
+    accounts, inverse = np.unique(np.concatenate(columns), return_inverse=True)
+    inverse = inverse.reshape(-1)
+    size = len(accounts)
+    sums = {name: np.bincount(inverse, weights=np.concatenate([b.amounts[name] for b in balances]), minlength=size)
+            for name in AMOUNT_COLUMNS}
+    opening = sums["opening_debit"] - sums["opening_credit"]
+    closing = sums["closing_debit"] - sums["closing_credit"]
+    amounts = {
+        "opening_debit": np.round(np.maximum(opening, 0), 2),
+        "opening_credit": np.round(np.maximum(-opening, 0), 2),
+        "movement_debit": np.round(sums["movement_debit"], 2),
+        "movement_credit": np.round(sums["movement_credit"], 2),
+        "closing_debit": np.round(np.maximum(closing, 0), 2),
+        "closing_credit": np.round(np.maximum(-closing, 0), 2),
+    }
+
+    # Intitule: celui de la premiere entite ou le compte apparait
+    starts = np.cumsum([0] + [len(b) for b in balances])
+    first = _first_index(inverse, size)
+    owner = np.searchsorted(starts, first, side="right") - 1
+    labels = [balances[e].label(row - starts[e]) for e, row in zip(owner.tolist(), first.tolist())]
+    if accounts.dtype.kind == "S":
+        accounts = np.char.decode(accounts, "utf-8")
+    consolidated = Balance(accounts.tolist(), labels, amounts)
+
+    # Soldes par entite en un seul bincount: case (entite, compte) = entite * comptes + compte
+    entity_ids = np.repeat(np.arange(len(balances)), [len(b) for b in balances])
+    soldes = np.concatenate([b.solde() for b in balances])
+    entity_soldes = np.bincount(entity_ids * size + inverse, weights=soldes, minlength=size * len(balances))
+    entity_soldes = np.round(entity_soldes.reshape(len(balances), size).T, 2)
+    return Consolidation(consolidated, list(entities), [len(b) for b in balances], entity_soldes)
+
+
+def consolidate(files):
+    """Consolide les fichiers [(nom, contenu)] d'un exercice"""
+    if not files:
+        raise ConsolidationError("Aucun fichier de balance")
+    return merge(read_balances(files), [os.path.splitext(os.path.basename(name))[0] for name, _ in files])
+
+
+def _rows(result, title, entities):
+    """Lignes (valeurs, gras) de la feuille consolidee"""
+    if title:
+        yield [title], True
+    yield list(HEADERS) + [None] * (ENTITY_FIRST_COLUMN - 1 - len(HEADERS)) + list(entities), True
+    gap = [None] * (PREFIX_COLUMNS[0][0] - 1 - len(HEADERS))
+    tail = [None] * (ENTITY_FIRST_COLUMN - 1 - PREFIX_COLUMNS[-1][0])
+    soldes = result.entity_soldes.tolist() if entities else None
+    for i, row in enumerate(result.balance.iter_rows()):
+        account = row[0]
+        values = list(row[:2]) + [value or None for value in row[2:]] + gap
+        values += [account[:length] for _, length in PREFIX_COLUMNS]
+        if entities:
+            values += tail + [value or None for value in soldes[i]]
+        yield values, False
+
+
+def to_xlsx(result, title=None, per_entity=False):
+    """Contenu xlsx de la balance consolidee: en-tetes de HEADERS, colonnes de prefixes, soldes par entite"""
+    entities = result.entities if per_entity else []
+    widths = {"A": 14, "B": 42}
+    for letter in "CDEFGH":
+        widths[letter] = 18
+    for i in range(len(entities)):
+        widths[get_column_letter(ENTITY_FIRST_COLUMN + i)] = 18
+    return ooxml.write_table(_rows(result, title, entities), "Consolidation", widths)
@@ -0,0 +1,157 @@
+"""Reintegration incrementale des balances (moteur openpyxl).
+
+Chaque classeur integre garde, pour ses feuilles de balance, l'empreinte du
+fichier source et les empreintes de ses lignes (Balance.row_hashes). Quand une
+balance est reimportee, seule sa feuille est retraitee: les lignes modifiees,
+ajoutees ou supprimees sont reperees par difflib.SequenceMatcher sur les
+empreintes, puis seules ces lignes sont relues dans le nouveau fichier et
+reecrites dans la feuille. Les cas non geres (trop de changements, lignes
+decalees sous des fusions, mises en forme conditionnelles ou validations,
+formules partagees) repassent par une copie complete de la feuille.
+"""
+import io
+import pickle
+import weakref
+from difflib import SequenceMatcher
+
+from openpyxl import load_workbook
+from openpyxl.cell.cell import Cell
+from openpyxl.styles.cell_style import StyleArray
+
+import ooxml
+import settings
+
+
+class DeltaUnsupported(Exception):
+    """Le changement ne peut pas etre applique ligne a ligne: la feuille est recopiee entierement"""
+
+
+class SheetState:
+    """Balance a l'origine d'une feuille integree"""
+
+    def __init__(self, digest, balance, data, width):
+        self.digest = digest
+        self.balance = balance
+        self.data = data
+        # Nombre de colonnes de la feuille, pour effacer une ligne sans parcourir toutes les cellules
+        self.width = width
+
+
+# Etat des feuilles de chaque classeur integre; l'entree disparait avec le classeur
+_states = weakref.WeakKeyDictionary()
+
+
+def sheet_states(workbook):
+    """Nom de feuille -> SheetState pour un classeur integre"""
+    return _states.setdefault(workbook, {})
+
+
+def clone_workbook(workbook):
+    """Copie privee d'un classeur integre, avec l'etat de ses feuilles (la reintegration reste incrementale)"""
+    clone = pickle.loads(pickle.dumps(workbook, protocol=pickle.HIGHEST_PROTOCOL))
+    sheet_states(clone).update(sheet_states(workbook))
+    return clone
+
+
+def diff_rows(old_hashes, new_hashes):
+    """Operations (tag, i1, i2, j1, j2) de SequenceMatcher entre deux versions d'une feuille"""
+    return SequenceMatcher(None, old_hashes.tolist(), new_hashes.tolist(), autojunk=False).get_opcodes()
+
+
+def _layout(data):
+    columns, merged = ooxml.read_sheet_layout(data)
+    return columns, sorted(merged)
+
+
+def _check_shift(ws, first_row):
+    """Les lignes decalees ne doivent pas porter d'elements lies a des numeros de ligne"""
+    for merged in ws.merged_cells.ranges:
+        if merged.max_row >= first_row:
+            raise DeltaUnsupported("cellules fusionnées sous les lignes décalées")
+    for conditional_format in ws.conditional_formatting:
+        if any(cell_range.max_row >= first_row for cell_range in conditional_format.sqref.ranges):
+            raise DeltaUnsupported("mise en forme conditionnelle sous les lignes décalées")
+    for validation in ws.data_validations.dataValidation:
+        if any(cell_range.max_row >= first_row for cell_range in validation.sqref.ranges):
+            raise DeltaUnsupported("validation de données sous les lignes décalées")
+    for row, dimension in ws.row_dimensions.items():
+        if row >= first_row and (dimension.height is not None or dimension.hidden):
+            raise DeltaUnsupported("hauteurs de ligne sous les lignes décalées")
+
+
+def patch_sheet(target_ws, state, balance, data, build_style_map):
+    """Applique a la feuille les lignes qui different entre state.balance et balance.
+
+    build_style_map(source_wb, target_wb) retourne la fonction de conversion des styles.
+    Retourne (lignes reecrites, largeur de la feuille); leve DeltaUnsupported si la
+    feuille doit etre recopiee entierement.
+    """
+    old_hashes, new_hashes = state.balance.row_hashes, balance.row_hashes
+    if old_hashes is None or new_hashes is None:
+        raise DeltaUnsupported("empreintes de lignes indisponibles")
+    if _layout(state.data) != _layout(data):
+        raise DeltaUnsupported("colonnes ou cellules fusionnées modifiées")
+
+    opcodes = diff_rows(old_hashes, new_hashes)
+    changes = [op for op in opcodes if op[0] != "equal"]
+    if not changes:
+        return 0, state.width
+    changed = sum(max(i2 - i1, j2 - j1) for _, i1, i2, j1, j2 in changes)
+    if changed * 100 > settings.DELTA_MAX_CHANGED_PERCENT * max(len(new_hashes), 1):
+        raise DeltaUnsupported("%d lignes modifiées sur %d" % (changed, len(new_hashes)))
+    shifted = [i1 for _, i1, i2, j1, j2 in changes if i2 - i1 != j2 - j1]
+    if shifted:
+        _check_shift(target_ws, min(shifted) + 1)
+
+    wanted = {j + 1 for _, _, _, j1, j2 in changes for j in range(j1, j2)}
+    new_rows = {number: (values, styles) for number, values, styles in ooxml.iter_sheet_cells(data, rows=wanted)}
+    if any(value is ooxml.SHARED_FORMULA for values, _ in new_rows.values() for value in values):
+        raise DeltaUnsupported("formules partagées dans les lignes modifiées")
+
+    # Effacement des lignes remplacees ou supprimees
+    removed = {i + 1 for _, i1, i2, _, _ in changes for i in range(i1, i2)}
+    cells = target_ws._cells
+    if shifted:
+        # Renumerotation des lignes conservees en un seul passage sur les cellules
+        moves = {}
+        for tag, i1, i2, j1, j2 in opcodes:
+            if tag == "equal" and i1 != j1:
+                for offset in range(i2 - i1):
+                    moves[i1 + offset + 1] = j1 + offset + 1
+        moved = {}
+        for (row, column), cell in cells.items():
+            if row in removed:
+                continue
+            if row in moves:
+                row = cell.row = moves[row]
+            moved[(row, column)] = cell
+        cells = target_ws._cells = moved
+    else:
+        for row in removed:
+            for column in range(1, state.width + 1):
+                cells.pop((row, column), None)
+
+    # Ecriture des nouvelles lignes, styles convertis dans le classeur cible
+    width = state.width
+    source_wb = load_workbook(io.BytesIO(data), read_only=True, data_only=False)
+    try:
+        map_style = build_style_map(source_wb, target_ws.parent)
+        cell_styles = source_wb._cell_styles
+        for number, (values, styles) in new_rows.items():
+            width = max(width, len(values))
+            for column, (value, style) in enumerate(zip(values, styles), start=1):
+                if value is None and not style:
+                    continue
+                if isinstance(value, ooxml.Formula):
+                    cell = Cell(target_ws, row=number, column=column, value=str(value))
+                else:
+                    cell = Cell(target_ws, row=number, column=column, value=value)
+                    if cell.data_type == "f":
+                        # Texte commencant par '=': ce n'est pas une formule
+                        cell.data_type = "s"
+                if style:
+                    cell._style = StyleArray(map_style(cell_styles[style]))
+                cells[(number, column)] = cell
+    finally:
+        source_wb.close()
+    return changed, width
@@ -0,0 +1,225 @@
+"""Import d'un FEC (Fichier des Ecritures Comptables) en balances N et N-1.
+
+Le fichier (separateur tabulation ou '|', montants avec virgule ou point
+decimal) est lu par blocs de settings.FEC_CHUNK_BYTES: seuls les cumuls par
+exercice et par compte sont gardes en memoire, jamais les lignes. Les ecritures
+des journaux d'a-nouveaux (OPENING_JOURNALS) donnent les soldes d'ouverture,
+les autres les mouvements de l'exercice. L'exercice d'une ecriture est deduit
+de sa date (EcritureDate) et du mois de cloture settings.FEC_FISCAL_YEAR_END_MONTH.
+
+Les balances obtenues sont ecrites en xlsx (feuille au format de 'BAL N', avec
+les colonnes de prefixes de compte que lisent les formules du modele) pour
+suivre ensuite le meme chemin qu'une balance importee.
+"""
+import io
+import os
+
+import numpy as np
+
+import ooxml
+import settings
+from balance import HEADERS, PREFIX_COLUMNS, Balance
+
+# Codes des journaux d'a-nouveaux (reprise des soldes de l'exercice precedent)
+OPENING_JOURNALS = frozenset((b"AN", b"RAN", b"ANO", b"ANX", b"OUV", b"REPORT"))
+
+
+class FECError(ValueError):
+    """Fichier qui n'a pas la structure d'un FEC"""
+
+
+class FECImport:
+    """Resultat de la lecture: balance de chaque exercice, nombre de lignes lues et ignorees"""
+
+    def __init__(self, balances, lines, skipped):
+        self.balances = balances
+        self.lines = lines
+        self.skipped = skipped
+
+    @property
+    def years(self):
+        """Exercices du fichier, du plus recent au plus ancien"""
+        return sorted(self.balances, reverse=True)
+
+
+def _open(source):
+    if isinstance(source, (str, os.PathLike)):
+        return open(source, "rb"), True
+    if isinstance(source, bytes):
+        return io.BytesIO(source), True
+    source.seek(0)
+    return source, False
+
+
+def _columns(header):
+    """Separateur et position des colonnes utiles d'apres la ligne d'en-tete"""
+    header = header.lstrip(b"\xef\xbb\xbf").rstrip(b"\r")
+    separator = b"\t" if b"\t" in header else b"|"
+    names = [name.strip().lower() for name in header.split(separator)]
+
+    def find(*candidates):
+        return next((names.index(c) for c in candidates if c in names), None)
+
+    columns = {
+        "journal": find(b"journalcode"),
+        "date": find(b"ecrituredate"),
+        "account": find(b"comptenum"),
+        "label": find(b"comptelib"),
+        "debit": find(b"debit"),
+        "credit": find(b"credit"),
+        "amount": find(b"montant"),
+        "direction": find(b"sens"),
+    }
+    missing = [name for name, column in (("EcritureDate", "date"), ("CompteNum", "account")) if columns[column] is None]
+    if (columns["debit"] is None or columns["credit"] is None) and (columns["amount"] is None or columns["direction"] is None):
+        missing.append("Debit/Credit (ou Montant/Sens)")
+    if missing:
+        raise FECError("Colonnes absentes de l'en-tête du FEC: %s" % ", ".join(missing))
+    return separator, columns
+
+
+def _amount(text):
+    text = text.strip()
+    if not text:
+        return 0.0
+    if b"," in text:
+        text = text.replace(b" ", b"").replace(b".", b"").replace(b",", b".")
+    return float(text)
+
+
+def _fiscal_year(date, end_month):
+    """Exercice (annee de cloture) d'une date AAAAMMJJ ou JJ/MM/AAAA"""
+    date = date.strip()
+    if b"/" in date:
+        day, month, year = date.split(b"/")[:3]
+        year, month = int(year[:4]), int(month)
+    else:
+        year, month = int(date[:4]), int(date[4:6])
+    return year + 1 if month > end_month else year
+
+
+def _decode(text):
+    try:
+        return text.decode("utf-8").strip()
+    except UnicodeDecodeError:
+        # Nombreux FEC exportes en ISO-8859-15 / Windows-1252
+        return text.decode("cp1252", "replace").strip()
+
+
+def read_fec(source, chunk_size=None, progress=None):
+    """Lit un FEC (chemin, contenu ou flux binaire) et retourne un FECImport.
+
+    progress: fonction (lignes lues) appelee apres chaque bloc
+    """
+    chunk_size = chunk_size or settings.FEC_CHUNK_BYTES
+    end_month = settings.FEC_FISCAL_YEAR_END_MONTH
+    stream, owned = _open(source)
+    try:
+        header = stream.readline()
+        if not header.strip():
+            raise FECError("Fichier FEC vide")
+        separator, columns = _columns(header)
+        i_journal, i_date, i_account, i_label = columns["journal"], columns["date"], columns["account"], columns["label"]
+        split_amounts = columns["debit"] is not None and columns["credit"] is not None
+        i_debit, i_credit = columns["debit"], columns["credit"]
+        i_amount, i_direction = columns["amount"], columns["direction"]
+        needed = max(i for i in columns.values() if i is not None)
+
+        # Cumuls (exercice, a-nouveau, compte) -> [debit, credit]: quelques milliers d'entrees
+        totals = {}
+        labels = {}
+        years = {}
+        lines = skipped = 0
+        rest = b""
+        while True:
+            chunk = stream.read(chunk_size)
+            block = rest + chunk
+            if chunk:
+                cut = block.rfind(b"\n") + 1
+                block, rest = block[:cut], block[cut:]
+            for line in block.split(b"\n"):
+                if not line or line == b"\r":
+                    continue
+                fields = line.split(separator)
+                if len(fields) <= needed:
+                    skipped += 1
+                    continue
+                try:
+                    date = fields[i_date]
+                    year = years.get(date)
+                    if year is None:
+                        year = years[date] = _fiscal_year(date, end_month)
+                    if split_amounts:
+                        debit, credit = _amount(fields[i_debit]), _amount(fields[i_credit])
+                    else:
+                        amount = _amount(fields[i_amount])
+                        debit, credit = (amount, 0.0) if fields[i_direction].strip().upper() in (b"D", b"+1", b"1") else (0.0, amount)
+                except (ValueError, IndexError):
+                    skipped += 1
+                    continue
+                lines += 1
+                account = fields[i_account].strip()
+                opening = i_journal is not None and fields[i_journal].strip().upper() in OPENING_JOURNALS
+                key = (year, opening, account)
+                total = totals.get(key)
+                if total is None:
+                    totals[key] = [debit, credit]
+                    if account not in labels and i_label is not None:
+                        labels[account] = fields[i_label]
+                else:
+                    total[0] += debit
+                    total[1] += credit
+            if progress is not None:
+                progress(lines)
+            if not chunk:
+                break
+    finally:
+        if owned:
+            stream.close()
+
+    balances = {}
+    for year in sorted({key[0] for key in totals}):
+        balances[year] = _build_balance({key[1:]: value for key, value in totals.items() if key[0] == year}, labels)
+    return FECImport(balances, lines, skipped)
+
+
+def _build_balance(totals, labels):
+    """Balance d'un exercice a partir des cumuls (a-nouveau, compte) -> [debit, credit]"""
+    accounts = sorted({account for _, account in totals})
+    position = {account: i for i, account in enumerate(accounts)}
+    opening = np.zeros((len(accounts), 2))
+    movement = np.zeros((len(accounts), 2))
+    for (is_opening, account), (debit, credit) in totals.items():
+        target = opening if is_opening else movement
+        target[position[account]] += (debit, credit)
+    # Soldes d'ouverture et de cloture presentes nets, au debit ou au credit
+    opening_net = opening[:, 0] - opening[:, 1]
+    closing_net = opening_net + movement[:, 0] - movement[:, 1]
+    amounts = {
+        "opening_debit": np.round(np.maximum(opening_net, 0), 2),
+        "opening_credit": np.round(np.maximum(-opening_net, 0), 2),
+        "movement_debit": np.round(movement[:, 0], 2),
+        "movement_credit": np.round(movement[:, 1], 2),
+        "closing_debit": np.round(np.maximum(closing_net, 0), 2),
+        "closing_credit": np.round(np.maximum(-closing_net, 0), 2),
+    }
+    return Balance([_decode(a) for a in accounts], [_decode(labels.get(a, b"")) for a in accounts], amounts)
+
+
+def _rows(balance, title):
+    """Lignes (valeurs, gras) de la feuille: en-tetes de HEADERS, une ligne par compte avec ses prefixes"""
+    if title:
+        yield [title], True
+    yield list(HEADERS), True
+    gap = [None] * (PREFIX_COLUMNS[0][0] - 1 - len(HEADERS))
+    for row in balance.iter_rows():
+        account = row[0]
+        yield list(row[:2]) + [value or None for value in row[2:]] + gap + [account[:length] for _, length in PREFIX_COLUMNS], False
+
+
+def to_xlsx(balance, title=None):
+    """Contenu xlsx d'une balance: en-tetes de HEADERS, une ligne par compte, colonnes de prefixes"""
+    widths = {"A": 14, "B": 42}
+    for letter in "CDEFGH":
+        widths[letter] = 18
+    return ooxml.write_table(_rows(balance, title), "Balance", widths)
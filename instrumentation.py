@@ -0,0 +1,176 @@
+"""Mesure des operations de Config en etapes nommees (spans).
+
+Chaque span enregistre sa duree, le temps CPU, le nombre de lignes et de
+cellules traitees et la variation de memoire (RSS du processus: la valeur est
+approximative quand plusieurs sessions travaillent en meme temps). Les spans
+sont gardes en memoire pour le panneau Performance et ajoutes en JSON-lines au
+journal settings.PERF_LOG_PATH.
+"""
+import cProfile
+import datetime
+import io
+import json
+import logging
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+import settings
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+_log_lock = threading.Lock()
+
+try:
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+
+def current_rss():
+    """Memoire residente du processus en octets (pic du processus hors Linux, None si inconnue)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    return None
+
+
+class Span:
+    """Une etape mesuree"""
+
+    def __init__(self, name, parent=None, **attrs):
+        self.name = name
+        self.parent = parent
+        self.depth = parent.depth + 1 if parent is not None else 0
+        self.attrs = attrs
+        self.rows = None
+        self.cells = None
+        self.status = "ok"
+        self.error = None
+        self.started_at = datetime.datetime.now()
+        self.duration = None
+        self.cpu = None
+        self.memory_delta = None
+
+    def fail(self, error):
+        """Marque l'etape en echec (l'erreur est aussi affichee par l'appelant)"""
+        self.status = "erreur"
+        self.error = str(error)
+
+    def to_dict(self):
+        return {
+            "etape": self.name,
+            "parent": self.parent.name if self.parent is not None else None,
+            "profondeur": self.depth,
+            "debut": self.started_at.isoformat(timespec="milliseconds"),
+            "duree": round(self.duration, 6) if self.duration is not None else None,
+            "cpu": round(self.cpu, 6) if self.cpu is not None else None,
+            "lignes": self.rows,
+            "cellules": self.cells,
+            "memoire": self.memory_delta,
+            "statut": self.status,
+            "erreur": self.error,
+            **self.attrs,
+        }
+
+
+class Tracer:
+    """Spans d'une session, journalises au fil de l'eau"""
+
+    def __init__(self, log_path=None, history=None):
+        self.session = uuid.uuid4().hex[:8]
+        self.log_path = settings.PERF_LOG_PATH if log_path is None else log_path
+        self.spans = deque(maxlen=history or settings.PERF_HISTORY_SIZE)
+        self._local = threading.local()
+        self.profile_data = None
+        self.profile_text = None
+
+    @contextmanager
+    def span(self, name, **attrs):
+        parent = getattr(self._local, "current", None)
+        span = Span(name, parent, **attrs)
+        self._local.current = span
+        rss = current_rss()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield span
+        except BaseException as e:
+            span.fail("%s: %s" % (type(e).__name__, e))
+            raise
+        finally:
+            span.duration = time.perf_counter() - wall
+            span.cpu = time.process_time() - cpu
+            after = current_rss()
+            span.memory_delta = after - rss if rss is not None and after is not None else None
+            self._local.current = parent
+            self.spans.append(span)
+            self._write(span)
+
+    def _write(self, span):
+        if not self.log_path:
+            return
+        line = json.dumps(dict(span.to_dict(), session=self.session), ensure_ascii=False, default=str)
+        try:
+            with _log_lock:
+                os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+        except OSError as e:
+            logger.warning("Journal de performance desactive (%s): %s", self.log_path, e)
+            self.log_path = None
+
+    def last_run(self):
+        """Spans de la derniere operation de premier niveau, dans l'ordre de leur debut"""
+        spans = list(self.spans)
+        roots = [i for i, span in enumerate(spans) if span.depth == 0]
+        if not roots:
+            return []
+        end = roots[-1]
+        start = roots[-2] + 1 if len(roots) > 1 else 0
+        return sorted(spans[start:end + 1], key=lambda span: span.started_at)
+
+    def profile(self, action):
+        """Execute action sous cProfile; le profil est garde pour le telechargement"""
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(action)
+        finally:
+            profiler.create_stats()
+            # Meme format que Profile.dump_stats: lisible par pstats, snakeviz, etc.
+            self.profile_data = marshal.dumps(profiler.stats)
+            text = io.StringIO()
+            pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(40)
+            self.profile_text = text.getvalue()
+
+    def fork(self):
+        """Tracer d'une tache de fond de la session (meme journal), fusionne ensuite par merge()"""
+        tracer = Tracer(self.log_path, self.spans.maxlen)
+        tracer.session = self.session
+        return tracer
+
+    def merge(self, other):
+        """Reprend les spans et le profil d'un Tracer obtenu par fork()"""
+        self.spans.extend(other.spans)
+        if other.profile_data is not None:
+            self.profile_data, self.profile_text = other.profile_data, other.profile_text
+
+    def clear(self):
+        self.spans.clear()
+        self.profile_data = None
+        self.profile_text = None
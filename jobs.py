@@ -0,0 +1,181 @@
+"""Taches d'integration executees en arriere-plan.
+
+Les taches de toutes les sessions passent par un ordonnanceur unique: au plus
+settings.JOB_WORKERS integrations tournent en meme temps, dans la limite du
+budget memoire settings.JOB_MEMORY_BUDGET; les autres attendent dans une file
+FIFO et connaissent leur position. Le script Streamlit n'est pas bloque et se
+contente d'interroger la tache. La tache publie son avancement (etape, lignes
+traitees) et peut etre annulee: l'annulation est constatee au prochain appel
+de Job.progress.
+"""
+import datetime
+import threading
+import uuid
+from collections import deque
+
+import settings
+from reporter import Reporter
+
+JOB_PENDING = "en attente"
+JOB_RUNNING = "en cours"
+JOB_DONE = "terminée"
+JOB_FAILED = "erreur"
+JOB_CANCELLED = "annulée"
+
+
+class JobCancelled(BaseException):
+    """Levee dans la tache quand l'annulation est demandee.
+
+    Derive de BaseException (comme asyncio.CancelledError) pour traverser les
+    blocs `except Exception` qui affichent les erreurs a l'utilisateur.
+    """
+
+
+class Job:
+    """Tache de fond: action(job) est executee dans un thread lance par l'ordonnanceur"""
+
+    def __init__(self, name, action, key=None, memory=0):
+        self.id = uuid.uuid4().hex[:8]
+        self.name = name
+        self.action = action
+        # Etat des donnees au lancement, pour ne pas rattacher un resultat perime
+        self.key = key
+        # Memoire estimee de la tache (octets), reservee sur le budget pendant son execution
+        self.memory = memory
+        self.scheduler = None
+        self.status = JOB_PENDING
+        self.stage = None
+        self.done = 0
+        self.total = None
+        self.result = None
+        self.error = None
+        self.reporter = Reporter()
+        self.submitted_at = datetime.datetime.now()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in (JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+
+    @property
+    def position(self):
+        """Position dans la file d'attente (1 = prochaine tache admise), 0 hors de la file"""
+        return self.scheduler.position(self) if self.scheduler is not None else 0
+
+    @property
+    def fraction(self):
+        """Avancement de l'etape en cours, entre 0 et 1"""
+        if not self.total:
+            return 0.0
+        return min(self.done / self.total, 1.0)
+
+    def progress(self, stage, done, total=None):
+        """Appelee par la tache; leve JobCancelled si l'annulation a ete demandee"""
+        if self._cancel.is_set():
+            raise JobCancelled()
+        self.stage, self.done, self.total = stage, done, total
+
+    def cancel(self):
+        self._cancel.set()
+        if self.scheduler is not None and self.scheduler.withdraw(self):
+            # La tache n'avait pas demarre
+            self.status = JOB_CANCELLED
+            self.finished_at = datetime.datetime.now()
+
+    def run(self):
+        if self._cancel.is_set():
+            self.status = JOB_CANCELLED
+            self.finished_at = datetime.datetime.now()
+            return
+        self.status = JOB_RUNNING
+        self.started_at = datetime.datetime.now()
+        try:
+            self.result = self.action(self)
+            self.status = JOB_DONE
+        except JobCancelled:
+            self.status = JOB_CANCELLED
+        except Exception as e:
+            self.error = str(e)
+            self.status = JOB_FAILED
+        finally:
+            self.finished_at = datetime.datetime.now()
+
+
+class Scheduler:
+    """File FIFO des taches, admises selon le nombre d'emplacements et le budget memoire"""
+
+    def __init__(self, slots=None, memory_budget=None):
+        self.slots = max(1, slots or settings.JOB_WORKERS)
+        self.memory_budget = settings.JOB_MEMORY_BUDGET if memory_budget is None else memory_budget
+        self._queue = deque()
+        self._running = set()
+        self._memory_used = 0
+        self._lock = threading.Lock()
+
+    def submit(self, job):
+        job.scheduler = self
+        with self._lock:
+            self._queue.append(job)
+            self._admit()
+        return job
+
+    def _fits(self, job):
+        if len(self._running) >= self.slots:
+            return False
+        # Une tache plus grosse que le budget passe seule, pour ne pas attendre indefiniment
+        return not self._running or self._memory_used + job.memory <= self.memory_budget
+
+    def _admit(self):
+        # Strictement FIFO: la tache en tete de file bloque les suivantes tant qu'elle n'est pas admise
+        while self._queue and self._fits(self._queue[0]):
+            job = self._queue.popleft()
+            self._running.add(job)
+            self._memory_used += job.memory
+            threading.Thread(target=self._run, args=(job,), name="comptalance-job-%s" % job.id, daemon=True).start()
+
+    def _run(self, job):
+        try:
+            job.run()
+        finally:
+            with self._lock:
+                self._running.discard(job)
+                self._memory_used -= job.memory
+                self._admit()
+
+    def withdraw(self, job):
+        """Retire une tache qui n'a pas encore demarre; False si elle est deja admise"""
+        with self._lock:
+            try:
+                self._queue.remove(job)
+            except ValueError:
+                return False
+            self._admit()
+            return True
+
+    def position(self, job):
+        with self._lock:
+            for index, queued in enumerate(self._queue):
+                if queued is job:
+                    return index + 1
+        return 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "running": len(self._running),
+                "queued": len(self._queue),
+                "slots": self.slots,
+                "memory_used": self._memory_used,
+                "memory_budget": self.memory_budget,
+            }
+
+
+# Ordonnanceur partage par toutes les sessions du serveur
+scheduler = Scheduler()
+
+
+def submit(name, action, key=None, memory=0):
+    """Met une tache en file et la retourne immediatement"""
+    return scheduler.submit(Job(name, action, key, memory))
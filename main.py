@@ -2,223 +2,38 @@
 from datetime import datetime
 import os
 import streamlit as st
-import io
-import json
-from openpyxl import workbook, load_workbook
-from PIL import Image
-
-
-def load_models():
-    models = []
-    try:
-        with open("models.json") as m:
-            models = json.load(m)
-    except:
-        pass
-    
-    return models
-
-
-class Config:
-    def __init__(self):
-        self.model_balances_ = {"modele":False, "baln": False, "baln_1":False}
-        self.isIntegrated = False
-        self.model_wb = None
-        self.baln_wb = None
-        self.baln_1_wb = None
-        self.excel_data = None
-        self.modeles = load_models()
-        self.default_img_path = "models_images"
-        self.default_excel_folder = "models_excel"
-    
-    
-    def _copy_worksheet_with_styles(self,st, source_ws, target_ws):
-        """Copie une feuille Excel en préservant tous les styles et formatages"""
-        try:
-            # Copie des dimensions des colonnes
-            for col_letter, dimension in source_ws.column_dimensions.items():
-                target_ws.column_dimensions[col_letter].width = dimension.width
-                target_ws.column_dimensions[col_letter].hidden = dimension.hidden
-            
-            # Copie des dimensions des lignes
-            for row_num, dimension in source_ws.row_dimensions.items():
-                target_ws.row_dimensions[row_num].height = dimension.height
-                target_ws.row_dimensions[row_num].hidden = dimension.hidden
-            
-            # Copie des cellules avec tous leurs attributs
-            for row in source_ws.iter_rows():
-                for cell in row:
-                    target_cell = target_ws.cell(row=cell.row, column=cell.column)
-                    
-                    # Copie de la valeur
-                    target_cell.value = cell.value
-                    
-                    # Copie du style si disponible
-                    if hasattr(cell, 'has_style') and cell.has_style:
-                        if cell.font:
-                            target_cell.font = cell.font.copy()
-                        if cell.fill:
-                            target_cell.fill = cell.fill.copy()
-                        if cell.border:
-                            target_cell.border = cell.border.copy()
-                        if cell.alignment:
-                            target_cell.alignment = cell.alignment.copy()
-                        if cell.number_format:
-                            target_cell.number_format = cell.number_format
-                        if cell.protection:
-                            target_cell.protection = cell.protection.copy()
-            
-            # Copie des cellules fusionnées
-            for merged_range in source_ws.merged_cells.ranges:
-                target_ws.merge_cells(str(merged_range))
-            
-            # Copie des paramètres de mise en page (avec vérification d'existence)
-            try:
-                if hasattr(source_ws, 'page_setup') and source_ws.page_setup:
-                    target_ws.page_setup = source_ws.page_setup
-            except:
-                pass
-            
-            try:
-                if hasattr(source_ws, 'page_margins') and source_ws.page_margins:
-                    target_ws.page_margins = source_ws.page_margins
-            except:
-                pass
-            
-            try:
-                if hasattr(source_ws, 'header_footer') and source_ws.header_footer:
-                    target_ws.header_footer = source_ws.header_footer
-            except:
-                pass
-            
-            # Copie des paramètres d'impression additionnels
-            try:
-                if hasattr(source_ws, 'print_options') and source_ws.print_options:
-                    target_ws.print_options = source_ws.print_options
-            except:
-                pass
-                
-            try:
-                if hasattr(source_ws, 'sheet_view') and source_ws.sheet_view:
-                    target_ws.sheet_view = source_ws.sheet_view
-            except:
-                pass
-            
-        except Exception as e:
-            pass
-            # st.warning(f"Copie avec styles partielle: {str(e)}. Basculement vers copie simple.")
-            # Fallback vers copie simple
-            # self._copy_worksheet_simple(source_ws, target_ws)
-    
-    
-    def add_balances_to_modele(self, st):
-        """Ajoute les balances au modèle Excel en préservant leur style original"""
-        try:
-            # Suppression des anciennes feuilles si elles existent
-            if 'BAL N' in self.modele_wb.sheetnames:
-                del self.modele_wb['BAL N']
-            if 'BAL N-1' in self.modele_wb.sheetnames:
-                del self.modele_wb['BAL N-1']
-            
-            # Ajout de la balance N en préservant le style original
-            if self.baln_wb is not None:
-                # Copie de la feuille originale avec tous ses styles
-                source_sheet = self.baln_wb.active
-                target_sheet = self.modele_wb.create_sheet('BAL N')
-                self._copy_worksheet_with_styles(st, source_sheet, target_sheet)
-            else:
-                pass
-            
-            # Ajout de la balance N-1 si disponible
-            if self.baln_1_wb is not None:
-                # Copie de la feuille originale avec tous ses styles
-                source_sheet = self.baln_1_wb.active
-                target_sheet = self.modele_wb.create_sheet('BAL N-1')
-                self._copy_worksheet_with_styles(st, source_sheet, target_sheet)
-            else:
-                pass
-            
-            return True
-        except Exception as e:
-            st.error(f"Erreur lors de l'integration des balances: {str(e)}")
-            return False
-    
-    
-    def get_excel_file_download(self, st):
-        """Génère le fichier Excel téléchargeable"""
-        if not self.modele_wb:
-            return None
-        
-        try:
-            buffer = io.BytesIO()
-            self.modele_wb.save(buffer)
-            buffer.seek(0)
-            self.excel_data= buffer.getvalue()
-            return self.excel_data
-        except Exception as e:
-            st.error(f"Erreur lors de la génération du fichier: {str(e)}")
-            return None
-    
-    
-    def display_image(self, st, image_path):
-        """Affiche une image avec gestion d'erreur"""
-        try:
-            if os.path.exists(image_path):
-                image = Image.open(image_path)
-                st.image(image, use_container_width=True)
-                # return True
-            else:
-                st.warning(f"Image non trouvée: {image_path}")
-                # return False
-        except Exception as e:
-            st.error(f"Erreur lors du chargement de l'image: {str(e)}")
-            # return False
-    
-    def get_index_model(self, model_choisi:str):
-        if self.modeles:
-            for i, model in enumerate(self.modeles):
-                if model["nom"].lower() == model_choisi.lower():
-                    return i
-        
-        return 0
-
-    def load_excel(self, st, uploaded_file, type=1):
-        try:
-            if type==1:
-                self.modele_wb = load_workbook(uploaded_file, data_only=False)
-            elif type==2:
-                self.baln_wb = load_workbook(uploaded_file, data_only=False)
-            else:
-                self.baln_1_wb = load_workbook(uploaded_file, data_only=False)
-            return True
-        except Exception as e:
-            st.error(f"Erreur lors du chargement du modèle: {str(e)}")
-            return False
-    
-    def model_choisi(self):
-        self.model_balances_["modele"] = True
-        
-    def balance_n_importer(self):
-        self.model_balances_["baln"] = True
-        
-    def balance_n_1_importer(self):
-        self.model_balances_["baln_1"] = True
 
+import jobs
+import sessions
+import settings
+import warmup
+from cache import balance_cache
+from config import Config, ENGINE_OOXML, ENGINE_OPENPYXL
 
 
 # global variable
 
+# Modeles et miniatures prepares une seule fois pour le processus, sans faire attendre la session
+# (inutile si le serveur a ete lance par "python warmup.py --serve")
+if settings.WARMUP:
+    warmup.start()
+
 # Initialisation de l'application
 if 'config' not in st.session_state:
     st.session_state.config = Config()
     
 config = st.session_state.config
+# Donnees de la session relues si elles avaient ete deplacees sur disque
+sessions.manager.touch(config)
     
-if 'current_model_index' not in st.session_state:
+if 'current_model_index' not in st.session_state or st.session_state.current_model_index >= len(config.modeles):
+    # Le catalogue a pu etre recharge avec moins de modeles
     st.session_state.current_model_index = 0
 
-if config.load_excel(st, os.path.join(config.default_excel_folder, config.modeles[0]["file_path"])):
+# Le modele est pris dans le cache du processus: aucune relecture du fichier entre deux reruns
+if config.load_excel(st, os.path.join(config.default_excel_folder, config.modeles[st.session_state.current_model_index]["file_path"])):
     config.model_choisi()
+config.load_mapping(st, config.modeles[st.session_state.current_model_index])
 
 # Configuration de la page
 st.set_page_config(
@@ -274,6 +89,56 @@ st.markdown('<h1 class="main-header">📊 Comptalance, le logiciel qui facilite
 
 # fonctions
 
+@st.fragment(run_every=1)
+def show_integration_job():
+    """Avancement de l'intégration en cours, rafraîchi chaque seconde sans relancer toute la page"""
+    job = config.integration_job
+    if job is None:
+        return
+    if job.finished:
+        # Relance complète: la section Exportation utilise le résultat
+        st.rerun()
+    if job.status == jobs.JOB_PENDING:
+        position = job.position
+        stats = jobs.scheduler.stats()
+        st.progress(0.0, text=f"En file d'attente: position {position} "
+                              f"({stats['running']} intégration(s) en cours sur {stats['slots']})" if position else "Démarrage...")
+    elif job.total:
+        st.progress(job.fraction, text=f"{job.stage}: {job.done:,} / {job.total:,} lignes".replace(",", " "))
+    else:
+        st.progress(0.0, text=f"{job.stage or 'Préparation'}...")
+    if st.button("⏹️ Annuler l'intégration", key=f"cancel_{job.id}"):
+        job.cancel()
+
+
+def go_to_row(sheet, sheet_name):
+    """Page de l'aperçu qui contient la ligne demandée"""
+    row = st.session_state[f"preview_goto_{sheet_name}"]
+    if row:
+        st.session_state[f"preview_page_{sheet_name}"] = sheet.page_of(row, settings.PREVIEW_PAGE_ROWS)
+
+
+@st.fragment
+def show_sheet_preview():
+    """Aperçu page par page d'une feuille du fichier exporté: changer de page ne relance que ce panneau"""
+    sheet_name = st.selectbox("Feuille à afficher", config.preview_sheets(), key="preview_sheet")
+    if not sheet_name:
+        return
+    with st.spinner(f"Lecture de la feuille '{sheet_name}'..."):
+        sheet = config.sheet_preview(st, sheet_name)
+    if sheet is None:
+        return
+    page_rows = settings.PREVIEW_PAGE_ROWS
+    pages = sheet.pages(page_rows)
+    col1, col2 = st.columns(2)
+    # Page gardee dans la session: "Aller a la ligne" la change avant l'affichage du champ
+    st.session_state.setdefault(f"preview_page_{sheet_name}", 1)
+    page_number = col1.number_input("Page", min_value=1, max_value=pages, step=1, key=f"preview_page_{sheet_name}")
+    col2.number_input("Aller à la ligne", min_value=0, value=0, step=1, key=f"preview_goto_{sheet_name}",
+                      on_change=go_to_row, args=(sheet, sheet_name))
+    st.caption(f"{len(sheet):,} lignes · page {page_number} / {pages}".replace(",", " "))
+    st.dataframe(sheet.page(page_number, page_rows), use_container_width=True, hide_index=True)
+
 # =====================
 
 # Sidebar pour la navigation
@@ -332,19 +197,57 @@ if page == "🏠 Accueil":
         balance_n1_status = "✅ Chargée" if config.model_balances_["baln_1"] else "❌ Non chargée"
         st.metric("Balance N-1", balance_n1_status)
 
+    if config.model_balances_["baln"] and config.model_balances_["baln_1"]:
+        if st.checkbox("📈 Afficher la comparaison N / N-1", value=False):
+            comparison = config.compare_balances()
+            if comparison is not None:
+                col1, col2, col3 = st.columns(3)
+                col1.metric("Comptes", len(comparison))
+                col2.metric("Nouveaux comptes", comparison.new_accounts)
+                col3.metric("Comptes disparus", comparison.removed_accounts)
+                st.dataframe(comparison.to_columns(), use_container_width=True, hide_index=True)
+
+    if config.model_balances_["baln"] and config.account_mapping is not None:
+        if st.checkbox("🧮 Afficher les totaux par rubrique", value=False):
+            rubrics = config.rubric_totals()
+            if rubrics is not None:
+                st.caption(f"{config.account_mapping.name} · {len(config.account_mapping)} rubriques, "
+                           f"écrites dans la feuille '{config.account_mapping.sheet_name}' lors de l'intégration")
+                st.dataframe(rubrics.to_columns(), use_container_width=True, hide_index=True)
+                if rubrics.unmapped_count:
+                    st.warning(f"{rubrics.unmapped_count} comptes ne sont rattachés à aucune rubrique")
+                    st.dataframe(rubrics.unmapped_columns(), use_container_width=True, hide_index=True)
+                else:
+                    st.success("✅ Tous les comptes sont rattachés à une rubrique")
+
 
     if config.model_balances_["modele"] and config.model_balances_["baln"] and config.model_balances_["baln_1"]:
         st.markdown('<div class="section-header">Integration</div>', unsafe_allow_html=True)
         # Bouton pour intégrer les balances
+        engines = {"Rapide (fusion des fichiers xlsx)": ENGINE_OOXML, "Standard (copie cellule par cellule)": ENGINE_OPENPYXL}
+        engine_label = st.radio("Moteur d'intégration", list(engines), horizontal=True)
+        config.integration_engine = engines[engine_label]
         
-        if st.button("🔄 Intégrer les balances au modèle", type="primary"):
-            with st.spinner("Traitement en cours..."):
-                if config.add_balances_to_modele(st):
-                    config.isIntegrated = True
-                    config.get_excel_file_download(st)
-                    st.info("Les feuilles 'Balance_N' et 'Balance_N-1' ont été ajoutées au modèle")
-                else:
-                    st.markdown('<div class="warning-box">❌ Erreur lors de l\'intégration des balances</div>', unsafe_allow_html=True)
+        # L'integration tourne en tache de fond: la page reste utilisable pendant le traitement
+        running = config.integration_job is not None
+        if st.button("🔄 Intégrer les balances au modèle", type="primary", disabled=running):
+            config.isIntegrated = False
+            config.start_integration(profile=st.session_state.get("profile_integration", False))
+        
+        if config.integration_job is not None and not config.integration_job.finished:
+            show_integration_job()
+        
+        job = config.finish_integration()
+        if job is not None:
+            for message in job.reporter.messages:
+                if message["niveau"] == "avertissement":
+                    st.warning(message["message"])
+            if job.status == jobs.JOB_DONE and config.isIntegrated:
+                st.info("Les feuilles 'Balance_N' et 'Balance_N-1' ont été ajoutées au modèle")
+            elif job.status == jobs.JOB_CANCELLED:
+                st.warning("Intégration annulée")
+            elif job.status == jobs.JOB_FAILED:
+                st.markdown(f'<div class="warning-box">❌ Erreur lors de l\'intégration des balances: {job.error}</div>', unsafe_allow_html=True)
             # st.success("Terminé!")
 
     if config.isIntegrated:
@@ -358,6 +261,20 @@ if page == "🏠 Accueil":
             type="primary"
         )
         
+        # Formules du modele calculees sur le serveur: apercu sans ouvrir le fichier dans Excel
+        if st.checkbox("👁️ Aperçu des états calculés", value=False):
+            evaluation = config.evaluate_formulas()
+            if evaluation is not None:
+                preview_sheet = st.selectbox("Feuille", evaluation.sheets())
+                if preview_sheet:
+                    st.dataframe(evaluation.preview(preview_sheet), use_container_width=True, hide_index=True)
+                if evaluation.graph.unsupported:
+                    st.caption(f"{len(evaluation.graph.unsupported)} formules seront calculées par Excel à l'ouverture du fichier")
+
+        # Feuilles du fichier exporte lues une fois, puis affichees page par page
+        if st.checkbox("🔎 Aperçu des feuilles intégrées", value=False):
+            show_sheet_preview()
+        
         
 elif page == "📁 Choisir un model":
     # Interface principale
@@ -388,6 +305,7 @@ elif page == "📁 Choisir un model":
             st.session_state.current_model_index = index
             if config.load_excel(st, os.path.join(config.default_excel_folder, config.modeles[index]["file_path"])):
                 config.model_choisi()
+            config.load_mapping(st, config.modeles[index])
         
     with col2:
         if config.modeles:
@@ -395,6 +313,13 @@ elif page == "📁 Choisir un model":
             
             st.subheader(f"🖼️ Aparcu du {selected_model['nom']}")
             
+            # Informations lues dans l'archive du modele, sans le charger
+            info = config.model_info(selected_model)
+            if info is not None:
+                balances = [f"{sheet['name']} ({sheet['dimension']})" for sheet in info.sheets if sheet['name'] in ('BAL N', 'BAL N-1')]
+                st.caption(f"{len(info.sheets)} feuilles · {info.size / 1048576:.1f} Mo"
+                           + (f" · {', '.join(balances)}" if balances else ""))
+            
             # Affichage des images
             if 'imgs' in selected_model and selected_model['imgs']:
                 # st.markdown()
@@ -417,41 +342,172 @@ elif page == "📁 Choisir un model":
     
 
 elif page == "📤 Importer les balances":
-    config.model_balances_["baln"] = False
-    config.model_balances_["baln_1"] = False
     st.markdown('<div class="section-header">Import des balances</div>', unsafe_allow_html=True)
     
-    # Upload des balances
-    col1, col2 = st.columns(2)
+    source = st.radio("Format des balances",
+                      ["Fichiers Excel (N et N-1)", "FEC (écritures comptables)", "Consolidation (plusieurs entités)"],
+                      horizontal=True)
     
-    with col1:
-        st.markdown("#### 📊 Balance Année N")
-        balance_n_file = st.file_uploader(
-            "Fichier balance année courante (N):",
-            type=['xlsx'],
-            key="balance_n_uploader"
-        )
+    if source.startswith("Fichiers Excel"):
+        # Upload des balances
+        col1, col2 = st.columns(2)
+    
+        with col1:
+            st.markdown("#### 📊 Balance Année N")
+            balance_n_file = st.file_uploader(
+                "Fichier balance année courante (N):",
+                type=['xlsx'],
+                key="balance_n_uploader"
+            )
         
-        if balance_n_file:
-            if config.load_excel(st, balance_n_file, 2):
-                config.model_balances_["baln"] = True
-                st.success("✅ Balance N chargée!")
+            # Les balances sont en cache par contenu: un fichier inchange n'est pas reparse
+            if balance_n_file:
+                config.model_balances_["baln"] = config.load_excel(st, balance_n_file, 2)
+                if config.model_balances_["baln"]:
+                    st.success("✅ Balance N chargée!")
+                    st.caption(f"{len(config.baln_balance)} comptes")
+            else:
+                config.model_balances_["baln"] = False
     
-    with col2:
-        st.markdown("#### 📊 Balance Année N-1")
-        balance_n1_file = st.file_uploader(
-            "Fichier balance année précédente (N-1):",
-            type=['xlsx'],
-            key="balance_n1_uploader"
+        with col2:
+            st.markdown("#### 📊 Balance Année N-1")
+            balance_n1_file = st.file_uploader(
+                "Fichier balance année précédente (N-1):",
+                type=['xlsx'],
+                key="balance_n1_uploader"
+            )
+        
+            if balance_n1_file:
+                config.model_balances_["baln_1"] = config.load_excel(st, balance_n1_file, 3)
+                if config.model_balances_["baln_1"]:
+                    st.success("✅ Balance N-1 chargée!")
+                    st.caption(f"{len(config.baln_1_balance)} comptes")
+            else:
+                config.model_balances_["baln_1"] = False
+    
+    
+    elif source.startswith("Consolidation"):
+        st.caption("Une balance par entité et par exercice: les comptes sont additionnés et le résultat est intégré "
+                   "comme une balance unique.")
+        per_entity = st.checkbox("Colonnes par entité (solde de clôture de chaque entité)", value=False,
+                                 key="consolidation_per_entity")
+        col1, col2 = st.columns(2)
+        for column, label, key, type, flag, attribute in (
+            (col1, "N", "consolidation_n", 2, "baln", "baln_balance"),
+            (col2, "N-1", "consolidation_n1", 3, "baln_1", "baln_1_balance"),
+        ):
+            with column:
+                st.markdown(f"#### 🏢 Balances {label} des entités")
+                files = st.file_uploader(
+                    f"Fichiers balance {label} (un par entité):",
+                    type=['xlsx'],
+                    accept_multiple_files=True,
+                    key=f"{key}_uploader"
+                )
+                if files:
+                    # Consolidation refaite seulement si les fichiers ou l'option changent
+                    state = (tuple(f.file_id for f in files), per_entity)
+                    if st.session_state.get(f"{key}_state") != state:
+                        with st.spinner(f"Consolidation de {len(files)} balances {label}..."):
+                            result = config.load_consolidation(st, files, type, per_entity)
+                        st.session_state[f"{key}_state"] = state
+                        st.session_state[f"{key}_entities"] = len(files) if result is not None else 0
+                        config.model_balances_[flag] = result is not None
+                    if config.model_balances_[flag]:
+                        st.success(f"✅ Balance {label} consolidée!")
+                        st.caption(f"{st.session_state[f'{key}_entities']} entités, "
+                                   f"{len(getattr(config, attribute))} comptes")
+                    else:
+                        st.markdown(f'<div class="warning-box">❌ Les balances {label} n\'ont pas pu être consolidées</div>',
+                                    unsafe_allow_html=True)
+                else:
+                    st.session_state[f"{key}_state"] = None
+                    config.model_balances_[flag] = False
+
+    else:
+        st.markdown("#### 📄 Fichier des écritures comptables")
+        fec_file = st.file_uploader(
+            "FEC (séparateur tabulation ou |):",
+            type=['txt', 'csv', 'tsv'],
+            key="fec_uploader"
         )
         
-        if balance_n1_file:
-            if config.load_excel(st, balance_n1_file, 3):
-                config.model_balances_["baln_1"] = True
-                st.success("✅ Balance N-1 chargée!")
+        if fec_file:
+            # Le FEC n'est relu que s'il change: les balances calculees restent dans la configuration
+            if st.session_state.get("fec_file_id") != fec_file.file_id:
+                with st.spinner("Calcul des balances à partir des écritures..."):
+                    years = config.load_fec(st, fec_file)
+                st.session_state.fec_file_id = fec_file.file_id
+                st.session_state.fec_years = years
+                config.model_balances_["baln"] = bool(years)
+                config.model_balances_["baln_1"] = len(years) > 1
+            years = st.session_state.get("fec_years", [])
+            if years:
+                st.success(f"✅ Balance N ({years[0]}) calculée: {len(config.baln_balance)} comptes")
+                if len(years) > 1:
+                    st.success(f"✅ Balance N-1 ({years[1]}) calculée: {len(config.baln_1_balance)} comptes")
+                else:
+                    st.info("Le FEC ne couvre qu'un exercice: importez la balance N-1 au format Excel")
+                    balance_n1_file = st.file_uploader(
+                        "Fichier balance année précédente (N-1):",
+                        type=['xlsx'],
+                        key="fec_balance_n1_uploader"
+                    )
+                    if balance_n1_file:
+                        config.model_balances_["baln_1"] = config.load_excel(st, balance_n1_file, 3)
+                    else:
+                        config.model_balances_["baln_1"] = False
+            else:
+                st.markdown('<div class="warning-box">❌ Le FEC n\'a pas pu être importé</div>', unsafe_allow_html=True)
+        else:
+            st.session_state.fec_file_id = None
+            config.model_balances_["baln"] = config.model_balances_["baln_1"] = False
     
     st.markdown("---")
     
 
+# Panneau Performance: affiche apres la page pour inclure les mesures de ce rerun
+with st.sidebar:
+    st.markdown("---")
+    if st.checkbox("⏱️ Performance", value=False):
+        spans = config.tracer.last_run()
+        if spans:
+            st.caption("Dernière opération")
+            st.dataframe(
+                {
+                    "Étape": ["\u2003" * span.depth + span.name for span in spans],
+                    "Durée (s)": [round(span.duration, 3) for span in spans],
+                    "Lignes": [span.rows for span in spans],
+                    "Cellules": [span.cells for span in spans],
+                    "Mémoire (Mo)": [None if span.memory_delta is None else round(span.memory_delta / 1048576, 1) for span in spans],
+                    "Statut": [span.error or span.status for span in spans],
+                },
+                use_container_width=True,
+                hide_index=True,
+            )
+        else:
+            st.caption("Aucune mesure pour l'instant")
+        stats = sessions.manager.stats()
+        st.caption(f"Sessions: {stats['in_memory']} en mémoire ({stats['memory'] / 1048576:.0f} Mo "
+                   f"sur {stats['memory_budget'] / 1048576:.0f} Mo), {stats['on_disk']} sur disque")
+        stats = balance_cache.stats()
+        st.caption(f"Balances en cache: {stats['colonnes']['entries']} en colonnes "
+                   f"({stats['colonnes']['bytes'] / 1048576:.0f} Mo), {stats['classeurs']['entries']} classeurs "
+                   f"({stats['classeurs']['bytes'] / 1048576:.0f} Mo), sur {stats['max_bytes'] / 1048576:.0f} Mo")
+        st.checkbox("Profiler la prochaine intégration (cProfile)", key="profile_integration")
+        if config.tracer.profile_data:
+            st.download_button(
+                label="📥 Profil cProfile",
+                data=config.tracer.profile_data,
+                file_name=f"integration_{datetime.now().strftime('%Y%m%d_%H%M%S')}.prof",
+                mime="application/octet-stream",
+            )
+            with st.expander("Fonctions les plus coûteuses"):
+                st.code(config.tracer.profile_text)
+
+# Fin du rerun: les donnees de la session peuvent de nouveau etre deplacees sur disque
+sessions.manager.release(config)
+
+
 if __name__=="__main__":
     pass
\ No newline at end of file
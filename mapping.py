@@ -0,0 +1,224 @@
+"""Rattachement des comptes des balances aux rubriques des etats financiers.
+
+Chaque modele peut indiquer dans models.json un fichier de correspondance
+(cle "mapping", fichier de models_mappings/) qui associe a chaque rubrique
+(code, libelle, sens) des prefixes de comptes, par exemple les classes du
+SYSCOHADA ou du PCG. Un compte appartient a la rubrique de son prefixe le plus
+long: "411" -> Clients et "4191" -> Clients, avances recues.
+
+Les prefixes sont ranges par longueur dans des tableaux tries: tous les comptes
+d'une balance sont classes en une recherche dichotomique vectorisee par
+longueur de prefixe, puis les totaux des rubriques sont calcules par
+np.bincount. Ces totaux sont ecrits dans une feuille du modele (RUBRIQUES par
+defaut) que les formules peuvent lire par code, au lieu de refaire des SOMME.SI
+sur toutes les lignes des balances.
+"""
+import io
+import json
+import os
+import threading
+
+import numpy as np
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+
+from cache import bytes_sha256
+
+DEFAULT_SHEET = "RUBRIQUES"
+
+SHEET_HEADERS = ("Code", "Rubrique", "Sens", "Préfixes", "Montant N", "Montant N-1", "Comptes N", "Comptes N-1")
+
+AMOUNT_FORMAT = "#,##0.00"
+
+# Sens d'une rubrique: signe applique au solde de cloture (debit - credit)
+SIGNS = {"debit": 1.0, "credit": -1.0}
+
+
+class MappingError(ValueError):
+    """Fichier de correspondance invalide"""
+
+
+class Rubric:
+    def __init__(self, code, label, sign, prefixes):
+        self.code = code
+        self.label = label
+        self.sign = sign
+        self.prefixes = prefixes
+
+    @property
+    def direction(self):
+        return "debit" if self.sign > 0 else "credit"
+
+
+class Mapping:
+    """Rubriques d'un fichier de correspondance et index trie de leurs prefixes"""
+
+    def __init__(self, rubrics, name="", sheet_name=DEFAULT_SHEET, sha256=None):
+        self.rubrics = rubrics
+        self.name = name
+        self.sheet_name = sheet_name
+        self.sha256 = sha256
+        owners = {}
+        for i, rubric in enumerate(rubrics):
+            for prefix in rubric.prefixes:
+                if prefix in owners:
+                    raise MappingError("Préfixe %s présent dans les rubriques %s et %s"
+                                       % (prefix, rubrics[owners[prefix]].code, rubric.code))
+                owners[prefix] = i
+        # Longueur de prefixe -> (prefixes tries, rubrique de chaque prefixe), du plus long au plus court
+        self._index = []
+        for length in sorted({len(p) for p in owners}, reverse=True):
+            prefixes = sorted(p for p in owners if len(p) == length)
+            self._index.append((length, prefixes, np.array([owners[p] for p in prefixes], dtype=np.int64)))
+        self._typed = {}
+        self.signs = np.array([rubric.sign for rubric in rubrics])
+
+    @classmethod
+    def from_json(cls, data):
+        try:
+            content = json.loads(data)
+        except ValueError as e:
+            raise MappingError("Fichier de correspondance illisible: %s" % e)
+        rubrics = []
+        for item in content.get("rubriques", []):
+            direction = item.get("sens", "debit")
+            if direction not in SIGNS:
+                raise MappingError("Sens inconnu pour la rubrique %s: %s" % (item.get("code"), direction))
+            prefixes = [str(p).strip() for p in item.get("prefixes", []) if str(p).strip()]
+            rubrics.append(Rubric(str(item["code"]), item.get("libelle", ""), SIGNS[direction], prefixes))
+        return cls(rubrics, content.get("nom", ""), content.get("feuille", DEFAULT_SHEET), bytes_sha256(data))
+
+    def __len__(self):
+        return len(self.rubrics)
+
+    def _prefix_arrays(self, kind):
+        """Index des prefixes dans le type des numeros de compte (bytes ou unicode)"""
+        arrays = self._typed.get(kind)
+        if arrays is None:
+            arrays = self._typed[kind] = [
+                (length, np.array([p.encode("utf-8") for p in prefixes] if kind == "S" else prefixes,
+                                  dtype="%s%d" % (kind, length)), owners)
+                for length, prefixes, owners in self._index
+            ]
+        return arrays
+
+    def classify(self, accounts):
+        """Rubrique (indice dans self.rubrics) de chaque compte, -1 si aucun prefixe ne correspond"""
+        kind = accounts.dtype.kind
+        result = np.full(len(accounts), -1, dtype=np.int64)
+        for length, prefixes, owners in self._prefix_arrays(kind):
+            pending = np.flatnonzero(result < 0)
+            if not len(pending):
+                break
+            # Numeros tronques a la longueur du prefixe (un numero plus court ne peut pas correspondre)
+            heads = accounts[pending].astype("%s%d" % (kind, length))
+            position = np.searchsorted(prefixes, heads)
+            position[position >= len(prefixes)] = 0
+            found = prefixes[position] == heads
+            result[pending[found]] = owners[position[found]]
+        return result
+
+    def totals(self, balance_n, balance_n1=None):
+        return RubricTotals(self, balance_n, balance_n1)
+
+
+class RubricTotals:
+    """Total de chaque rubrique pour les balances N et N-1, et comptes non rattaches"""
+
+    def __init__(self, mapping, balance_n, balance_n1=None):
+        self.mapping = mapping
+        self.balances = (balance_n, balance_n1)
+        size = len(mapping)
+        self.amounts = []
+        self.counts = []
+        self.unmapped = []
+        for balance in self.balances:
+            if balance is None:
+                self.amounts.append(np.zeros(size))
+                self.counts.append(np.zeros(size, dtype=np.int64))
+                self.unmapped.append(np.zeros(0, dtype=np.int64))
+                continue
+            rubric = mapping.classify(balance.accounts)
+            mapped = rubric >= 0
+            self.amounts.append(np.round(np.bincount(rubric[mapped], weights=balance.solde()[mapped], minlength=size) * mapping.signs, 2))
+            self.counts.append(np.bincount(rubric[mapped], minlength=size))
+            self.unmapped.append(np.flatnonzero(~mapped))
+
+    @property
+    def unmapped_count(self):
+        return sum(len(indexes) for indexes in self.unmapped)
+
+    def to_columns(self):
+        """Table (dict de colonnes) des rubriques pour l'affichage"""
+        rubrics = self.mapping.rubrics
+        return {
+            "Code": [r.code for r in rubrics],
+            "Rubrique": [r.label for r in rubrics],
+            "Montant N": self.amounts[0],
+            "Montant N-1": self.amounts[1],
+            "Comptes N": self.counts[0],
+            "Comptes N-1": self.counts[1],
+        }
+
+    def unmapped_columns(self):
+        """Comptes des balances N et N-1 sans rubrique"""
+        columns = {"Balance": [], "Compte": [], "Intitulé": [], "Solde": []}
+        for name, balance, indexes in zip(("N", "N-1"), self.balances, self.unmapped):
+            if balance is None:
+                continue
+            solde = balance.solde()
+            for i in indexes.tolist():
+                columns["Balance"].append(name)
+                columns["Compte"].append(balance.account(i))
+                columns["Intitulé"].append(balance.label(i))
+                columns["Solde"].append(float(solde[i]))
+        return columns
+
+    def to_xlsx(self):
+        """Contenu xlsx de la feuille des rubriques: une ligne par rubrique, code en colonne A"""
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet(self.mapping.sheet_name)
+        ws.column_dimensions["B"].width = 50
+        ws.column_dimensions["D"].width = 30
+        for letter in "EF":
+            ws.column_dimensions[letter].width = 18
+        bold = Font(bold=True)
+        header = []
+        for text in SHEET_HEADERS:
+            cell = WriteOnlyCell(ws, value=text)
+            cell.font = bold
+            header.append(cell)
+        ws.append(header)
+        amount_cells = [WriteOnlyCell(ws), WriteOnlyCell(ws)]
+        for cell in amount_cells:
+            cell.number_format = AMOUNT_FORMAT
+        for i, rubric in enumerate(self.mapping.rubrics):
+            amount_cells[0].value = float(self.amounts[0][i])
+            amount_cells[1].value = float(self.amounts[1][i])
+            ws.append([rubric.code, rubric.label, rubric.direction, " ".join(rubric.prefixes)]
+                      + amount_cells + [int(self.counts[0][i]), int(self.counts[1][i])])
+        output = io.BytesIO()
+        wb.save(output)
+        return output.getvalue()
+
+
+# Fichiers de correspondance deja lus, relus seulement s'ils changent sur disque
+_loaded = {}
+_lock = threading.Lock()
+
+
+def load_mapping(path):
+    """Mapping d'un fichier de correspondance (partage par toutes les sessions)"""
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        entry = _loaded.get(path)
+        if entry is not None and entry[0] == signature:
+            return entry[1]
+    with open(path, "rb") as f:
+        mapping = Mapping.from_json(f.read())
+    with _lock:
+        _loaded[path] = (signature, mapping)
+    return mapping
@@ -0,0 +1,1008 @@
+"""Moteur d'integration au niveau du paquet xlsx (archive zip OOXML).
+
+Les feuilles des balances sont recopiees directement dans l'archive du modele,
+sans construire de classeur openpyxl: les chaines partagees et les styles sont
+fusionnes, les feuilles 'BAL N' / 'BAL N-1' sont remplacees et toutes les autres
+parties du modele (feuilles, images, dessins...) sont recopiees a l'identique.
+"""
+import hashlib
+import io
+import posixpath
+import re
+import zipfile
+from xml.sax.saxutils import escape, unescape
+
+from openpyxl.utils.cell import get_column_letter
+
+ENGINE_VERSION = "ooxml-1"
+
+CHUNK_SIZE = 1024 * 1024
+
+_ENTITIES = {"&quot;": '"', "&apos;": "'"}
+
+NS_RELATIONSHIPS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+REL_WORKSHEET = NS_RELATIONSHIPS + "/worksheet"
+REL_SHARED_STRINGS = NS_RELATIONSHIPS + "/sharedStrings"
+REL_STYLES = NS_RELATIONSHIPS + "/styles"
+REL_CALC_CHAIN = NS_RELATIONSHIPS + "/calcChain"
+CT_WORKSHEET = "application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"
+CT_SHARED_STRINGS = "application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"
+
+_ATTR_RE = re.compile(r'([\w:.-]+)\s*=\s*"([^"]*)"')
+
+# Elements de fin de feuille conserves, comme la copie openpyxl (fusions et mise en page)
+_KEPT_TAIL_ELEMENTS = ("mergeCells", "printOptions", "pageMargins", "pageSetup", "headerFooter")
+
+
+class OOXMLError(Exception):
+    pass
+
+
+def _attrs(tag):
+    return {k: unescape(v, _ENTITIES) for k, v in _ATTR_RE.findall(tag)}
+
+
+def _set_attr(tag, name, value):
+    """Remplace (ou ajoute) un attribut dans une balise ouvrante"""
+    value = escape(str(value), {'"': "&quot;"})
+    pattern = re.compile(r'(\s%s\s*=\s*")[^"]*(")' % re.escape(name))
+    if pattern.search(tag):
+        return pattern.sub(lambda m: m.group(1) + value + m.group(2), tag, count=1)
+    end = -2 if tag.endswith("/>") else -1
+    return tag[:end].rstrip() + ' %s="%s"' % (name, value) + tag[end:]
+
+
+def _prefix(xml, root):
+    """Prefixe d'espace de noms utilise par l'element racine ('' ou 'x:')"""
+    m = re.search(r"<(\w+:)?%s\b" % root, xml)
+    return (m.group(1) or "") if m else ""
+
+
+def _elements(xml, name, prefix=""):
+    """Liste des elements <name> (brut) d'un fragment xml, sans imbrication du meme nom"""
+    pattern = r"<%s%s\b[^>]*?(?:/>|>.*?</%s%s>)" % (prefix, name, prefix, name)
+    return re.findall(pattern, xml, re.S)
+
+
+def _section(xml, name, prefix=""):
+    """Retourne (debut, fin, balise ouvrante, contenu) d'une section comme <fonts>...</fonts>"""
+    m = re.search(r"(<%s%s\b[^>]*?)(/>|>(.*?)</%s%s>)" % (prefix, name, prefix, name), xml, re.S)
+    if not m:
+        return None
+    return m.start(), m.end(), m.group(1) + ">", m.group(3) or ""
+
+
+def _reprefix(fragment, old, new):
+    if old == new:
+        return fragment
+    return re.sub(r"(</?)%s" % re.escape(old), lambda m: m.group(1) + new, fragment) if old else \
+        re.sub(r"(</?)(?=\w)", lambda m: m.group(1) + new, fragment)
+
+
+def _resolve(base_dir, target):
+    if target.startswith("/"):
+        return target.lstrip("/")
+    return posixpath.normpath(posixpath.join(base_dir, target))
+
+
+def _rels_path(part):
+    directory, name = posixpath.split(part)
+    return posixpath.join(directory, "_rels", name + ".rels")
+
+
+class _Package:
+    """Lecture des parties utiles d'un paquet xlsx"""
+
+    def __init__(self, source):
+        self.zip = zipfile.ZipFile(source if not isinstance(source, bytes) else io.BytesIO(source))
+        self.names = set(self.zip.namelist())
+        self.workbook_part = self._find_workbook()
+        self.workbook_xml = self.read_text(self.workbook_part)
+        self.workbook_rels_part = _rels_path(self.workbook_part)
+        self.workbook_rels = self.read_text(self.workbook_rels_part) if self.workbook_rels_part in self.names else ""
+        self.relations = [_attrs(tag) for tag in re.findall(r"<(?:\w+:)?Relationship\b[^>]*>", self.workbook_rels)]
+        base_dir = posixpath.dirname(self.workbook_part)
+        for rel in self.relations:
+            rel["Part"] = _resolve(base_dir, rel.get("Target", ""))
+        prefix = _prefix(self.workbook_xml, "workbook")
+        self.sheets = []
+        for tag in re.findall(r"<%ssheet\b[^>]*>" % prefix, self.workbook_xml):
+            attrs = _attrs(tag)
+            rid = next((v for k, v in attrs.items() if k.endswith(":id")), None)
+            part = next((r["Part"] for r in self.relations if r.get("Id") == rid), None)
+            self.sheets.append({"tag": tag, "name": attrs.get("name"), "sheetId": attrs.get("sheetId"), "rid": rid, "part": part})
+
+    def _find_workbook(self):
+        rels = self.read_text("_rels/.rels")
+        for tag in re.findall(r"<(?:\w+:)?Relationship\b[^>]*>", rels):
+            attrs = _attrs(tag)
+            if attrs.get("Type", "").endswith("/officeDocument"):
+                return _resolve("", attrs["Target"])
+        raise OOXMLError("Classeur introuvable dans le fichier")
+
+    def read_text(self, part):
+        return self.zip.read(part).decode("utf-8")
+
+    def related_part(self, rel_type):
+        return next((r["Part"] for r in self.relations if r.get("Type") == rel_type and r["Part"] in self.names), None)
+
+    def active_sheet(self):
+        m = re.search(r"<(?:\w+:)?workbookView\b[^>]*>", self.workbook_xml)
+        index = int(_attrs(m.group(0)).get("activeTab", 0)) if m else 0
+        if not self.sheets:
+            raise OOXMLError("Le fichier ne contient aucune feuille")
+        sheet = self.sheets[index] if index < len(self.sheets) else self.sheets[0]
+        if sheet["part"] not in self.names:
+            raise OOXMLError("Feuille active introuvable: %s" % sheet["name"])
+        return sheet
+
+    def sheet_named(self, name):
+        sheet = next((s for s in self.sheets if s["name"] == name), None)
+        if sheet is None or sheet["part"] not in self.names:
+            raise OOXMLError("Feuille introuvable: %s" % name)
+        return sheet
+
+    def close(self):
+        self.zip.close()
+
+
+class _SharedStrings:
+    """Table des chaines partagees du modele, enrichie par celles des balances"""
+
+    def __init__(self, xml):
+        self.prefix = _prefix(xml, "sst") if xml else ""
+        section = _section(xml, "sst", self.prefix) if xml else None
+        self.head = section[2] if section else '<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        self.xml_decl = xml[:section[0]] if section else '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        self.items = _elements(section[3], "si", self.prefix) if section else []
+        self.count = int(_attrs(self.head).get("count", len(self.items)))
+        self._index = None
+        self.changed = False
+
+    def mapping(self, source_xml):
+        """Index des chaines de la balance -> index dans la table du modele"""
+        if not source_xml:
+            return []
+        src_prefix = _prefix(source_xml, "sst")
+        if self._index is None:
+            self._index = {}
+            for i, item in enumerate(self.items):
+                self._index.setdefault(item, i)
+        mapping = []
+        for item in _elements(source_xml, "si", src_prefix):
+            item = _reprefix(item, src_prefix, self.prefix)
+            index = self._index.get(item)
+            if index is None:
+                index = len(self.items)
+                self.items.append(item)
+                self._index[item] = index
+                self.changed = True
+            mapping.append(index)
+        return mapping
+
+    def tostring(self):
+        head = _set_attr(_set_attr(self.head, "count", self.count), "uniqueCount", len(self.items))
+        return self.xml_decl + head + "".join(self.items) + "</%ssst>" % self.prefix
+
+
+class _Styles:
+    """Fusion des styles (formats, polices, remplissages, bordures, cellXfs) des balances dans le modele"""
+
+    _LISTS = (("numFmts", "numFmt"), ("fonts", "font"), ("fills", "fill"), ("borders", "border"), ("cellXfs", "xf"))
+
+    def __init__(self, xml):
+        self.xml = xml
+        self.prefix = _prefix(xml, "styleSheet")
+        self.items = {}
+        for section, child in self._LISTS:
+            found = _section(xml, section, self.prefix)
+            self.items[section] = _elements(found[3], child, self.prefix) if found else []
+        self._indexes = {}
+        self._numfmt_codes = {}
+        for item in self.items["numFmts"]:
+            attrs = _attrs(item)
+            self._numfmt_codes[attrs.get("formatCode")] = int(attrs.get("numFmtId"))
+        self.changed = False
+
+    def _intern(self, section, item):
+        index = self._indexes.get(section)
+        if index is None:
+            index = self._indexes[section] = {}
+            for i, existing in enumerate(self.items[section]):
+                index.setdefault(existing, i)
+        position = index.get(item)
+        if position is None:
+            position = len(self.items[section])
+            self.items[section].append(item)
+            index[item] = position
+            self.changed = True
+        return position
+
+    def mapping(self, source_xml):
+        """Index cellXfs de la balance -> index cellXfs dans le modele"""
+        if not source_xml:
+            return []
+        src_prefix = _prefix(source_xml, "styleSheet")
+
+        def children(section, child):
+            found = _section(source_xml, section, src_prefix)
+            items = _elements(found[3], child, src_prefix) if found else []
+            return [_reprefix(item, src_prefix, self.prefix) for item in items]
+
+        numfmt_map = {}
+        for item in children("numFmts", "numFmt"):
+            attrs = _attrs(item)
+            code, old_id = attrs.get("formatCode"), int(attrs.get("numFmtId"))
+            new_id = self._numfmt_codes.get(code)
+            if new_id is None:
+                new_id = max([163] + list(self._numfmt_codes.values())) + 1
+                self._numfmt_codes[code] = new_id
+                self.items["numFmts"].append(_set_attr(item, "numFmtId", new_id))
+                self.changed = True
+            numfmt_map[old_id] = new_id
+
+        maps = {}
+        for section, child in (("fonts", "font"), ("fills", "fill"), ("borders", "border")):
+            maps[section] = [self._intern(section, item) for item in children(section, child)]
+
+        xf_map = []
+        for xf in children("cellXfs", "xf"):
+            tag_end = xf.index(">") + 1
+            tag, body = xf[:tag_end], xf[tag_end:]
+            attrs = _attrs(tag)
+            num_fmt = int(attrs.get("numFmtId", 0))
+            tag = _set_attr(tag, "numFmtId", numfmt_map.get(num_fmt, num_fmt))
+            for attr, section in (("fontId", "fonts"), ("fillId", "fills"), ("borderId", "borders")):
+                old = int(attrs.get(attr, 0))
+                ids = maps[section]
+                tag = _set_attr(tag, attr, ids[old] if old < len(ids) else 0)
+            tag = _set_attr(tag, "xfId", 0)
+            xf_map.append(self._intern("cellXfs", tag + body))
+        return xf_map
+
+    def tostring(self):
+        xml = self.xml
+        p = self.prefix
+        # On remplace les sections de la fin vers le debut pour garder les positions valides
+        sections = []
+        for section, child in self._LISTS:
+            found = _section(xml, section, p)
+            if found is None and not self.items[section]:
+                continue
+            sections.append((section, found))
+        for section, found in sorted(sections, key=lambda s: -(s[1][0] if s[1] else 0)):
+            items = self.items[section]
+            if found is None:
+                root = re.search(r"<%sstyleSheet\b[^>]*>" % p, xml)
+                new = '<%s%s count="%d">%s</%s%s>' % (p, section, len(items), "".join(items), p, section)
+                xml = xml[:root.end()] + new + xml[root.end():]
+            else:
+                start, end, head, _ = found
+                new = _set_attr(head, "count", len(items)) + "".join(items) + "</%s%s>" % (p, section)
+                xml = xml[:start] + new + xml[end:]
+        return xml
+
+
+class _SheetRewriter:
+    """Recopie en flux d'une feuille de balance avec remappage des styles et des chaines"""
+
+    def __init__(self, prefix, xf_map, sst_map, progress=None):
+        p = re.escape(prefix).encode()
+        self.prefix = prefix.encode()
+        self.xf_map = xf_map
+        self.sst_map = sst_map
+        self.progress = progress
+        self.string_refs = 0
+        self.rows = 0
+        self._sst_re = re.compile(rb'(<%sc\b[^>]*?\bt="s"[^>]*>\s*<%sv>)(\d+)(</%sv>)' % (p, p, p))
+        self._cell_style_re = re.compile(rb'(<%s(?:c|row)\b[^>]*?\ss=")(\d+)' % p)
+        self._styles = {str(i).encode(): str(new).encode() for i, new in enumerate(xf_map)}
+        self._col_re = re.compile(rb"<%scol\b[^>]*>" % p)
+        self._style_re = re.compile(rb'(\s(?:s|style)=")(\d+)(")')
+        self._row_end = b"</%srow>" % self.prefix
+        self._data_start = re.compile(rb"<%ssheetData\b[^>]*?(/?)>" % p)
+        self._data_end = b"</%ssheetData>" % self.prefix
+
+    def _style(self, m):
+        index = int(m.group(2))
+        new = self.xf_map[index] if index < len(self.xf_map) else 0
+        return m.group(1) + str(new).encode() + m.group(3)
+
+    def _restyle_tag(self, m):
+        return self._style_re.sub(self._style, m.group(0))
+
+    def _cell_style(self, m):
+        return m.group(1) + self._styles.get(m.group(2), b"0")
+
+    def _shared_string(self, m):
+        index = int(m.group(2))
+        self.string_refs += 1
+        new = self.sst_map[index] if index < len(self.sst_map) else index
+        return m.group(1) + str(new).encode() + m.group(3)
+
+    def _data(self, chunk):
+        if self.sst_map:
+            chunk = self._sst_re.sub(self._shared_string, chunk)
+        self.rows += chunk.count(self._row_end)
+        if self.progress is not None:
+            self.progress(self.rows)
+        return self._cell_style_re.sub(self._cell_style, chunk)
+
+    def _head(self, head):
+        head = re.sub(rb"<%ssheetPr\b[^>]*?(?:/>|>.*?</%ssheetPr>)" % (self.prefix, self.prefix), b"", head, flags=re.S)
+        head = re.sub(rb'\stabSelected="[^"]*"', b"", head)
+        return self._col_re.sub(self._restyle_tag, head)
+
+    def _tail(self, tail):
+        kept = []
+        for name in _KEPT_TAIL_ELEMENTS:
+            pattern = rb"<%s%s\b[^>]*?(?:/>|>.*?</%s%s>)" % (self.prefix, name.encode(), self.prefix, name.encode())
+            for m in re.finditer(pattern, tail, re.S):
+                element = m.group(0)
+                if name == "pageSetup":
+                    # L'imprimante liee (printerSettings) n'est pas recopiee
+                    element = re.sub(rb'\s[\w]+:id="[^"]*"', b"", element)
+                kept.append((m.start(), element))
+        return b"".join(e for _, e in sorted(kept)) + b"</%sworksheet>" % self.prefix
+
+    def rewrite(self, source, target):
+        buffer = b""
+        # En-tete (jusqu'a <sheetData>)
+        while True:
+            chunk = source.read(CHUNK_SIZE)
+            buffer += chunk
+            m = self._data_start.search(buffer)
+            if m or not chunk:
+                break
+        if not m:
+            raise OOXMLError("Feuille sans donnees (sheetData manquant)")
+        target.write(self._head(buffer[:m.end()]))
+        buffer = buffer[m.end():]
+        if m.group(1) != b"/":
+            # Donnees, traitees par blocs de lignes completes
+            while True:
+                end = buffer.find(self._data_end)
+                if end >= 0:
+                    target.write(self._data(buffer[:end]) + self._data_end)
+                    buffer = buffer[end + len(self._data_end):]
+                    break
+                cut = buffer.rfind(self._row_end)
+                if cut >= 0:
+                    cut += len(self._row_end)
+                    target.write(self._data(buffer[:cut]))
+                    buffer = buffer[cut:]
+                chunk = source.read(CHUNK_SIZE)
+                if not chunk:
+                    raise OOXMLError("Feuille tronquee (fin de sheetData manquante)")
+                buffer += chunk
+        tail = buffer + source.read()
+        target.write(self._tail(tail))
+
+
+def read_sheet_layout(source, sheet=None):
+    """Lit en flux la feuille active (ou la feuille nommee sheet) d'un fichier: largeurs de colonnes et plages fusionnees.
+
+    Complement de la lecture openpyxl en mode read_only, qui n'expose pas ces informations.
+    """
+    package = _Package(source)
+    try:
+        active = package.active_sheet() if sheet is None else package.sheet_named(sheet)
+        with package.zip.open(active["part"]) as stream:
+            buffer = b""
+            columns = []
+            head_done = False
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                buffer += chunk
+                if not head_done:
+                    m = re.search(rb"<(?:\w+:)?sheetData\b", buffer)
+                    if m or not chunk:
+                        head = buffer[:m.start()] if m else buffer
+                        for tag in re.findall(rb"<(?:\w+:)?col\b[^>]*>", head):
+                            columns.append(_attrs(tag.decode("utf-8")))
+                        head_done = True
+                end = re.search(rb"</(?:\w+:)?sheetData>", buffer)
+                if end:
+                    tail = buffer[end.end():] + stream.read()
+                    break
+                if not chunk:
+                    tail = b""
+                    break
+                # On ne garde que la fin du bloc, au cas ou la balise fermante serait coupee
+                buffer = buffer[-32:]
+        merged = [ref.decode("utf-8") for ref in re.findall(rb'<(?:\w+:)?mergeCell\b[^>]*\bref="([^"]+)"', tail)]
+        return columns, merged
+    finally:
+        package.close()
+
+
+def _sheet_summary(package):
+    summary = []
+    for sheet in package.sheets:
+        dimension = None
+        size = None
+        if sheet["part"] in package.names:
+            size = package.zip.getinfo(sheet["part"]).file_size
+            with package.zip.open(sheet["part"]) as stream:
+                # <dimension> precede <sheetData>: le debut de la partie suffit
+                m = re.search(rb'<(?:\w+:)?dimension\b[^>]*\bref="([^"]+)"', stream.read(4096))
+                dimension = m.group(1).decode("utf-8") if m else None
+        summary.append({"name": sheet["name"], "dimension": dimension, "size": size})
+    return summary
+
+
+def read_workbook_summary(source):
+    """Feuilles d'un fichier (nom, plage utilisee d'apres <dimension>, taille de la partie), sans lire les cellules"""
+    package = _Package(source)
+    try:
+        return _sheet_summary(package)
+    finally:
+        package.close()
+
+
+def read_package_summary(source):
+    """Repertoire central du zip et workbook.xml seulement: feuilles (comme read_workbook_summary),
+    nom de la feuille active et taille totale une fois decompresse"""
+    package = _Package(source)
+    try:
+        return {
+            "sheets": _sheet_summary(package),
+            "active": package.active_sheet()["name"],
+            "uncompressed": sum(info.file_size for info in package.zip.infolist()),
+        }
+    finally:
+        package.close()
+
+
+def _empty_sheet():
+    return (b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData/></worksheet>')
+
+
+def _value_xml(value):
+    """(type de cellule ou None, texte de <v>) d'une valeur calculee; une exception est une valeur d'erreur"""
+    if isinstance(value, bool):
+        return "b", "1" if value else "0"
+    if isinstance(value, (int, float)):
+        return None, repr(value)
+    if isinstance(value, Exception):
+        return "e", escape(str(value))
+    return "str", escape(str(value))
+
+
+def _set_cached_values(xml, values):
+    """Ecrit la valeur en cache (<v>) des cellules a formule d'une feuille.
+
+    values: {(ligne, colonne): valeur}, lignes et colonnes a partir de 1
+    """
+    p = _prefix(xml[:4096].decode("utf-8", "ignore"), "worksheet").encode()
+    cell_re = re.compile(rb"<%sc\b([^>]*?)(/>|>(.*?)</%sc>)" % (p, p), re.S)
+    ref_re = re.compile(rb'\br="([A-Z]+)(\d+)"')
+    formula_re = re.compile(rb"<%sf\b[^>]*?(?:/>|>.*?</%sf>)" % (p, p), re.S)
+
+    def replace(m):
+        body = m.group(3)
+        if not body or b"<%sf" % p not in body:
+            return m.group(0)
+        ref = ref_re.search(m.group(1))
+        if ref is None:
+            return m.group(0)
+        key = (int(ref.group(2)), _column_index(ref.group(1).decode()) + 1)
+        if key not in values:
+            return m.group(0)
+        kind, text = _value_xml(values[key])
+        attrs = re.sub(rb'\st="[^"]*"', b"", m.group(1))
+        if kind is not None:
+            attrs += b' t="%s"' % kind.encode()
+        formula = formula_re.search(body).group(0)
+        return b"<%sc%s>%s<%sv>%s</%sv></%sc>" % (p, attrs, formula, p, text.encode("utf-8"), p, p)
+
+    return cell_re.sub(replace, xml)
+
+
+def set_cached_values(source, values, output=None):
+    """Copie d'un fichier xlsx avec les valeurs en cache des cellules a formule.
+
+    values: nom de feuille -> {(ligne, colonne): valeur}
+    output: flux binaire de sortie; si absent, le fichier est retourne en bytes
+    """
+    package = _Package(source)
+    try:
+        parts = {s["part"]: values[s["name"]] for s in package.sheets if s["name"] in values}
+        out = output if output is not None else io.BytesIO()
+        with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zout:
+            for info in package.zip.infolist():
+                if info.filename in parts:
+                    zout.writestr(info.filename, _set_cached_values(package.zip.read(info), parts[info.filename]))
+                else:
+                    with package.zip.open(info) as src, zout.open(info.filename, "w", force_zip64=True) as dst:
+                        while True:
+                            chunk = src.read(CHUNK_SIZE)
+                            if not chunk:
+                                break
+                            dst.write(chunk)
+    finally:
+        package.close()
+    if output is None:
+        return out.getvalue()
+    return output
+
+
+_TABLE_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="%s"/>'
+        '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>' % CT_WORKSHEET),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="%s/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>' % NS_RELATIONSHIPS),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="%s" Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" Type="%s" Target="styles.xml"/>'
+        '</Relationships>' % (REL_WORKSHEET, REL_STYLES)),
+    # Styles: 0 standard, 1 gras (titres et en-tetes), 2 montant
+    "xl/styles.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<numFmts count="1"><numFmt numFmtId="164" formatCode="#,##0.00"/></numFmts>'
+        '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font><font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="3"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>'
+        '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>'),
+}
+
+
+def write_table(rows, sheet_name="Feuille1", widths=None, output=None):
+    """Ecrit en flux un classeur d'une feuille, sans openpyxl.
+
+    rows: lignes (valeurs, gras); les nombres des lignes non grasses sont au format montant,
+    les textes sont ecrits en chaines en ligne, None laisse la cellule vide.
+    widths: {lettre de colonne: largeur}
+    Retourne le contenu du fichier si output est None.
+    """
+    target = output if output is not None else io.BytesIO()
+    letters = []
+    with zipfile.ZipFile(target, "w", zipfile.ZIP_DEFLATED) as archive:
+        for part, xml in _TABLE_PARTS.items():
+            archive.writestr(part, xml)
+        archive.writestr("xl/workbook.xml", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="%s">'
+            '<sheets><sheet name="%s" sheetId="1" r:id="rId1"/></sheets></workbook>'
+            % (NS_RELATIONSHIPS, escape(sheet_name, {'"': "&quot;"}))))
+        with archive.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as stream:
+            head = ['<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">']
+            if widths:
+                head.append("<cols>")
+                for letter, width in sorted(widths.items(), key=lambda item: _column_index(item[0])):
+                    index = _column_index(letter) + 1
+                    head.append('<col min="%d" max="%d" width="%s" customWidth="1"/>' % (index, index, width))
+                head.append("</cols>")
+            head.append("<sheetData>")
+            stream.write("".join(head).encode("utf-8"))
+            block = []
+            for number, (values, bold) in enumerate(rows, 1):
+                while len(letters) < len(values):
+                    letters.append(get_column_letter(len(letters) + 1))
+                cells = []
+                for letter, value in zip(letters, values):
+                    if value is None:
+                        continue
+                    if isinstance(value, str):
+                        cells.append('<c r="%s%d" t="inlineStr"%s><is><t xml:space="preserve">%s</t></is></c>'
+                                     % (letter, number, ' s="1"' if bold else "", escape(value)))
+                    elif isinstance(value, bool):
+                        cells.append('<c r="%s%d" t="b"><v>%d</v></c>' % (letter, number, value))
+                    else:
+                        cells.append('<c r="%s%d" s="%d"><v>%r</v></c>' % (letter, number, 1 if bold else 2, value))
+                block.append('<row r="%d">%s</row>' % (number, "".join(cells)))
+                if len(block) >= 1000:
+                    stream.write("".join(block).encode("utf-8"))
+                    block = []
+            block.append("</sheetData></worksheet>")
+            stream.write("".join(block).encode("utf-8"))
+    if output is None:
+        return target.getvalue()
+
+
+def integrate_balances(template, balances, output=None, progress=None, cached_values=None):
+    """Integre les balances dans le modele au niveau du paquet xlsx.
+
+    template: chemin ou contenu (bytes) du modele
+    balances: dict nom de feuille -> contenu (bytes) du fichier de balance, ou None
+    output: flux binaire de sortie; si absent, le fichier est retourne en bytes
+    progress: fonction (nom de feuille, lignes ecrites) appelee a chaque bloc de lignes;
+              une exception levee par progress interrompt l'integration
+    cached_values: nom de feuille du modele -> {(ligne, colonne): valeur} des formules calculees
+    """
+    package = _Package(template)
+    sources = []
+    try:
+        styles_part = package.related_part(REL_STYLES)
+        styles = _Styles(package.read_text(styles_part)) if styles_part else None
+        sst_part = package.related_part(REL_SHARED_STRINGS)
+        shared_strings = _SharedStrings(package.read_text(sst_part) if sst_part else "")
+
+        workbook_xml = package.workbook_xml
+        rels_xml = package.workbook_rels
+        content_types = package.read_text("[Content_Types].xml")
+        wb_prefix = _prefix(workbook_xml, "workbook")
+        base_dir = posixpath.dirname(package.workbook_part)
+
+        # Feuilles a remplacer (ou a ajouter si le modele ne les contient pas)
+        replaced = {}
+        for name, data in balances.items():
+            sheet = next((s for s in package.sheets if s["name"] == name), None)
+            if sheet is None:
+                number = 1
+                while "%s/worksheets/sheet%d.xml" % (base_dir, number) in package.names or \
+                        any(r["part"] == "%s/worksheets/sheet%d.xml" % (base_dir, number) for r in replaced.values()):
+                    number += 1
+                part = "%s/worksheets/sheet%d.xml" % (base_dir, number)
+                rid_number = 1
+                existing_ids = {r.get("Id") for r in package.relations} | {r["rid"] for r in replaced.values()}
+                while "rId%d" % rid_number in existing_ids:
+                    rid_number += 1
+                rid = "rId%d" % rid_number
+                sheet_ids = [int(s["sheetId"]) for s in package.sheets] + [int(r["sheetId"]) for r in replaced.values()]
+                sheet_id = max(sheet_ids + [0]) + 1
+                r_attr = next((k for k in _attrs(package.sheets[0]["tag"]) if k.endswith(":id")), "r:id") if package.sheets else "r:id"
+                tag = '<%ssheet name="%s" sheetId="%d" %s="%s"/>' % (wb_prefix, escape(name, {'"': "&quot;"}), sheet_id, r_attr, rid)
+                workbook_xml = workbook_xml.replace("</%ssheets>" % wb_prefix, tag + "</%ssheets>" % wb_prefix, 1)
+                rels_xml = rels_xml.replace("</Relationships>", '<Relationship Id="%s" Type="%s" Target="%s"/></Relationships>'
+                                            % (rid, REL_WORKSHEET, posixpath.relpath(part, base_dir)), 1)
+                content_types = content_types.replace("</Types>", '<Override PartName="/%s" ContentType="%s"/></Types>' % (part, CT_WORKSHEET), 1)
+                sheet = {"part": part, "rid": rid, "sheetId": sheet_id}
+            replaced[name] = dict(sheet, data=data)
+
+        # Feuilles du modele dont les formules recoivent une valeur calculee
+        valued = {s["part"]: cached_values[s["name"]] for s in package.sheets
+                  if cached_values and s["name"] in cached_values and s["name"] not in replaced}
+
+        # Suppression de la chaine de calcul: Excel recalcule tout a l'ouverture
+        removed = {_rels_path(s["part"]) for s in replaced.values()}
+        calc_chain = package.related_part(REL_CALC_CHAIN)
+        if calc_chain:
+            removed.add(calc_chain)
+            rels_xml = re.sub(r'<Relationship\b[^>]*Type="%s"[^>]*>' % re.escape(REL_CALC_CHAIN), "", rels_xml)
+            content_types = re.sub(r'<Override\b[^>]*PartName="/%s"[^>]*>' % re.escape(calc_chain), "", content_types)
+        calc_pr = re.search(r"<%scalcPr\b[^>]*>" % wb_prefix, workbook_xml)
+        if calc_pr:
+            workbook_xml = workbook_xml.replace(calc_pr.group(0), _set_attr(calc_pr.group(0), "fullCalcOnLoad", 1), 1)
+        else:
+            anchor = "</%sdefinedNames>" % wb_prefix if "</%sdefinedNames>" % wb_prefix in workbook_xml else "</%ssheets>" % wb_prefix
+            workbook_xml = workbook_xml.replace(anchor, anchor + '<%scalcPr fullCalcOnLoad="1"/>' % wb_prefix, 1)
+
+        out = output if output is not None else io.BytesIO()
+        with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zout:
+            # Feuilles des balances, ecrites en flux
+            for name, sheet in replaced.items():
+                with zout.open(sheet["part"], "w", force_zip64=True) as target:
+                    if sheet["data"] is None:
+                        target.write(_empty_sheet())
+                        continue
+                    source = _Package(sheet["data"])
+                    sources.append(source)
+                    src_styles = source.related_part(REL_STYLES)
+                    src_sst = source.related_part(REL_SHARED_STRINGS)
+                    xf_map = styles.mapping(source.read_text(src_styles)) if styles and src_styles else []
+                    sst_map = shared_strings.mapping(source.read_text(src_sst) if src_sst else "")
+                    active = source.active_sheet()
+                    with source.zip.open(active["part"]) as stream:
+                        head = stream.read(4096).decode("utf-8", "ignore")
+                    sheet_progress = (lambda rows, name=name: progress(name, rows)) if progress is not None else None
+                    rewriter = _SheetRewriter(_prefix(head, "worksheet"), xf_map, sst_map, sheet_progress)
+                    with source.zip.open(active["part"]) as stream:
+                        rewriter.rewrite(stream, target)
+                    shared_strings.count += rewriter.string_refs
+
+            if shared_strings.changed and not sst_part:
+                sst_part = base_dir + "/sharedStrings.xml"
+                rid_number = 1
+                existing_ids = {r.get("Id") for r in package.relations} | {r["rid"] for r in replaced.values()}
+                while "rId%d" % rid_number in existing_ids:
+                    rid_number += 1
+                rels_xml = rels_xml.replace("</Relationships>", '<Relationship Id="rId%d" Type="%s" Target="sharedStrings.xml"/></Relationships>'
+                                            % (rid_number, REL_SHARED_STRINGS), 1)
+                content_types = content_types.replace("</Types>", '<Override PartName="/%s" ContentType="%s"/></Types>' % (sst_part, CT_SHARED_STRINGS), 1)
+
+            rewritten = {
+                "[Content_Types].xml": content_types.encode("utf-8"),
+                package.workbook_part: workbook_xml.encode("utf-8"),
+                package.workbook_rels_part: rels_xml.encode("utf-8"),
+            }
+            if styles is not None and styles.changed:
+                rewritten[styles_part] = styles.tostring().encode("utf-8")
+            if shared_strings.changed:
+                rewritten[sst_part] = shared_strings.tostring().encode("utf-8")
+
+            zout.writestr("[Content_Types].xml", rewritten.pop("[Content_Types].xml"))
+            written = {"[Content_Types].xml"} | {s["part"] for s in replaced.values()}
+            for info in package.zip.infolist():
+                name = info.filename
+                if name in written or name in removed:
+                    continue
+                if name in rewritten:
+                    zout.writestr(name, rewritten.pop(name))
+                elif name in valued:
+                    zout.writestr(name, _set_cached_values(package.zip.read(info), valued[name]))
+                else:
+                    # Partie du modele non concernee: contenu recopie tel quel
+                    with package.zip.open(info) as src, zout.open(name, "w", force_zip64=True) as dst:
+                        while True:
+                            chunk = src.read(CHUNK_SIZE)
+                            if not chunk:
+                                break
+                            dst.write(chunk)
+                written.add(name)
+            for name, data in rewritten.items():
+                zout.writestr(name, data)
+    finally:
+        package.close()
+        for source in sources:
+            source.close()
+
+    if output is None:
+        return out.getvalue()
+    return output
+
+
+def _column_index(reference):
+    """'AB12' -> 27 (index de colonne a partir de 0)"""
+    index = 0
+    for char in reference:
+        if "A" <= char <= "Z":
+            index = index * 26 + ord(char) - 64
+        else:
+            break
+    return index - 1
+
+
+def _text(fragment, prefix=b""):
+    """Texte d'un element <si> ou <is> (runs concatenes, phonetique ignoree)"""
+    fragment = re.sub(rb"<%srPh\b.*?</%srPh>" % (prefix, prefix), b"", fragment, flags=re.S)
+    parts = re.findall(rb"<%st\b[^>]*>(.*?)</%st>" % (prefix, prefix), fragment, re.S)
+    return unescape(b"".join(parts).decode("utf-8"), _ENTITIES)
+
+
+class _StreamedStrings:
+    """Chaines partagees lues en flux, seulement jusqu'au dernier index demande"""
+
+    def __init__(self, source_package):
+        self.items = []
+        self._buffer = b""
+        self._stream = None
+        part = source_package.related_part(REL_SHARED_STRINGS)
+        if part:
+            self._stream = source_package.zip.open(part)
+            self._buffer = self._stream.read(4096)
+            prefix = _prefix(self._buffer.decode("utf-8", "ignore"), "sst").encode()
+            self._prefix = prefix
+            self._item_re = re.compile(rb"<%ssi\b[^>]*?(?:/>|>.*?</%ssi>)" % (prefix, prefix), re.S)
+            self._item_end = b"</%ssi>" % prefix
+
+    def __getitem__(self, index):
+        while index >= len(self.items) and self._stream is not None:
+            chunk = self._stream.read(64 * 1024)
+            self._buffer += chunk
+            cut = self._buffer.rfind(self._item_end) + len(self._item_end) if chunk else len(self._buffer)
+            if cut >= len(self._item_end):
+                block, self._buffer = self._buffer[:cut], self._buffer[cut:]
+                self.items.extend(_text(item, self._prefix) for item in self._item_re.findall(block))
+            if not chunk:
+                self.close()
+        return self.items[index]
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+
+def shared_strings(source_package):
+    """Liste des chaines partagees d'un paquet ouvert"""
+    part = source_package.related_part(REL_SHARED_STRINGS)
+    if not part:
+        return []
+    xml = source_package.zip.read(part)
+    prefix = _prefix(xml[:4096].decode("utf-8", "ignore"), "sst").encode()
+    return [_text(item, prefix) for item in re.findall(rb"<%ssi\b[^>]*?(?:/>|>.*?</%ssi>)" % (prefix, prefix), xml, re.S)]
+
+
+def stable_hash(value):
+    """Empreinte 64 bits (signee) de repr(value), identique d'un processus a l'autre.
+
+    hash() est sale par processus (PYTHONHASHSEED): ses empreintes ne se comparent
+    pas avec celles calculees dans un autre processus (pool de la consolidation).
+    """
+    return int.from_bytes(hashlib.blake2b(repr(value).encode("utf-8"), digest_size=8).digest(), "little", signed=True)
+
+
+def style_fingerprints(source):
+    """Empreinte du contenu de chaque style de cellule (cellXfs) de la feuille, par index.
+
+    Deux enregistrements d'un meme classeur peuvent numeroter differemment leurs
+    styles: l'empreinte compare les formats, polices, remplissages et bordures
+    eux-memes plutot que leurs index.
+    """
+    package = _Package(source)
+    try:
+        part = package.related_part(REL_STYLES)
+        if not part:
+            return []
+        xml = package.read_text(part)
+    finally:
+        package.close()
+    prefix = _prefix(xml, "styleSheet")
+
+    def children(section, child):
+        found = _section(xml, section, prefix)
+        return [_reprefix(item, prefix, "") for item in _elements(found[3], child, prefix)] if found else []
+
+    formats = {attrs.get("numFmtId"): attrs.get("formatCode")
+               for attrs in (_attrs(item) for item in children("numFmts", "numFmt"))}
+    parts = {section: children(section, child) for section, child in (("fonts", "font"), ("fills", "fill"), ("borders", "border"))}
+    fingerprints = []
+    for xf in children("cellXfs", "xf"):
+        tag_end = xf.index(">") + 1
+        attrs = _attrs(xf[:tag_end])
+        key = [formats.get(attrs.get("numFmtId", "0"), attrs.get("numFmtId", "0")), xf[tag_end:]]
+        for attr, section in (("fontId", "fonts"), ("fillId", "fills"), ("borderId", "borders")):
+            index = int(attrs.pop(attr, 0))
+            key.append(parts[section][index] if index < len(parts[section]) else None)
+        attrs.pop("numFmtId", None)
+        attrs.pop("xfId", None)
+        key.append(sorted(attrs.items()))
+        fingerprints.append(stable_hash(key))
+    return fingerprints
+
+
+class Formula(str):
+    """Formule lue dans une cellule ("=..."), a distinguer d'un texte commencant par '='"""
+
+
+class SharedFormula:
+    """Cellule dependante d'une formule partagee: sa formule n'est pas ecrite dans la cellule"""
+
+    def __repr__(self):
+        return "SharedFormula"
+
+
+SHARED_FORMULA = SharedFormula()
+
+
+def _iter_sheet(source, max_rows=None, rows=None, formulas=False, with_styles=True, sheet=None):
+    """Lecteur commun: (numero de ligne, valeurs, index de style des cellules) de la feuille active,
+    ou de la feuille nommee sheet.
+
+    rows: ensemble de numeros de ligne a lire (les autres lignes sont sautees sans lire leurs cellules)
+    formulas: les cellules a formule donnent "=formule" au lieu de leur derniere valeur
+    with_styles: sinon les index de style ne sont pas lus (tuple vide)
+    """
+    package = _Package(source)
+    strings = None
+    try:
+        # Lecture partielle: les chaines partagees ne sont lues que jusqu'au dernier index utilise
+        strings = _StreamedStrings(package) if max_rows is not None else shared_strings(package)
+        active = package.active_sheet() if sheet is None else package.sheet_named(sheet)
+        with package.zip.open(active["part"]) as stream:
+            head = stream.read(4096)
+            p = _prefix(head.decode("utf-8", "ignore"), "worksheet").encode()
+            row_re = re.compile(rb"<%srow\b([^>]*?)(?:/>|>(.*?)</%srow>)" % (p, p), re.S)
+            row_number_re = re.compile(rb'\br="(\d+)"')
+            cell_re = re.compile(rb"<%sc\b([^>]*?)(?:/>|>(.*?)</%sc>)" % (p, p), re.S)
+            ref_re = re.compile(rb'\br="([A-Z]+)')
+            type_re = re.compile(rb'\bt="(\w+)"')
+            style_re = re.compile(rb'\ss="(\d+)"')
+            value_re = re.compile(rb"<%sv>(.*?)</%sv>" % (p, p), re.S)
+            formula_re = re.compile(rb"<%sf\b[^>]*?(?:/>|>(.*?)</%sf>)" % (p, p), re.S)
+            row_end = b"</%srow>" % p
+            columns = {}
+            count = 0
+            number = 0
+            buffer = head
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                buffer += chunk
+                cut = buffer.rfind(row_end) + len(row_end) if chunk else len(buffer)
+                if cut < len(row_end):
+                    continue
+                block, buffer = buffer[:cut], buffer[cut:]
+                for row in row_re.finditer(block):
+                    found = row_number_re.search(row.group(1))
+                    number = int(found.group(1)) if found else number + 1
+                    if rows is not None and number not in rows:
+                        continue
+                    values = []
+                    styles = []
+                    for cell in cell_re.finditer(row.group(2) or b""):
+                        attrs, body = cell.group(1), cell.group(2)
+                        ref = ref_re.search(attrs)
+                        if ref:
+                            letters = ref.group(1)
+                            column = columns.get(letters)
+                            if column is None:
+                                column = columns[letters] = _column_index(letters.decode())
+                            if column > len(values):
+                                values.extend([None] * (column - len(values)))
+                                if with_styles:
+                                    styles.extend([0] * (column - len(styles)))
+                        if with_styles:
+                            style = style_re.search(attrs)
+                            styles.append(int(style.group(1)) if style else 0)
+                        value = None
+                        if body:
+                            formula = formula_re.search(body) if formulas else None
+                            if formula:
+                                text = formula.group(1)
+                                value = Formula("=" + unescape(text.decode("utf-8"), _ENTITIES)) if text else SHARED_FORMULA
+                                values.append(value)
+                                continue
+                            kind = type_re.search(attrs)
+                            kind = kind.group(1) if kind else b"n"
+                            if kind == b"inlineStr":
+                                value = _text(body, p)
+                            else:
+                                found = value_re.search(body)
+                                if found:
+                                    raw = found.group(1)
+                                    if kind == b"n":
+                                        value = float(raw)
+                                        if value.is_integer() and b"." not in raw and b"E" not in raw.upper():
+                                            value = int(value)
+                                    elif kind == b"s":
+                                        try:
+                                            value = strings[int(raw)]
+                                        except IndexError:
+                                            value = None
+                                    elif kind == b"b":
+                                        value = raw == b"1"
+                                    else:
+                                        value = unescape(raw.decode("utf-8"), _ENTITIES)
+                        values.append(value)
+                    yield number, tuple(values), tuple(styles)
+                    count += 1
+                    if max_rows is not None and count >= max_rows:
+                        return
+                if not chunk:
+                    return
+    finally:
+        if isinstance(strings, _StreamedStrings):
+            strings.close()
+        package.close()
+
+
+def iter_sheet_values(source, max_rows=None):
+    """Parcourt en flux les valeurs de la feuille active, sans openpyxl.
+
+    Chaque ligne est un tuple de valeurs (chaine, nombre, booleen ou None); les
+    lignes absentes du fichier ne sont pas produites. Les dates restent des numeros
+    de serie Excel et les formules donnent leur derniere valeur calculee.
+    """
+    for _, values, _ in _iter_sheet(source, max_rows, with_styles=False):
+        yield values
+
+
+def iter_sheet_cells(source, rows=None, max_rows=None, formulas=True, sheet=None, with_styles=True):
+    """Lignes (numero, valeurs, index de style) de la feuille active (ou de la feuille nommee sheet).
+
+    Avec formulas, les formules sont donnees sous la forme Formula("=formule") et une cellule
+    dependante d'une formule partagee vaut SHARED_FORMULA; sinon elles donnent leur
+    derniere valeur calculee. rows limite la lecture a certaines lignes.
+    """
+    return _iter_sheet(source, max_rows, rows=rows, formulas=formulas, with_styles=with_styles, sheet=sheet)
@@ -0,0 +1,91 @@
+"""Controles rapides d'une balance importee, avant toute lecture complete.
+
+Seuls le repertoire central du zip, workbook.xml, le debut de chaque feuille
+(<dimension>) et les premieres lignes de la feuille active sont lus: un fichier
+endommage, un classeur de plusieurs feuilles, une plage ou une taille
+decompressee demesuree, ou une feuille sans en-tete de balance est refuse en
+quelques millisecondes, sans passer par openpyxl ni lire toutes les lignes.
+
+Le resultat d'un fichier accepte (empreinte, en-tete detecte) est reutilise par
+la lecture de la balance.
+"""
+import zipfile
+import zlib
+
+from openpyxl.utils.cell import range_boundaries
+
+import ooxml
+import settings
+from balance import DEFAULT_LAYOUT, HEADER_SEARCH_ROWS, _to_account, detect_layout
+
+ZIP_SIGNATURE = b"PK\x03\x04"
+
+
+class PreflightError(ValueError):
+    """Fichier refuse par les controles rapides"""
+
+
+class Preflight:
+    """Resultat des controles d'un fichier accepte"""
+
+    def __init__(self, digest, sheets, active, uncompressed, head, detected):
+        self.digest = digest
+        self.sheets = sheets
+        self.active = active
+        self.uncompressed = uncompressed
+        self.head = head
+        # (index de la premiere ligne de donnees, colonnes), comme detect_layout
+        self.detected = detected
+
+    @property
+    def dimension(self):
+        return next((sheet["dimension"] for sheet in self.sheets if sheet["name"] == self.active), None)
+
+
+def _dimension_size(reference):
+    """(lignes, colonnes) d'une plage "A1:H2000", ou None si elle est illisible"""
+    try:
+        min_col, min_row, max_col, max_row = range_boundaries(reference.upper())
+    except (ValueError, TypeError):
+        return None
+    if None in (min_col, min_row, max_col, max_row):
+        return None
+    return max_row - min_row + 1, max_col - min_col + 1
+
+
+def check_balance(data, digest):
+    """Controle le contenu d'un fichier de balance (empreinte digest); retourne un Preflight ou leve PreflightError"""
+    if not data.startswith(ZIP_SIGNATURE):
+        raise PreflightError("Le fichier n'est pas un classeur Excel (.xlsx)")
+    try:
+        summary = ooxml.read_package_summary(data)
+    except (zipfile.BadZipFile, zlib.error, KeyError, UnicodeDecodeError, ooxml.OOXMLError) as e:
+        raise PreflightError("Classeur illisible ou endommagé: %s" % e)
+
+    if summary["uncompressed"] > settings.UPLOAD_MAX_UNCOMPRESSED_BYTES:
+        raise PreflightError("Classeur trop volumineux une fois décompressé: %d Mo (maximum %d Mo)"
+                             % (summary["uncompressed"] // 2 ** 20, settings.UPLOAD_MAX_UNCOMPRESSED_BYTES // 2 ** 20))
+    sheets = summary["sheets"]
+    if len(sheets) > settings.UPLOAD_MAX_SHEETS:
+        raise PreflightError("Le classeur contient %d feuilles (%s): la balance doit être seule dans son fichier"
+                             % (len(sheets), ", ".join(sheet["name"] for sheet in sheets[:5])))
+    active = summary["active"]
+    reference = next((sheet["dimension"] for sheet in sheets if sheet["name"] == active), None)
+    # Sans <dimension> (certains exports), la plage n'est pas controlee
+    size = _dimension_size(reference) if reference else None
+    if size is not None and (size[0] > settings.UPLOAD_MAX_ROWS or size[1] > settings.UPLOAD_MAX_COLUMNS):
+        raise PreflightError("Plage utilisée démesurée pour une balance: %s (maximum %d lignes et %d colonnes)"
+                             % (reference, settings.UPLOAD_MAX_ROWS, settings.UPLOAD_MAX_COLUMNS))
+
+    try:
+        head = list(ooxml.iter_sheet_values(data, max_rows=HEADER_SEARCH_ROWS))
+    except (zipfile.BadZipFile, zlib.error, KeyError, ValueError, ooxml.OOXMLError) as e:
+        raise PreflightError("Feuille illisible: %s" % e)
+    detected = detect_layout(head)
+    if detected is None:
+        # Sans en-tete, les colonnes par defaut (compte en A) doivent contenir des numeros de compte
+        if not any(row and _to_account(row[0]) for row in head):
+            raise PreflightError("Aucun en-tête de balance (Compte, Débit, Crédit...) ni numéro de compte en colonne A "
+                                 "dans les %d premières lignes de la feuille %s" % (HEADER_SEARCH_ROWS, active))
+        detected = (0, DEFAULT_LAYOUT)
+    return Preflight(digest, sheets, active, summary["uncompressed"], head, detected)
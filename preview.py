@@ -0,0 +1,144 @@
+"""Apercu pagine des feuilles du classeur integre.
+
+Une feuille du fichier exporte est lue une seule fois (en flux, sans openpyxl)
+et rangee en colonnes typees: un tableau de nombres et un tableau d'index de
+textes par colonne. Afficher une page ne convertit que les lignes de la page:
+parcourir une balance de 200 000 lignes ne reconstruit jamais la feuille
+entiere et n'envoie au navigateur que settings.PREVIEW_PAGE_ROWS lignes.
+
+Les feuilles lues sont gardees pour tout le serveur, cle = fichier exporte
+(cle d'export_cache ou empreinte du contenu) et nom de feuille.
+"""
+import math
+import threading
+from array import array
+
+import numpy as np
+from openpyxl.utils.cell import get_column_letter
+
+import ooxml
+import settings
+from cache import LRUCache
+
+_NAN = float("nan")
+
+
+def _number_text(value):
+    return str(int(value)) if value.is_integer() else str(value)
+
+
+class SheetPreview:
+    """Valeurs d'une feuille en colonnes typees, lues par fenetres de lignes"""
+
+    def __init__(self, name, rows, numbers, texts, strings):
+        self.name = name
+        # Numero (Excel) de chaque ligne presente dans la feuille
+        self.rows = rows
+        # Par colonne: valeur numerique (NaN sinon) et index dans strings (-1 sinon)
+        self.numbers = numbers
+        self.texts = texts
+        self.strings = strings
+        self.used = [column for column in range(len(numbers))
+                     if (texts[column] >= 0).any() or not np.isnan(numbers[column]).all()]
+
+    @classmethod
+    def from_xlsx(cls, source, name):
+        rows = array("i")
+        numbers, texts = [], []
+        strings, ids = [], {}
+        count = 0
+        for number, values, _ in ooxml.iter_sheet_cells(source, formulas=False, sheet=name, with_styles=False):
+            while len(numbers) < len(values):
+                numbers.append(array("d", [_NAN]) * count)
+                texts.append(array("i", [-1]) * count)
+            rows.append(number)
+            for column, value in enumerate(values):
+                if value is None:
+                    numbers[column].append(_NAN)
+                    texts[column].append(-1)
+                elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                    numbers[column].append(value)
+                    texts[column].append(-1)
+                else:
+                    if isinstance(value, bool):
+                        value = "VRAI" if value else "FAUX"
+                    index = ids.get(value)
+                    if index is None:
+                        index = ids[value] = len(strings)
+                        strings.append(value)
+                    numbers[column].append(_NAN)
+                    texts[column].append(index)
+            for column in range(len(values), len(numbers)):
+                numbers[column].append(_NAN)
+                texts[column].append(-1)
+            count += 1
+        return cls(name, np.frombuffer(rows, dtype=np.int32),
+                   [np.frombuffer(column, dtype=np.float64) for column in numbers],
+                   [np.frombuffer(column, dtype=np.int32) for column in texts], strings)
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def nbytes(self):
+        return (self.rows.nbytes + sum(column.nbytes for column in self.numbers) + sum(column.nbytes for column in self.texts)
+                + sum(len(text) for text in self.strings))
+
+    def pages(self, page_rows):
+        return max(1, math.ceil(len(self) / page_rows))
+
+    def page_of(self, row_number, page_rows):
+        """Page (a partir de 1) contenant la ligne Excel row_number, ou la ligne suivante"""
+        position = int(np.searchsorted(self.rows, row_number))
+        return min(position // page_rows, self.pages(page_rows) - 1) + 1
+
+    def window(self, start, stop):
+        """Table (dict de colonnes) des lignes presentes start a stop-1 (positions, pas numeros Excel)"""
+        start, stop = max(start, 0), min(stop, len(self))
+        table = {"Ligne": self.rows[start:stop].tolist()}
+        for column in self.used:
+            numbers = self.numbers[column][start:stop].tolist()
+            texts = self.texts[column][start:stop].tolist()
+            # Colonne mixte dans la fenetre: nombres affiches en texte (une colonne, un type)
+            mixed = any(t >= 0 for t in texts)
+            values = []
+            for number, text in zip(numbers, texts):
+                if text >= 0:
+                    values.append(self.strings[text])
+                elif number != number:
+                    values.append(None)
+                else:
+                    values.append(_number_text(number) if mixed else number)
+            table[get_column_letter(column + 1)] = values
+        return table
+
+    def page(self, number, page_rows):
+        """Table de la page number (a partir de 1)"""
+        return self.window((number - 1) * page_rows, number * page_rows)
+
+
+# Feuilles deja lues, partagees par les sessions qui consultent le meme fichier
+_previews = LRUCache(max_bytes=settings.PREVIEW_CACHE_MAX_BYTES)
+# Un verrou par feuille en cours de lecture: une grande feuille ne bloque pas les apercus des autres sessions
+_reading = {}
+_reading_lock = threading.Lock()
+
+
+def sheet_preview(data, key, name):
+    """SheetPreview de la feuille name du fichier data (cle key), lu une seule fois pour tout le serveur"""
+    cache_key = (key, name)
+    preview = _previews.get(cache_key)
+    if preview is None:
+        with _reading_lock:
+            lock = _reading.setdefault(cache_key, threading.Lock())
+        try:
+            with lock:
+                preview = _previews.peek(cache_key)
+                if preview is None:
+                    preview = SheetPreview.from_xlsx(data, name)
+                    _previews.put(cache_key, preview, preview.nbytes)
+        finally:
+            with _reading_lock:
+                if _reading.get(cache_key) is lock:
+                    del _reading[cache_key]
+    return preview
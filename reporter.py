@@ -0,0 +1,27 @@
+"""Messages des traitements sans interface Streamlit (taches de fond, lot, benchmarks)."""
+
+
+class Reporter:
+    """Remplace l'objet st de Streamlit: les messages sont collectes au lieu d'etre affiches"""
+
+    def __init__(self):
+        self.messages = []
+
+    def _add(self, level, message):
+        self.messages.append({"niveau": level, "message": str(message)})
+
+    def error(self, message, *args, **kwargs):
+        self._add("erreur", message)
+
+    def warning(self, message, *args, **kwargs):
+        self._add("avertissement", message)
+
+    def info(self, message, *args, **kwargs):
+        self._add("info", message)
+
+    def success(self, message, *args, **kwargs):
+        self._add("info", message)
+
+    @property
+    def errors(self):
+        return [m["message"] for m in self.messages if m["niveau"] == "erreur"]
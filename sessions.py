@@ -0,0 +1,195 @@
+"""Memoire des sessions Streamlit.
+
+Chaque session (un Config dans st.session_state) est enregistree aupres du
+gestionnaire a chaque rerun. Les donnees propres a une session (classeur
+integre, fichier exporte, contenu des balances importees) d'une session
+inactive sont deplacees dans un fichier compresse sur disque:
+
+- sans condition apres settings.SESSION_IDLE_SECONDS d'inactivite;
+- des que le total des sessions depasse settings.SESSION_MEMORY_BUDGET, en
+  commencant par la session utilisee le moins recemment (LRU), parmi celles
+  inactives depuis settings.SESSION_MIN_IDLE_SECONDS.
+
+Ces deplacements (pickle + gzip) se font dans un thread de fond lance par
+touch(): un rerun ne paie pas la compression des autres sessions.
+
+Le prochain rerun de la session relit ces donnees. Une session dont le
+script est en cours d'execution (de touch() a release(), ou tant que le thread
+du rerun est vivant) ou dont l'integration tourne en tache de fond n'est
+jamais deplacee.
+"""
+import gzip
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
+import weakref
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class _Session:
+    def __init__(self):
+        self.last_used = time.monotonic()
+        self.size = 0
+        # Fichier des donnees deplacees sur disque, et son nettoyage a la fin de la session
+        self.path = None
+        self.finalizer = None
+        self.lock = threading.Lock()
+        # Thread qui execute le script de la session, None entre deux reruns
+        self.runner = None
+
+    @property
+    def running(self):
+        # Un rerun interrompu (exception, st.rerun) n'appelle pas release(): son thread se termine
+        runner = self.runner
+        return runner is not None and runner.is_alive()
+
+
+class SessionManager:
+    """Suivi de la memoire des sessions, deplacement sur disque et relecture"""
+
+    def __init__(self, max_bytes=None, directory=None, idle_seconds=None, min_idle_seconds=None):
+        self.max_bytes = settings.SESSION_MEMORY_BUDGET if max_bytes is None else max_bytes
+        self.directory = settings.SESSION_SPILL_DIR if directory is None else directory
+        self.idle_seconds = settings.SESSION_IDLE_SECONDS if idle_seconds is None else idle_seconds
+        self.min_idle_seconds = settings.SESSION_MIN_IDLE_SECONDS if min_idle_seconds is None else min_idle_seconds
+        # Une entree par Config; elle disparait avec la session
+        self._sessions = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        # Thread qui execute enforce() (None au repos) et demande d'un nouveau passage
+        self._enforcer = None
+        self._enforce_pending = False
+        self.spills = 0
+        self.rehydrations = 0
+
+    def touch(self, config):
+        """A appeler au debut de chaque rerun: relit les donnees de la session si besoin"""
+        with self._lock:
+            session = self._sessions.get(config)
+            if session is None:
+                session = self._sessions[config] = _Session()
+            session.last_used = time.monotonic()
+            session.runner = threading.current_thread()
+        with session.lock:
+            if session.path is not None:
+                self._rehydrate(config, session)
+            session.size = config.memory_size()
+        self._schedule_enforce()
+
+    def release(self, config):
+        """A appeler a la fin de chaque rerun: la session peut de nouveau etre deplacee"""
+        with self._lock:
+            session = self._sessions.get(config)
+            if session is not None and session.runner is threading.current_thread():
+                session.runner = None
+
+    def _schedule_enforce(self):
+        """Lance enforce() en tache de fond; un seul thread, relance si une demande arrive pendant son passage"""
+        with self._lock:
+            self._enforce_pending = True
+            if self._enforcer is not None:
+                return
+            self._enforcer = threading.Thread(target=self._enforce_loop, name="sessions", daemon=True)
+            self._enforcer.start()
+
+    def _enforce_loop(self):
+        while True:
+            with self._lock:
+                if not self._enforce_pending:
+                    self._enforcer = None
+                    return
+                self._enforce_pending = False
+            try:
+                self.enforce()
+            except Exception as e:
+                logger.warning("Deplacement des sessions sur disque interrompu: %s", e)
+
+    def enforce(self, current=None):
+        """Deplace sur disque les sessions inactives, puis les moins recentes au-dela du budget.
+
+        current: session en cours de rerun, jamais deplacee.
+        """
+        now = time.monotonic()
+        with self._lock:
+            sessions = list(self._sessions.items())
+        in_memory = [(config, session) for config, session in sessions if session.path is None]
+        total = sum(session.size for _, session in in_memory)
+        candidates = sorted(
+            ((config, session) for config, session in in_memory
+             if config is not current and now - session.last_used >= self.min_idle_seconds
+             and not session.running and not config.is_busy()),
+            key=lambda item: item[1].last_used,
+        )
+        for config, session in candidates:
+            idle = now - session.last_used >= self.idle_seconds
+            if not idle and total <= self.max_bytes:
+                break
+            size = session.size
+            if self._spill(config, session):
+                total -= size
+
+    def _spill(self, config, session):
+        # Session en cours de rerun: on ne l'attend pas
+        if not session.lock.acquire(blocking=False):
+            return False
+        try:
+            if session.path is not None or session.running or config.is_busy():
+                return False
+            state = config.spill_state()
+            if state is None:
+                return False
+            path = None
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                fd, path = tempfile.mkstemp(prefix="session-", suffix=".pkl.gz", dir=self.directory)
+                with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=1) as f:
+                    pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            except (OSError, pickle.PicklingError) as e:
+                logger.warning("Session non deplacee sur disque (%s): %s", self.directory, e)
+                if path is not None:
+                    _remove(path)
+                return False
+            config.release_spilled()
+            session.path = path
+            session.finalizer = weakref.finalize(config, _remove, path)
+            session.size = 0
+            self.spills += 1
+            return True
+        finally:
+            session.lock.release()
+
+    def _rehydrate(self, config, session):
+        with gzip.open(session.path, "rb") as f:
+            config.restore_spilled(pickle.load(f))
+        session.finalizer()
+        session.path = session.finalizer = None
+        self.rehydrations += 1
+
+    def stats(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+        return {
+            "sessions": len(sessions),
+            "in_memory": sum(1 for s in sessions if s.path is None),
+            "on_disk": sum(1 for s in sessions if s.path is not None),
+            "memory": sum(s.size for s in sessions if s.path is None),
+            "memory_budget": self.max_bytes,
+            "spills": self.spills,
+            "rehydrations": self.rehydrations,
+        }
+
+
+# Gestionnaire partage par toutes les sessions du serveur
+manager = SessionManager()
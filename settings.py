@@ -0,0 +1,107 @@
+import os
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+# Nombre maximum de modeles parses gardes en memoire pour tout le serveur
+TEMPLATE_CACHE_SIZE = _env_int("COMPTALANCE_TEMPLATE_CACHE_SIZE", 4)
+
+# Budget memoire (en octets) des balances parsees partagees entre les sessions
+BALANCE_CACHE_MAX_BYTES = _env_int("COMPTALANCE_BALANCE_CACHE_MAX_BYTES", 512 * 1024 * 1024)
+
+# Estimation de l'empreinte memoire d'une cellule openpyxl (objet Cell + valeur + style)
+CELL_SIZE_ESTIMATE = _env_int("COMPTALANCE_CELL_SIZE_ESTIMATE", 400)
+
+# Nombre d'empreintes de balances deja validees gardees en memoire (mode flux)
+VALIDATED_BALANCES_SIZE = _env_int("COMPTALANCE_VALIDATED_BALANCES_SIZE", 1024)
+
+# Limites des balances importees, controlees avant toute lecture complete (preflight.py):
+# nombre de feuilles, plage utilisee (<dimension>) et taille totale une fois decompresse
+UPLOAD_MAX_SHEETS = _env_int("COMPTALANCE_UPLOAD_MAX_SHEETS", 1)
+UPLOAD_MAX_ROWS = _env_int("COMPTALANCE_UPLOAD_MAX_ROWS", 1_000_000)
+UPLOAD_MAX_COLUMNS = _env_int("COMPTALANCE_UPLOAD_MAX_COLUMNS", 256)
+UPLOAD_MAX_UNCOMPRESSED_BYTES = _env_int("COMPTALANCE_UPLOAD_MAX_UNCOMPRESSED_BYTES", 512 * 1024 * 1024)
+
+# Journal JSON-lines des mesures de performance (chaine vide: desactive)
+PERF_LOG_PATH = os.environ.get("COMPTALANCE_PERF_LOG", os.path.join("logs", "performance.jsonl"))
+
+# Nombre de mesures gardees en memoire par session pour le panneau Performance
+PERF_HISTORY_SIZE = _env_int("COMPTALANCE_PERF_HISTORY_SIZE", 200)
+
+# Nombre d'integrations executees en meme temps pour tout le serveur (les suivantes attendent en file)
+JOB_WORKERS = _env_int("COMPTALANCE_JOB_WORKERS", 2)
+
+# Budget memoire (en octets) des integrations executees en meme temps
+JOB_MEMORY_BUDGET = _env_int("COMPTALANCE_JOB_MEMORY_BUDGET", 2 * 1024 * 1024 * 1024)
+
+# Rapport entre la memoire d'un classeur openpyxl et la taille de son fichier xlsx
+XLSX_MEMORY_FACTOR = _env_int("COMPTALANCE_XLSX_MEMORY_FACTOR", 200)
+
+# Au-dela de ce pourcentage de lignes modifiees, une balance reimportee est recopiee entierement
+DELTA_MAX_CHANGED_PERCENT = _env_int("COMPTALANCE_DELTA_MAX_CHANGED_PERCENT", 20)
+
+# Budget memoire (en octets) des fichiers exportes gardes pour tout le serveur
+EXPORT_CACHE_MAX_BYTES = _env_int("COMPTALANCE_EXPORT_CACHE_MAX_BYTES", 256 * 1024 * 1024)
+
+# Dossier des fichiers exportes conserves entre deux demarrages (chaine vide: desactive)
+EXPORT_CACHE_DIR = os.environ.get("COMPTALANCE_EXPORT_CACHE_DIR", os.path.join("cache", "exports"))
+
+# Taille maximale (en octets) du dossier des fichiers exportes
+EXPORT_CACHE_DISK_MAX_BYTES = _env_int("COMPTALANCE_EXPORT_CACHE_DISK_MAX_BYTES", 2 * 1024 * 1024 * 1024)
+
+# Au-dela de cette taille, un fichier en cours d'enregistrement est ecrit sur disque plutot qu'en memoire
+EXPORT_SPOOL_MAX_BYTES = _env_int("COMPTALANCE_EXPORT_SPOOL_MAX_BYTES", 8 * 1024 * 1024)
+
+# Miniatures des images des modeles: largeurs produites (pixels) et dossier sur disque
+THUMBNAIL_WIDTHS = (480, 960)
+THUMBNAIL_DIR = os.environ.get("COMPTALANCE_THUMBNAIL_DIR", os.path.join("cache", "thumbnails"))
+
+# Largeur de miniature affichee dans l'apercu d'un modele
+THUMBNAIL_DISPLAY_WIDTH = _env_int("COMPTALANCE_THUMBNAIL_DISPLAY_WIDTH", 960)
+
+# Qualite WebP des miniatures (0-100)
+THUMBNAIL_QUALITY = _env_int("COMPTALANCE_THUMBNAIL_QUALITY", 80)
+
+# Budget memoire (en octets) des miniatures gardees pour tout le serveur
+THUMBNAIL_CACHE_MAX_BYTES = _env_int("COMPTALANCE_THUMBNAIL_CACHE_MAX_BYTES", 32 * 1024 * 1024)
+
+# Catalogue des modeles et intervalle minimal (secondes) entre deux verifications de ses fichiers
+CATALOG_PATH = os.environ.get("COMPTALANCE_CATALOG", "models.json")
+CATALOG_CHECK_INTERVAL = _env_int("COMPTALANCE_CATALOG_CHECK_INTERVAL", 2)
+
+# Budget memoire (en octets) des donnees propres aux sessions (classeur integre, export, balances importees)
+SESSION_MEMORY_BUDGET = _env_int("COMPTALANCE_SESSION_MEMORY_BUDGET", 1024 * 1024 * 1024)
+
+# Inactivite (secondes) apres laquelle les donnees d'une session sont deplacees sur disque
+SESSION_IDLE_SECONDS = _env_int("COMPTALANCE_SESSION_IDLE_SECONDS", 900)
+
+# Inactivite minimale (secondes) d'une session deplacee pour respecter le budget
+SESSION_MIN_IDLE_SECONDS = _env_int("COMPTALANCE_SESSION_MIN_IDLE_SECONDS", 60)
+
+# Dossier des donnees de sessions deplacees sur disque
+SESSION_SPILL_DIR = os.environ.get("COMPTALANCE_SESSION_SPILL_DIR", os.path.join("cache", "sessions"))
+
+# Taille (en octets) des blocs lus dans un FEC importe
+FEC_CHUNK_BYTES = _env_int("COMPTALANCE_FEC_CHUNK_BYTES", 4 * 1024 * 1024)
+
+# Mois de cloture des exercices (12: exercice civil), pour repartir les ecritures d'un FEC entre N et N-1
+FEC_FISCAL_YEAR_END_MONTH = _env_int("COMPTALANCE_FEC_FISCAL_YEAR_END_MONTH", 12)
+
+# Calcul des formules du modele apres l'integration (valeurs ecrites dans le fichier exporte), 0: desactive
+FORMULA_EVALUATION = _env_int("COMPTALANCE_FORMULA_EVALUATION", 1)
+
+# Apercu des feuilles du fichier exporte: lignes par page et budget memoire (octets) des feuilles lues
+PREVIEW_PAGE_ROWS = _env_int("COMPTALANCE_PREVIEW_PAGE_ROWS", 100)
+PREVIEW_CACHE_MAX_BYTES = _env_int("COMPTALANCE_PREVIEW_CACHE_MAX_BYTES", 128 * 1024 * 1024)
+
+# Processus qui lisent en parallele les balances des entites d'une consolidation (1: lecture dans le serveur)
+CONSOLIDATION_WORKERS = _env_int("COMPTALANCE_CONSOLIDATION_WORKERS", os.cpu_count() or 1)
+
+# Prechauffage des modeles et miniatures en tache de fond au premier run du processus, pour un serveur
+# lance par "streamlit run" (1: active); "python warmup.py --serve" le fait avant le demarrage du serveur
+WARMUP = _env_int("COMPTALANCE_WARMUP", 0)
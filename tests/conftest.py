@@ -0,0 +1,33 @@
+"""Configuration commune des tests: modules de l'application importables, sans cache disque ni journal."""
+import os
+import sys
+
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.join(APP_DIR, "benchmarks")
+
+# Avant tout import de settings: pas de fichiers ecrits dans cache/ ni logs/
+os.environ.setdefault("COMPTALANCE_EXPORT_CACHE_DIR", "")
+os.environ.setdefault("COMPTALANCE_PERF_LOG", "")
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+
+@pytest.fixture(scope="session")
+def model_path():
+    """Chemin du modele de reference"""
+    return os.path.join(APP_DIR, "models_excel", "model_1.xlsx")
+
+
+@pytest.fixture(scope="session")
+def balances(tmp_path_factory):
+    """Chemins de deux balances synthetiques (N, N-1) de 200 comptes, styles et fusions compris"""
+    import synthetic
+
+    directory = tmp_path_factory.mktemp("balances")
+    paths = []
+    for seed in (0, 1):
+        paths.append(str(directory / ("balance_%d.xlsx" % seed)))
+        synthetic.generate_balance(paths[-1], 200, seed)
+    return paths
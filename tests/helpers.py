@@ -0,0 +1,32 @@
+"""Comparaison de feuilles openpyxl dans les tests."""
+
+STYLE_ATTRIBUTES = ("font", "fill", "border", "number_format", "alignment", "protection")
+
+
+def _cells(ws):
+    """Cellules de la feuille, bornes explicites: les feuilles integrees sont remplies sans ws.cell()"""
+    return (cell for row in ws.iter_rows(min_row=1, max_row=ws.max_row, max_col=ws.max_column) for cell in row)
+
+
+def cell_values(ws):
+    """Coordonnee -> valeur des cellules non vides"""
+    return {cell.coordinate: cell.value for cell in _cells(ws) if cell.value is not None}
+
+
+def cell_styles(ws):
+    """Coordonnee -> attributs de style resolus; chaque combinaison de styles n'est resolue qu'une fois"""
+    resolved = {}
+    styles = {}
+    for cell in _cells(ws):
+        key = tuple(cell._style) if cell.has_style else None
+        style = resolved.get(key)
+        if style is None:
+            style = resolved[key] = tuple(repr(getattr(cell, attribute)) for attribute in STYLE_ATTRIBUTES)
+        styles[cell.coordinate] = style
+    return styles
+
+
+def style_differences(expected, actual):
+    """Coordonnees dont le style differe entre deux feuilles"""
+    expected_styles, actual_styles = cell_styles(expected), cell_styles(actual)
+    return [coordinate for coordinate, style in expected_styles.items() if actual_styles.get(coordinate) != style]
@@ -0,0 +1,27 @@
+import os
+import shutil
+
+from cache import TemplateCache, file_sha256
+
+
+def test_template_cache_keeps_one_entry_per_file_version(tmp_path, model_path):
+    cache = TemplateCache(max_entries=2)
+    paths = []
+    for name in ("a.xlsx", "b.xlsx", "c.xlsx"):
+        paths.append(str(tmp_path / name))
+        shutil.copyfile(model_path, paths[-1])
+
+    first = cache.get(paths[0])
+    assert cache.get(paths[0]) is first
+    assert first.sha256 == file_sha256(model_path)
+
+    # Fichier modifie: nouvelle entree, nouvelle empreinte
+    with open(paths[0], "ab") as f:
+        f.write(b"\0")
+    os.utime(paths[0], ns=(first.mtime_ns + 10 ** 9, first.mtime_ns + 10 ** 9))
+    changed = cache.get(paths[0])
+    assert changed is not first and changed.sha256 != first.sha256
+
+    for path in paths[1:]:
+        cache.get(path)
+    assert len(cache._entries) == 2
@@ -0,0 +1,76 @@
+import io
+
+import pytest
+from openpyxl import Workbook, load_workbook
+
+import calculation
+from balance import HEADERS, PREFIX_COLUMNS
+from cache import template_cache
+
+pytestmark = pytest.mark.filterwarnings("ignore:Print area cannot be set")
+
+LOOKUP_FUNCTIONS = ("SUMIF(", "VLOOKUP(")
+
+
+def _balance(rows=()):
+    """Contenu xlsx d'une balance avec ses colonnes de prefixes (compte, intitule, 6 montants)"""
+    wb = Workbook()
+    ws = wb.active
+    ws.append(HEADERS)
+    for row in rows:
+        ws.append(row)
+        for column, length in PREFIX_COLUMNS:
+            ws.cell(ws.max_row, column).value = row[0][:length]
+    output = io.BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+
+def _evaluate(model_path, balance_n, balance_n1):
+    evaluation = calculation.Evaluation(calculation.graph_for(template_cache.get(model_path)))
+    evaluation.update({"BAL N": ("n", lambda: balance_n), "BAL N-1": ("n-1", lambda: balance_n1)})
+    return evaluation
+
+
+def test_sumif_and_vlookup_match_the_values_cached_in_the_template(model_path):
+    # Les balances du modele sont vides: les valeurs en cache sont celles de balances vides
+    empty = _balance()
+    evaluation = _evaluate(model_path, empty, empty)
+    formulas = load_workbook(model_path)
+    cached = load_workbook(model_path, data_only=True)
+
+    lookups = [
+        (ws.title, cell.row, cell.column) for ws in formulas.worksheets for cell in ws._cells.values()
+        if cell.data_type == "f" and isinstance(cell.value, str) and any(name in cell.value.upper() for name in LOOKUP_FUNCTIONS)
+    ]
+    assert len(lookups) > 800
+    for sheet, row, column in lookups:
+        value = evaluation.results[(sheet, row, column)]
+        assert value is not calculation.UNSUPPORTED, (sheet, row, column)
+        assert value == cached[sheet].cell(row, column).value, (sheet, row, column)
+    assert evaluation.results[("BILAN PAYSAGE", 14, 12)] == -87524556
+
+
+def test_sumif_and_vlookup_read_the_integrated_balances(model_path):
+    balance_n = _balance([
+        ("130000", "Resultat", 100.0, 2500.0, 0.0, 0.0, 0.0, 0.0),
+        ("131000", "Subventions", 40.0, 60.0, 0.0, 0.0, 0.0, 0.0),
+        ("702200", "Ventes", 0.0, 0.0, 0.0, 750.0, 0.0, 750.0),
+    ])
+    evaluation = _evaluate(model_path, balance_n, _balance())
+
+    # SOMME.SI sur les comptes de prefixe 13 (colonne J), credit moins debit d'ouverture
+    assert evaluation.results[("BILAN PAYSAGE", 14, 12)] == (2500 + 60) - (100 + 40) - 87524556
+    # RECHERCHEV du compte 702200, 8e colonne (solde credit de cloture)
+    assert evaluation.results[("Activités de l'entreprise R2", 33, 12)] == 750
+
+
+def test_update_recalculates_only_the_formulas_of_changed_sheets(model_path):
+    empty = _balance()
+    evaluation = _evaluate(model_path, empty, empty)
+    graph = evaluation.graph
+
+    changed = _balance([("702200", "Ventes", 0.0, 0.0, 0.0, 750.0, 0.0, 750.0)])
+    recalculated = evaluation.update({"BAL N": ("n2", lambda: changed), "BAL N-1": ("n-1", lambda: empty)})
+    assert recalculated == len(graph.dependents["BAL N"])
+    assert evaluation.update({"BAL N": ("n2", lambda: changed), "BAL N-1": ("n-1", lambda: empty)}) == 0
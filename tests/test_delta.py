@@ -0,0 +1,111 @@
+import io
+
+import pytest
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Font
+
+import delta
+from config import Config, ENGINE_OPENPYXL
+from helpers import cell_values, style_differences
+from reporter import Reporter
+
+pytestmark = pytest.mark.filterwarnings("ignore:Print area cannot be set")
+
+
+def _config(model_path, balance_n, balance_n1):
+    config = Config()
+    config.integration_engine = ENGINE_OPENPYXL
+    reporter = Reporter()
+    assert config.load_excel(reporter, model_path)
+    _load(config, balance_n, balance_n1)
+    return config
+
+
+def _load(config, balance_n, balance_n1=None):
+    reporter = Reporter()
+    assert config.load_excel(reporter, io.BytesIO(balance_n), 2), reporter.errors
+    if balance_n1 is not None:
+        assert config.load_excel(reporter, io.BytesIO(balance_n1), 3), reporter.errors
+    assert config.add_balances_to_modele(reporter), reporter.errors
+
+
+def _edited(data, edit):
+    """Contenu xlsx de data apres edit(feuille active)"""
+    wb = load_workbook(io.BytesIO(data))
+    edit(wb.active)
+    output = io.BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+
+def _simple_balance(rows):
+    """Balance sans fusion ni mise en forme conditionnelle: les lignes peuvent etre decalees"""
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["Compte", "Intitulé", "Solde débit ouverture", "Solde crédit ouverture", "Mouvement débit",
+               "Mouvement crédit", "Solde débit clôture", "Solde crédit clôture"])
+    for cell in ws[1]:
+        cell.font = Font(bold=True)
+    for account, amount in rows:
+        ws.append([account, "Compte %s" % account, 0, 0, amount, 0, amount, 0])
+        ws.cell(ws.max_row, 5).number_format = "#,##0.00"
+    output = io.BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+
+def _patched_rows(config):
+    spans = [span for span in config.tracer.last_run() if span.name == "feuille.delta" and span.attrs.get("feuille") == "BAL N"]
+    assert spans and "repli" not in spans[-1].attrs, spans
+    return spans[-1].rows
+
+
+def _assert_same_sheet(patched, full):
+    assert cell_values(patched) == cell_values(full)
+    assert not style_differences(full, patched)
+    assert not style_differences(patched, full)
+
+
+def test_changed_amounts_are_patched_like_a_full_integration(model_path, balances):
+    with open(balances[0], "rb") as f:
+        # Reenregistree par openpyxl comme la version modifiee: seules les lignes editees different
+        original = _edited(f.read(), lambda ws: None)
+    with open(balances[1], "rb") as f:
+        previous = f.read()
+
+    def edit(ws):
+        ws.cell(10, 5).value = 1234.5
+        ws.cell(42, 2).value = "Intitulé modifié"
+
+    changed = _edited(original, edit)
+    patched = _config(model_path, original, previous)
+    _load(patched, changed)
+    assert _patched_rows(patched) == 2
+
+    full = _config(model_path, changed, previous)
+    _assert_same_sheet(patched._modele_wb["BAL N"], full._modele_wb["BAL N"])
+
+
+def test_inserted_and_deleted_rows_are_patched_like_a_full_integration(model_path):
+    rows = [("%d" % (401000 + i), 100.0 + i) for i in range(100)]
+    original = _simple_balance(rows)
+    previous = _simple_balance(rows[:50])
+    changed = _simple_balance(rows[:20] + [("401999", 5.0)] + rows[20:70] + rows[71:])
+
+    patched = _config(model_path, original, previous)
+    _load(patched, changed)
+    # Une ligne inseree et une supprimee; les lignes suivantes sont renumerotees
+    assert _patched_rows(patched) == 2
+
+    full = _config(model_path, changed, previous)
+    _assert_same_sheet(patched._modele_wb["BAL N"], full._modele_wb["BAL N"])
+    assert delta.sheet_states(patched._modele_wb)["BAL N"].balance is patched.baln_balance
+
+
+def test_unchanged_balance_is_left_as_is(model_path):
+    data = _simple_balance([("101000", 10.0), ("512000", 20.0)])
+    config = _config(model_path, data, data)
+    sheet = config._modele_wb["BAL N"]
+    _load(config, data)
+    assert config._modele_wb["BAL N"] is sheet
+    assert any(span.name == "feuille.inchangee" for span in config.tracer.last_run())
@@ -0,0 +1,86 @@
+import calculation
+import fec
+from cache import template_cache
+
+HEADER = ("JournalCode\tJournalLib\tEcritureNum\tEcritureDate\tCompteNum\tCompteLib\tCompAuxNum\tCompAuxLib\t"
+          "PieceRef\tPieceDate\tEcritureLib\tDebit\tCredit\tEcritureLet\tDateLet\tValidDate\tMontantdevise\tIdevise")
+
+
+def _line(journal, date, account, label, debit, credit):
+    return "\t".join((journal, journal, "1", date, account, label, "", "", "P1", date, label, debit, credit, "", "", date, "", ""))
+
+
+def _fec(*lines):
+    return ("\r\n".join((HEADER,) + lines) + "\r\n").encode("cp1252")
+
+
+# Exercices 2023 (N-1) et 2024 (N), cloture en decembre
+FEC = _fec(
+    _line("AN", "20230101", "101000", "Capital", "0,00", "10000,00"),
+    _line("AN", "20230101", "512000", "Banque", "10000,00", "0,00"),
+    _line("VE", "20230315", "411000", "Clients", "1200,00", "0,00"),
+    _line("VE", "20230315", "706000", "Prestations", "0,00", "1200,00"),
+    _line("AN", "20240101", "101000", "Capital", "0,00", "10000,00"),
+    _line("AN", "20240101", "512000", "Banque", "10000,00", "0,00"),
+    _line("AC", "20240210", "601000", "Achats", "500,50", "0,00"),
+    _line("AC", "20240210", "512000", "Banque", "0,00", "500,50"),
+    _line("VE", "20240520", "411000", "Clients", "6 200,00", "0,00"),
+    _line("VE", "20240520", "706000", "Prestations", "0,00", "6 200,00"),
+)
+
+
+def _row(balance, account):
+    return next(row for row in balance.iter_rows() if row[0] == account)
+
+
+def test_read_fec_splits_years_and_totals_accounts():
+    result = fec.read_fec(FEC)
+    assert result.years == [2024, 2023]
+    assert (result.lines, result.skipped) == (10, 0)
+
+    n = result.balances[2024]
+    assert [n.account(i) for i in range(len(n))] == ["101000", "411000", "512000", "601000", "706000"]
+    # Compte, intitule, ouverture D/C, mouvements D/C, cloture D/C
+    assert _row(n, "101000") == ("101000", "Capital", 0.0, 10000.0, 0.0, 0.0, 0.0, 10000.0)
+    assert _row(n, "512000") == ("512000", "Banque", 10000.0, 0.0, 0.0, 500.5, 9499.5, 0.0)
+    assert _row(n, "411000") == ("411000", "Clients", 0.0, 0.0, 6200.0, 0.0, 6200.0, 0.0)
+    totals = n.totals()
+    assert totals["closing_debit"] == totals["closing_credit"] == 16200.0
+
+    n1 = result.balances[2023]
+    assert len(n1) == 4
+    assert _row(n1, "706000") == ("706000", "Prestations", 0.0, 0.0, 0.0, 1200.0, 0.0, 1200.0)
+
+
+def test_read_fec_fiscal_year_follows_the_closing_month(monkeypatch):
+    monkeypatch.setattr(fec.settings, "FEC_FISCAL_YEAR_END_MONTH", 6)
+    result = fec.read_fec(_fec(
+        _line("VE", "30/06/2024", "706000", "Prestations", "0,00", "100,00"),
+        _line("VE", "01/07/2024", "706000", "Prestations", "0,00", "50,00"),
+    ))
+    assert result.years == [2025, 2024]
+    assert result.balances[2025].totals()["movement_credit"] == 50.0
+
+
+def test_read_fec_counts_each_invalid_line_once():
+    result = fec.read_fec(_fec(
+        _line("VE", "20240520", "706000", "Prestations", "0,00", "100,00"),
+        _line("VE", "date", "706000", "Prestations", "0,00", "100,00"),
+        _line("VE", "20240520", "706000", "Prestations", "abc", "0,00"),
+        "VE\tVentes\t1",
+    ), chunk_size=64)
+    assert (result.lines, result.skipped) == (1, 3)
+    assert result.balances[2024].totals()["movement_credit"] == 100.0
+
+
+def test_template_formulas_read_the_account_prefix_columns(model_path):
+    result = fec.read_fec(FEC)
+    balance_n = fec.to_xlsx(result.balances[2024], "Balance 2024 (FEC)")
+    balance_n1 = fec.to_xlsx(result.balances[2023], "Balance 2023 (FEC)")
+
+    evaluation = calculation.Evaluation(calculation.graph_for(template_cache.get(model_path)))
+    evaluation.update({"BAL N": ("n", lambda: balance_n), "BAL N-1": ("n-1", lambda: balance_n1)})
+
+    # BILAN PAYSAGE!K8 et L8: SOMME.SI sur les prefixes de 3 caracteres (colonne K) des comptes 101 a 104
+    assert evaluation.results[("BILAN PAYSAGE", 8, 11)] == 10000
+    assert evaluation.results[("BILAN PAYSAGE", 8, 12)] == 10000
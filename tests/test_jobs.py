@@ -0,0 +1,101 @@
+import threading
+import time
+
+import jobs
+
+TIMEOUT = 5
+
+
+class Gate:
+    """Action de tache qui note son demarrage puis attend d'etre liberee"""
+
+    def __init__(self, started):
+        self.started = started
+        self.release = threading.Event()
+
+    def __call__(self, job):
+        self.started.append(job.name)
+        assert self.release.wait(TIMEOUT)
+        return job.name
+
+
+def _submit(scheduler, name, started, memory=0):
+    gate = Gate(started)
+    return scheduler.submit(jobs.Job(name, gate, memory=memory)), gate
+
+
+def _wait(condition):
+    deadline = time.monotonic() + TIMEOUT
+    while not condition():
+        assert time.monotonic() < deadline, "delai depasse"
+        time.sleep(0.01)
+
+
+def test_jobs_are_admitted_in_submission_order():
+    scheduler = jobs.Scheduler(slots=1, memory_budget=100)
+    started = []
+    submitted = [_submit(scheduler, name, started) for name in ("a", "b", "c")]
+    _wait(lambda: started == ["a"])
+    assert [job.position for job, _ in submitted] == [0, 1, 2]
+
+    for index, (job, gate) in enumerate(submitted):
+        gate.release.set()
+        _wait(lambda: job.finished)
+        assert job.status == jobs.JOB_DONE and job.result == job.name
+        if index + 1 < len(submitted):
+            _wait(lambda: len(started) == index + 2)
+    assert started == ["a", "b", "c"]
+    assert scheduler.stats()["memory_used"] == 0
+
+
+def test_memory_budget_holds_back_the_head_of_the_queue():
+    scheduler = jobs.Scheduler(slots=3, memory_budget=100)
+    started = []
+    big, big_gate = _submit(scheduler, "big", started, memory=70)
+    _wait(lambda: started == ["big"])
+    # La tete de file ne tient pas dans le budget restant: la suivante attend derriere elle
+    large, large_gate = _submit(scheduler, "large", started, memory=50)
+    small, small_gate = _submit(scheduler, "small", started, memory=10)
+    time.sleep(0.1)
+    assert started == ["big"]
+    assert (large.position, small.position) == (1, 2)
+    assert scheduler.stats()["memory_used"] == 70
+
+    big_gate.release.set()
+    _wait(lambda: started == ["big", "large", "small"])
+    assert scheduler.stats()["memory_used"] == 60
+    large_gate.release.set()
+    small_gate.release.set()
+    _wait(lambda: large.finished and small.finished)
+    assert scheduler.stats()["memory_used"] == 0
+
+
+def test_job_larger_than_the_budget_runs_alone():
+    scheduler = jobs.Scheduler(slots=2, memory_budget=100)
+    started = []
+    huge, huge_gate = _submit(scheduler, "huge", started, memory=500)
+    _wait(lambda: started == ["huge"])
+    other, other_gate = _submit(scheduler, "other", started, memory=1)
+    time.sleep(0.1)
+    assert started == ["huge"] and other.position == 1
+
+    huge_gate.release.set()
+    other_gate.release.set()
+    _wait(lambda: huge.finished and other.finished)
+    assert started == ["huge", "other"]
+
+
+def test_cancelling_a_queued_job_frees_its_place():
+    scheduler = jobs.Scheduler(slots=1, memory_budget=100)
+    started = []
+    first, first_gate = _submit(scheduler, "first", started)
+    second, _ = _submit(scheduler, "second", started)
+    third, third_gate = _submit(scheduler, "third", started)
+    _wait(lambda: started == ["first"])
+
+    second.cancel()
+    assert second.status == jobs.JOB_CANCELLED and third.position == 1
+    first_gate.release.set()
+    third_gate.release.set()
+    _wait(lambda: third.finished)
+    assert started == ["first", "third"]
@@ -0,0 +1,52 @@
+import io
+
+import pytest
+from openpyxl import load_workbook
+
+from config import Config, ENGINE_OOXML, ENGINE_OPENPYXL
+from helpers import cell_values, style_differences
+from reporter import Reporter
+
+# Zone d'impression du modele sur des colonnes entieres, que openpyxl ne relit pas
+pytestmark = pytest.mark.filterwarnings("ignore:Print area cannot be set")
+
+
+def _integrate(engine, model_path, balances):
+    config = Config()
+    config.integration_engine = engine
+    reporter = Reporter()
+    assert config.load_excel(reporter, model_path)
+    assert config.load_excel(reporter, balances[0], 2) and config.load_excel(reporter, balances[1], 3)
+    assert config.add_balances_to_modele(reporter), reporter.errors
+    return load_workbook(io.BytesIO(config.get_excel_file_download(reporter)))
+
+
+@pytest.fixture(scope="module")
+def workbooks(model_path, balances):
+    return _integrate(ENGINE_OPENPYXL, model_path, balances), _integrate(ENGINE_OOXML, model_path, balances)
+
+
+def test_engines_produce_the_same_sheets(workbooks):
+    expected, actual = workbooks
+    assert actual.sheetnames == expected.sheetnames
+
+
+def test_engines_produce_the_same_cell_values(workbooks):
+    expected, actual = workbooks
+    for name in expected.sheetnames:
+        assert cell_values(actual[name]) == cell_values(expected[name]), name
+
+
+def test_engines_produce_the_same_styles(workbooks):
+    expected, actual = workbooks
+    for name in expected.sheetnames:
+        differences = style_differences(expected[name], actual[name])
+        assert not differences, (name, differences[:10])
+
+
+@pytest.mark.parametrize("name", ["BAL N", "BAL N-1"])
+def test_engines_copy_the_same_balance_layout(workbooks, name):
+    expected, actual = workbooks[0][name], workbooks[1][name]
+    assert sorted(map(str, actual.merged_cells.ranges)) == sorted(map(str, expected.merged_cells.ranges))
+    assert {k: d.width for k, d in actual.column_dimensions.items() if d.customWidth} == \
+        {k: d.width for k, d in expected.column_dimensions.items() if d.customWidth}
@@ -0,0 +1,76 @@
+import threading
+
+import sessions
+
+
+class FakeConfig:
+    """Session minimale: ce que SessionManager attend d'un Config"""
+
+    def __init__(self):
+        self.data = b"x" * 100
+
+    def memory_size(self):
+        return 100 if self.data is not None else 0
+
+    def is_busy(self):
+        return False
+
+    def spill_state(self):
+        return {"data": self.data}
+
+    def release_spilled(self):
+        self.data = None
+
+    def restore_spilled(self, state):
+        self.data = state["data"]
+
+
+def _manager(tmp_path):
+    # Budget nul et aucune duree d'inactivite: toute session deplacable l'est
+    return sessions.SessionManager(max_bytes=0, directory=str(tmp_path), idle_seconds=0, min_idle_seconds=0)
+
+
+def _settle(manager):
+    """Attend la fin du passage de fond d'enforce()"""
+    enforcer = manager._enforcer
+    if enforcer is not None:
+        enforcer.join()
+
+
+def test_touch_spills_other_sessions_in_the_background(tmp_path):
+    manager = _manager(tmp_path)
+    a, b = FakeConfig(), FakeConfig()
+    manager.touch(a)
+    manager.release(a)
+    _settle(manager)
+    manager.touch(b)
+    _settle(manager)
+    assert a.data is None and manager.stats()["on_disk"] == 1
+
+    manager.touch(a)
+    assert a.data == b"x" * 100
+    assert manager.stats()["rehydrations"] == 1
+
+
+def test_a_running_session_is_not_spilled(tmp_path):
+    manager = _manager(tmp_path)
+    a, b = FakeConfig(), FakeConfig()
+    started, finish = threading.Event(), threading.Event()
+
+    def rerun():
+        manager.touch(a)
+        started.set()
+        finish.wait()
+
+    thread = threading.Thread(target=rerun)
+    thread.start()
+    started.wait()
+    manager.touch(b)
+    _settle(manager)
+    assert a.data is not None
+
+    finish.set()
+    thread.join()
+    manager.touch(b)
+    _settle(manager)
+    assert a.data is None
@@ -0,0 +1,124 @@
+"""Miniatures des captures d'ecran des modeles.
+
+Chaque image de models_images/ est reduite une seule fois en plusieurs largeurs
+(settings.THUMBNAIL_WIDTHS), en WebP si Pillow le prend en charge, sinon en PNG.
+Les miniatures sont gardees sur disque (settings.THUMBNAIL_DIR) sous un nom qui
+contient la date de modification de l'image source, et en memoire pour tout le
+serveur: un rerun ne fait qu'un stat() par image.
+
+Usage (pre-generation pour tout le catalogue): python thumbnails.py
+"""
+import hashlib
+import io
+import json
+import logging
+import os
+
+from PIL import Image, features
+
+import settings
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+FORMAT = "WEBP" if features.check("webp") else "PNG"
+EXTENSION = "." + FORMAT.lower()
+
+# Miniatures deja lues, cle = (chemin, date de modification, largeur)
+_memory = LRUCache(max_bytes=settings.THUMBNAIL_CACHE_MAX_BYTES)
+
+
+def _stem(image_path):
+    """Prefixe des miniatures d'une image: nom lisible + empreinte du chemin complet"""
+    path = os.path.abspath(image_path)
+    name = os.path.splitext(os.path.basename(path))[0]
+    return "%s-%s" % (name, hashlib.sha1(path.encode("utf-8")).hexdigest()[:8])
+
+
+def thumbnail_path(image_path, mtime_ns, width):
+    return os.path.join(settings.THUMBNAIL_DIR, "%s-%d-%d%s" % (_stem(image_path), mtime_ns, width, EXTENSION))
+
+
+def _encode(image, width):
+    if image.width > width:
+        image = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+    output = io.BytesIO()
+    if FORMAT == "WEBP":
+        image.save(output, FORMAT, quality=settings.THUMBNAIL_QUALITY, method=4)
+    else:
+        image.save(output, FORMAT, optimize=True)
+    return output.getvalue()
+
+
+def generate(image_path, mtime_ns=None):
+    """Produit toutes les largeurs d'une image en une seule lecture; retourne {largeur: contenu}"""
+    if mtime_ns is None:
+        mtime_ns = os.stat(image_path).st_mtime_ns
+    with Image.open(image_path) as image:
+        image.load()
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "PA") else "RGB")
+        thumbnails = {width: _encode(image, width) for width in settings.THUMBNAIL_WIDTHS}
+
+    try:
+        os.makedirs(settings.THUMBNAIL_DIR, exist_ok=True)
+        stem = _stem(image_path) + "-"
+        # Miniatures d'une version precedente de l'image
+        for name in os.listdir(settings.THUMBNAIL_DIR):
+            if name.startswith(stem) and not name.startswith("%s%d-" % (stem, mtime_ns)):
+                os.remove(os.path.join(settings.THUMBNAIL_DIR, name))
+        for width, data in thumbnails.items():
+            path = thumbnail_path(image_path, mtime_ns, width)
+            with open(path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+    except OSError as e:
+        logger.warning("Miniatures non enregistrees (%s): %s", settings.THUMBNAIL_DIR, e)
+    for width, data in thumbnails.items():
+        _memory.put((os.path.abspath(image_path), mtime_ns, width), data, len(data))
+    return thumbnails
+
+
+def get_thumbnail(image_path, width=None):
+    """Contenu de la plus petite miniature d'au moins width pixels (la plus grande sinon)"""
+    widths = sorted(settings.THUMBNAIL_WIDTHS)
+    if width is not None:
+        width = next((w for w in widths if w >= width), widths[-1])
+    else:
+        width = widths[-1]
+    mtime_ns = os.stat(image_path).st_mtime_ns
+    key = (os.path.abspath(image_path), mtime_ns, width)
+    data = _memory.get(key)
+    if data is not None:
+        return data
+    try:
+        with open(thumbnail_path(image_path, mtime_ns, width), "rb") as f:
+            data = f.read()
+    except OSError:
+        return generate(image_path, mtime_ns)[width]
+    _memory.put(key, data, len(data))
+    return data
+
+
+def generate_catalog(models, image_folder):
+    """Produit les miniatures manquantes de toutes les images du catalogue; retourne leur nombre"""
+    count = 0
+    for model in models:
+        for image_name in model.get("imgs") or []:
+            image_path = os.path.join(image_folder, image_name)
+            if not os.path.exists(image_path):
+                logger.warning("Image non trouvee: %s", image_path)
+                continue
+            mtime_ns = os.stat(image_path).st_mtime_ns
+            if all(os.path.exists(thumbnail_path(image_path, mtime_ns, w)) for w in settings.THUMBNAIL_WIDTHS):
+                continue
+            generate(image_path, mtime_ns)
+            count += 1
+    return count
+
+
+if __name__ == "__main__":
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    with open("models.json") as m:
+        catalog = json.load(m)
+    print("%d image(s) traitee(s)" % generate_catalog(catalog, "models_images"))
@@ -0,0 +1,112 @@
+"""Prechauffage du serveur: modeles du catalogue prets avant la premiere session.
+
+Sans prechauffage, la premiere session qui integre des balances paie la
+lecture du modele par openpyxl (environ 1,5 s pour model_1.xlsx) et la
+construction du graphe de ses formules, et la premiere qui affiche les images
+d'un modele paie la production des miniatures. warm_up() fait ce travail une
+seule fois pour le processus:
+
+    - catalogue (models.json) et informations des fichiers modeles
+    - classeur de chaque modele parse dans template_cache (au plus
+      settings.TEMPLATE_CACHE_SIZE modeles) et graphe de ses formules
+    - correspondances comptes -> rubriques des modeles
+    - miniatures manquantes des images du catalogue
+
+Avec --serve, le prechauffage se fait avant le demarrage du serveur
+Streamlit, dans le meme processus: la premiere connexion trouve modeles et
+miniatures deja prets. Pour un serveur lance par "streamlit run",
+settings.WARMUP fait lancer start() par main.py au premier run du processus:
+la session n'attend pas, mais le prechauffage partage le processeur avec
+elle pendant qu'il tourne.
+
+Usage: python warmup.py [--serve [options de streamlit run]]
+"""
+import logging
+import os
+import sys
+import threading
+import time
+
+import calculation
+import mapping
+import settings
+import thumbnails
+from cache import template_cache
+from catalog import catalog
+
+logger = logging.getLogger(__name__)
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+IMAGE_FOLDER = "models_images"
+MAPPING_FOLDER = "models_mappings"
+
+_thread = None
+_lock = threading.Lock()
+
+
+def warm_up():
+    """Prepare les modeles et miniatures du catalogue; retourne la duree (s) et le nombre d'elements de chaque etape"""
+    report = {}
+    start = time.perf_counter()
+    catalog.refresh()
+    report["catalogue"] = {"duree": time.perf_counter() - start, "modeles": len(catalog.models)}
+
+    start = time.perf_counter()
+    templates = formulas = mappings = 0
+    # Au-dela de la taille du cache, les premiers modeles parses seraient evinces par les suivants
+    for model in catalog.models[:settings.TEMPLATE_CACHE_SIZE]:
+        path = catalog.template_path(model)
+        try:
+            template = template_cache.get(path)
+            template.load()
+            templates += 1
+            if settings.FORMULA_EVALUATION:
+                formulas += len(calculation.graph_for(template))
+            if model.get("mapping"):
+                mapping.load_mapping(os.path.join(MAPPING_FOLDER, model["mapping"]))
+                mappings += 1
+        except Exception as e:
+            logger.warning("Prechauffage du modele impossible (%s): %s", path, e)
+    report["modeles"] = {"duree": time.perf_counter() - start, "classeurs": templates, "formules": formulas,
+                         "correspondances": mappings}
+
+    start = time.perf_counter()
+    try:
+        images = thumbnails.generate_catalog(catalog.models, IMAGE_FOLDER)
+    except Exception as e:
+        logger.warning("Prechauffage des miniatures impossible: %s", e)
+        images = 0
+    report["miniatures"] = {"duree": time.perf_counter() - start, "images": images}
+    logger.info("Prechauffage termine: %s", report)
+    return report
+
+
+def start():
+    """Lance warm_up() en tache de fond, une seule fois par processus; retourne le thread"""
+    global _thread
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(target=warm_up, name="prechauffage", daemon=True)
+            _thread.start()
+        return _thread
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    os.chdir(APP_DIR)
+    report = warm_up()
+    for step, values in report.items():
+        details = ", ".join("%s %s" % (name, value) for name, value in values.items() if name != "duree")
+        print("%-11s %6.2fs  %s" % (step, values["duree"], details))
+    if argv[:1] == ["--serve"]:
+        from streamlit.web import cli
+
+        # Serveur lance dans ce processus: main.py y retrouve les caches deja remplis
+        settings.WARMUP = 0
+        sys.argv = ["streamlit", "run", os.path.join(APP_DIR, "main.py")] + argv[1:]
+        return cli.main()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())